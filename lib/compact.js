@@ -0,0 +1,89 @@
+// decoder of the compact binary export (data/data3.bin), see loader/compact.py for the layout
+const COMPACT_MAGIC = "VXCB";
+const COMPACT_VERSION = 1;
+const PREFIX_SIZE = 10; // magic, uint16 version, uint32 header length
+const LEAF_TYPES = ["null", "bool", "int", "float", "str"];
+
+const ARRAY_TYPES = {
+  "|b1": Uint8Array,
+  "<i1": Int8Array,
+  "<i2": Int16Array,
+  "<i4": Int32Array,
+  "<i8": BigInt64Array,
+  "<u1": Uint8Array,
+  "<u2": Uint16Array,
+  "<u4": Uint32Array,
+  "<u8": BigUint64Array,
+  "<f8": Float64Array,
+};
+
+// payload is an ArrayBuffer or a view of one, e.g. a Buffer from fs.readFileSync
+export function decodeCompact(payload) {
+  let bytes = ArrayBuffer.isView(payload)
+    ? new Uint8Array(payload.buffer, payload.byteOffset, payload.byteLength)
+    : new Uint8Array(payload);
+  if (bytes.byteOffset % 8 !== 0) {
+    // typed arrays need aligned offsets, copied to a new buffer
+    // (Buffer.prototype.slice would only give another view of the same memory)
+    bytes = new Uint8Array(bytes);
+  }
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  const magic = String.fromCharCode(...new Uint8Array(bytes.buffer, bytes.byteOffset, 4));
+  if (magic !== COMPACT_MAGIC) {
+    throw new Error("Not a compact export");
+  }
+  const version = view.getUint16(4, true);
+  if (version !== COMPACT_VERSION) {
+    throw new Error(`Compact export version ${version}, can read ${COMPACT_VERSION}`);
+  }
+  const headerLength = view.getUint32(6, true);
+  const header = JSON.parse(
+    new TextDecoder().decode(new Uint8Array(bytes.buffer, bytes.byteOffset + PREFIX_SIZE, headerLength))
+  );
+  const bodyStart = bytes.byteOffset + PREFIX_SIZE + headerLength;
+  const { keys, shapes, strings } = header;
+
+  // leaves are read back in the order they were written, one position per column
+  const columns = [];
+  for (const column of header.columns) {
+    const values = new ARRAY_TYPES[column.dtype](bytes.buffer, bodyStart + column.offset, column.length);
+    columns[column.shape] = columns[column.shape] || [];
+    columns[column.shape][column.slot] = { type: column.type, values, pos: 0 };
+  }
+
+  function leaf(parentId, slot) {
+    const column = columns[parentId][slot];
+    const value = column.values[column.pos++];
+    switch (column.type) {
+      case "bool":
+        return value !== 0;
+      case "str":
+        return strings[Number(value)];
+      default:
+        return typeof value === "bigint" ? Number(value) : value;
+    }
+  }
+
+  function build(shapeId, parentId, slot) {
+    if (shapeId < LEAF_TYPES.length) {
+      return LEAF_TYPES[shapeId] === "null" ? null : leaf(parentId, slot);
+    }
+    const shape = shapes[shapeId - LEAF_TYPES.length];
+    if (shape[0] === "d") {
+      const obj = {};
+      shape[1].forEach((keyId, keySlot) => {
+        obj[keys[keyId]] = build(shape[2][keySlot], shapeId, keySlot);
+      });
+      return obj;
+    }
+    const arr = [];
+    shape[1].forEach(([childId, runLength], runIdx) => {
+      for (let i = 0; i < runLength; i++) {
+        arr.push(build(childId, shapeId, runIdx));
+      }
+    });
+    return arr;
+  }
+
+  return build(header.root)[0];
+}
@@ -0,0 +1,88 @@
+// round trip of loader/compact.py output through decodeCompact, run with `npm test`
+import { test } from "node:test";
+import assert from "node:assert/strict";
+import { execFileSync } from "node:child_process";
+import fs from "node:fs";
+import os from "node:os";
+import path from "node:path";
+import { fileURLToPath } from "node:url";
+import { decodeCompact } from "./compact.js";
+
+const ROOT_PATH = path.join(path.dirname(fileURLToPath(import.meta.url)), "..");
+const PYTHON = process.env.PYTHON || "python3";
+
+const SAMPLE = {
+  by_state: Object.fromEntries(
+    ["Johor", "Kedah", "W.P. Kuala Lumpur"].map((stateName, idx) => [
+      stateName,
+      {
+        progress: {
+          full: 0.712,
+          partial: 0.05,
+          herd_days: -3 + idx,
+          full_dp: `${(71.2 + idx).toFixed(1)}%`,
+          is_rate_latest_incr: idx % 2 === 0,
+          herd_date_dp: null,
+        },
+        timeline: [
+          { name: "begin", n_count: 0 },
+          { name: "herd", n_count: 25000000 + idx },
+        ],
+      },
+    ])
+  ),
+  mixed: [1, 2, "a", null, true, 3.5, [], {}, [1, [2, [3]]], -(2 ** 40), 2 ** 52, "Pulau Pinang é"],
+  empty: {},
+};
+
+// encode with the loader, the same code that writes data/data3.bin
+function encodeCompact(jsonText) {
+  const tmpDir = fs.mkdtempSync(path.join(os.tmpdir(), "compact-"));
+  try {
+    const jsonPath = path.join(tmpDir, "data.json");
+    const binPath = path.join(tmpDir, "data.bin");
+    fs.writeFileSync(jsonPath, jsonText);
+    execFileSync(PYTHON, [path.join(ROOT_PATH, "loader", "compact.py"), jsonPath, binPath]);
+    return fs.readFileSync(binPath);
+  } finally {
+    fs.rmSync(tmpDir, { recursive: true, force: true });
+  }
+}
+
+test("decodes loader output of every leaf type and shape", () => {
+  const payload = encodeCompact(JSON.stringify(SAMPLE));
+  assert.deepEqual(decodeCompact(payload), SAMPLE);
+});
+
+test("decodes the export", () => {
+  const jsonText = fs.readFileSync(path.join(ROOT_PATH, "data", "data3.json"), "utf8");
+  assert.deepEqual(decodeCompact(encodeCompact(jsonText)), JSON.parse(jsonText));
+});
+
+test("decodes from an ArrayBuffer and from a misaligned view", () => {
+  const payload = encodeCompact(JSON.stringify(SAMPLE));
+  const arrayBuffer = payload.buffer.slice(payload.byteOffset, payload.byteOffset + payload.byteLength);
+  assert.deepEqual(decodeCompact(arrayBuffer), SAMPLE);
+
+  const shifted = new Uint8Array(payload.byteLength + 3);
+  shifted.set(payload, 3);
+  assert.deepEqual(decodeCompact(shifted.subarray(3)), SAMPLE);
+});
+
+test("decodes from a Buffer at an odd byteOffset", () => {
+  const payload = encodeCompact(JSON.stringify(SAMPLE));
+  const shifted = Buffer.concat([Buffer.alloc(3), payload]).subarray(3);
+  assert.notEqual(shifted.byteOffset % 8, 0);
+  assert.deepEqual(decodeCompact(shifted), SAMPLE);
+});
+
+test("rejects other formats and versions", () => {
+  const payload = new Uint8Array(encodeCompact(JSON.stringify(SAMPLE)));
+  const badMagic = payload.slice();
+  badMagic.set([88, 88, 88, 88], 0);
+  assert.throws(() => decodeCompact(badMagic), /Not a compact export/);
+
+  const badVersion = payload.slice();
+  new DataView(badVersion.buffer).setUint16(4, 99, true);
+  assert.throws(() => decodeCompact(badVersion), /version 99/);
+});
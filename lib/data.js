@@ -1,5 +1,6 @@
 import fs from "fs";
 import path from "path";
+import { decodeCompact } from "./compact";
 
 // const dataDirectory = path.join(process.cwd(), "data");
 
@@ -29,3 +30,44 @@ export function getAllData() {
   const obj = JSON.parse(fileContents);
   return obj;
 }
+
+// same data as getAllData, from the compact binary export written next to data3.json
+export function getCompactData() {
+  let basePath = process.cwd();
+  if (process.env.NODE_ENV === "production") {
+    basePath = path.join(process.cwd(), ".next/server/chunks");
+  }
+  const fullPath = path.join(basePath, "data/data3.bin");
+  return decodeCompact(fs.readFileSync(fullPath));
+}
+
+function readDataFile(fileName) {
+  let basePath = process.cwd();
+  if (process.env.NODE_ENV === "production") {
+    basePath = path.join(process.cwd(), ".next/server/chunks");
+  }
+  const fullPath = path.join(basePath, "data", fileName);
+  const fileContents = fs.readFileSync(fullPath, "utf8");
+  return JSON.parse(fileContents);
+}
+
+// sharded export: top_states, state and shard file per state
+export function getIndexData() {
+  return readDataFile("index.json");
+}
+
+// sharded export: by_state payload of a single state, e.g. getStateData("JHR")
+export function getStateData(stateAbbr) {
+  return readDataFile(path.join("by_state", `${stateAbbr}.json`));
+}
+
+// views served from memory by the loader data service (loader/serve.py),
+// e.g. fetchDataView("/by_state/JHR/adult") or fetchDataView("/top_states/adult")
+export async function fetchDataView(viewPath) {
+  const baseUrl = process.env.VAXAPP_DATA_URL || "http://127.0.0.1:8040";
+  const res = await fetch(`${baseUrl}${viewPath}`);
+  if (!res.ok) {
+    throw new Error(`Data service returned ${res.status} for ${viewPath}`);
+  }
+  return res.json();
+}
@@ -0,0 +1,206 @@
+import time
+import argparse
+import warnings
+import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import scriptv2
+from frame_cache import cache_key, load_frame, save_frame
+from sources import source_hashes
+from scriptv2 import (MILESTONE_TARGETS, POP_BANDS, ROLL_WINDOW, PFSN_DOSE_INT, AZ_DOSE_INT, LOADER_CACHE_PATH,
+                      vax_national_csv, vax_state_csv, static_pop)
+
+
+# projections further out are left empty, dates this far would overflow
+MAX_PROJECTION_DAYS = 365 * 100
+
+
+def target_name(target):
+    return f'{round(target * 100)}pct'
+
+
+def daily_windows(values, n_days):
+    """
+    (date x state) values to (date x state x n_days) windows ending on each date, in date order
+    Days before the first date are nan, same as days a state has no row for
+    """
+    padded = np.vstack([np.full((n_days - 1, values.shape[1]), np.nan), values])
+    return sliding_window_view(padded, n_days, axis=0)
+
+
+def pending_dose2(values, n_days):
+    """
+    Dose 1 of the last `n_days` as of every date, the (states x days) pending dose 2 matrix of
+    `rolling_state_stats` for all dates at once: days with rows first in date order, zero padded
+    """
+    windows = daily_windows(values, n_days)
+    has_row = ~np.isnan(windows)
+    order = np.argsort(~has_row, axis=-1, kind='stable')
+    return np.where(np.take_along_axis(has_row, order, axis=-1), np.take_along_axis(windows, order, axis=-1), 0)
+
+
+def rolling_rate(values, n_days=ROLL_WINDOW):
+    """Mean over the days with rows in the last `n_days` as of every date, nan if there are none"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # mean of no rows
+        return np.nanmean(daily_windows(values, n_days), axis=-1)
+
+
+def projected_dates(as_of, days_remaining):
+    """
+    `projected_target_date` for arrays of start dates and days remaining, NaT where there is no
+    projection in range (no dose 1 rate gives infinite days)
+    """
+    # microsecond resolution like timedelta(days=...)
+    offsets = np.round((days_remaining + 1) * 86400e6)
+    in_range = np.isfinite(offsets) & (offsets < MAX_PROJECTION_DAYS * 86400e6)
+    offsets = np.where(in_range, offsets, 0).astype('timedelta64[us]').astype('timedelta64[ns]')
+    return np.where(in_range, as_of + offsets, np.datetime64('NaT'))
+
+
+def hit_column(pop_level, target):
+    return f'{pop_level}_{target_name(target)}_hit'
+
+
+def as_of_frame(dfpop, use_cache=True, mmap=False):
+    """
+    What projections as of a (date_dt, state) row start from: dose 1 by vax type, dose 2 total of every
+    pop level and whether each target was hit by then. Target hits are first crossings, so a target
+    counts as hit from its hit date on. Cached like the prepared frames, keyed by vax CSVs, population,
+    regions, bands and targets, so repeated backfill and backtest runs skip reading and target hits
+    """
+    hashes = source_hashes([vax_national_csv, vax_state_csv])
+    key = cache_key(hashes[str(vax_national_csv)], hashes[str(vax_state_csv)], scriptv2.population_fingerprint(dfpop),
+                    scriptv2.regions_fingerprint(), POP_BANDS, MILESTONE_TARGETS)
+    dfasof = load_frame(LOADER_CACHE_PATH, 'as_of', key, mmap) if use_cache else None
+    if dfasof is not None:
+        return dfasof
+
+    dfvs = scriptv2.read_prepared_csv(vax_national_csv, vax_state_csv, dfpop, use_cache, mmap, hashes)
+    dfvs = scriptv2.add_vax_columns(dfvs, dfpop)
+    state_target_hits = scriptv2.find_target_hits(dfvs)
+    dfvs = dfvs.drop(scriptv2.hidden_states, level='state')
+
+    dfasof = dfvs[['pfsn1', 'astra1'] + [band['dose2'] for band in POP_BANDS.values()]].copy()
+    dates = dfasof.index.get_level_values('date_dt')
+    states = dfasof.index.get_level_values('state')
+    for pop_level in POP_BANDS:
+        for target in MILESTONE_TARGETS:
+            target_hits = {state_name: hits[target][0] for state_name, hits in state_target_hits[pop_level].items()
+                           if target in hits}
+            dfasof[hit_column(pop_level, target)] = dates >= pd.DatetimeIndex(states.map(target_hits))  # NaT never
+    if use_cache:
+        save_frame(LOADER_CACHE_PATH, 'as_of', key, dfasof)
+    return dfasof
+
+
+def prepare_backfill_data(dfasof, dfpop, pop_levels):
+    """
+    `as_of_frame` as (date x state) arrays on a daily calendar, nan on days a state has no row
+    Targets hit as (date x state x targets) per pop level
+    """
+    dfasof_wide = dfasof.unstack('state')
+    calendar = pd.date_range(dfasof_wide.index.min(), dfasof_wide.index.max())
+    dfasof_wide = dfasof_wide.reindex(calendar)
+    states = dfasof_wide['pfsn1'].columns
+
+    def wide(col):
+        return dfasof_wide[col].to_numpy(dtype=float)
+
+    return {
+        'calendar': calendar,
+        'states': states,
+        'pop_levels': pop_levels,
+        'pfsn1': wide('pfsn1'),
+        'astra1': wide('astra1'),
+        'pop': {pop_level: dfpop.loc[states, POP_BANDS[pop_level]['pop']].to_numpy(dtype=float)
+                for pop_level in pop_levels},
+        'dose2': {pop_level: wide(POP_BANDS[pop_level]['dose2']) for pop_level in pop_levels},
+        'is_hit': {pop_level: np.stack([wide(hit_column(pop_level, target)) == 1 for target in MILESTONE_TARGETS],
+                                       axis=-1)
+                   for pop_level in pop_levels},
+    }
+
+
+def as_of_rows(data, start_date=None):
+    """(date, state) indices of as of dates from `start_date` on where the state has a row"""
+    calendar = data['calendar']
+    return np.nonzero(~np.isnan(data['pfsn1']) & (calendar >= (start_date or calendar[0]))[:, None])
+
+
+def project_as_of(data, pop_level, as_of_idx, s_idx, pfsn_rate, az_rate, pfsn_dose2, az_dose2):
+    """
+    Target dates as of (date, state) rows given rates and pending dose 2 as (date x state [x days]) arrays,
+    all rows in one `project_days_to_targets` call. Hit targets get their hit date.
+    Returns (rows x targets) target dates and whether they were hit
+    """
+    as_of = data['calendar'].to_numpy()[as_of_idx]
+    days_remaining = scriptv2.project_days_to_targets(
+        MILESTONE_TARGETS, data['pop'][pop_level][s_idx], pfsn_rate[as_of_idx, s_idx], az_rate[as_of_idx, s_idx],
+        data['dose2'][pop_level][as_of_idx, s_idx], pfsn_dose2[as_of_idx, s_idx], az_dose2[as_of_idx, s_idx])
+    is_hit = data['is_hit'][pop_level][as_of_idx, s_idx]
+    target_dates = projected_dates(as_of[:, None], days_remaining)
+    return np.where(is_hit, realized_hit_dates(data, pop_level)[s_idx], target_dates), is_hit
+
+
+def realized_hit_dates(data, pop_level):
+    """(states x targets) date each target was first hit in the data, NaT if not yet"""
+    is_hit = data['is_hit'][pop_level]
+    return np.where(is_hit.any(axis=0), data['calendar'].to_numpy()[is_hit.argmax(axis=0)], np.datetime64('NaT'))
+
+
+def run_backfill(dfpop, pop_levels=['total', 'adult'], start_date=None, use_cache=True, mmap=False):
+    """
+    Rolling rates, pending dose 2, target hits and milestone projections as of every date in one pass
+    Inputs are unstacked once to (date x state) arrays on a daily calendar. Rates and pending dose 2
+    are sliding windows over them, the same numbers `rolling_state_stats` gives for the latest date, and
+    all (date, state) projections of a pop level are one `project_days_to_targets` call.
+    Returns table indexed by (as_of, state, pop_level) with the date of each target, hit or projected
+    """
+    data = prepare_backfill_data(as_of_frame(dfpop, use_cache, mmap), dfpop, pop_levels)
+    pfsn_rate, az_rate = rolling_rate(data['pfsn1']), rolling_rate(data['astra1'])
+    pfsn_dose2, az_dose2 = pending_dose2(data['pfsn1'], PFSN_DOSE_INT), pending_dose2(data['astra1'], AZ_DOSE_INT)
+    as_of_idx, s_idx = as_of_rows(data, start_date)
+
+    tables = []
+    for pop_level in pop_levels:
+        target_dates, is_hit = project_as_of(data, pop_level, as_of_idx, s_idx, pfsn_rate, az_rate, pfsn_dose2, az_dose2)
+        table = pd.DataFrame({
+            'as_of': data['calendar'][as_of_idx],
+            'state': data['states'][s_idx],
+            'pop_level': pop_level,
+            'avg_pfsn_rate': pfsn_rate[as_of_idx, s_idx],
+            'avg_az_rate': az_rate[as_of_idx, s_idx],
+            'pfsn_dose2_pending': pfsn_dose2[as_of_idx, s_idx].sum(axis=-1),
+            'az_dose2_pending': az_dose2[as_of_idx, s_idx].sum(axis=-1),
+            'dose2_total': data['dose2'][pop_level][as_of_idx, s_idx],
+        })
+        for t_idx, target in enumerate(MILESTONE_TARGETS):
+            table[f'{target_name(target)}_date'] = pd.DatetimeIndex(target_dates[:, t_idx]).normalize()
+            table[f'{target_name(target)}_hit'] = is_hit[:, t_idx]
+        tables.append(table)
+    return pd.concat(tables).set_index(['as_of', 'state', 'pop_level']).sort_index()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Milestone projections as of every past date')
+    parser.add_argument('--start', type=pd.Timestamp, default=None, help='first as of date, YYYY-MM-DD')
+    parser.add_argument('--levels', nargs='+', default=['total', 'adult'], choices=list(POP_BANDS))
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false')
+    parser.add_argument('-o', '--output', default='backfill.csv')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    dfpop = scriptv2.read_population(static_pop)
+    dfbackfill = run_backfill(dfpop, args.levels, args.start, args.use_cache)
+    dfbackfill.to_csv(args.output, date_format='%Y-%m-%d')
+    n_dates = dfbackfill.index.get_level_values('as_of').nunique()
+    print(f'{n_dates} dates, {len(dfbackfill)} rows written to {args.output} in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == "__main__":
+    main()
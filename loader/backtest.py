@@ -0,0 +1,154 @@
+import time
+import argparse
+import warnings
+import multiprocessing
+import pandas as pd
+import numpy as np
+
+import scriptv2
+from backfill import (as_of_frame, prepare_backfill_data, as_of_rows, project_as_of,
+                      realized_hit_dates, rolling_rate, pending_dose2, target_name)
+from scriptv2 import MILESTONE_TARGETS, POP_BANDS, ROLL_WINDOW, PROP_AZ, PFSN_DOSE_INT, AZ_DOSE_INT, static_pop
+
+
+# days from as of date to the realized hit, errors are summarized per bucket
+HORIZON_BINS = [0, 7, 14, 30, 60, 90, np.inf]
+HORIZON_LABELS = ['1-7', '8-14', '15-30', '31-60', '61-90', '90+']
+
+# backtest data shared with forked workers, set once by `run_backtest`
+BACKTEST_DATA = None
+
+
+def observed_rates(n_days):
+    """Mean pfizer/sinovac and AZ dose 1 of the last `n_days`, observed split"""
+    def estimate(data):
+        return rolling_rate(data['pfsn1'], n_days), rolling_rate(data['astra1'], n_days)
+    return estimate
+
+
+def prop_az_rates(n_days, prop_az=PROP_AZ):
+    """Mean dose 1 of the last `n_days` split into pfizer/sinovac and AZ by supply share `prop_az`"""
+    def estimate(data):
+        total_rate = rolling_rate(data['pfsn1'], n_days) + rolling_rate(data['astra1'], n_days)
+        return total_rate * (1 - prop_az), total_rate * prop_az
+    return estimate
+
+
+def ewm_rates(halflife):
+    """Exponentially weighted mean dose 1, days without rows skipped"""
+    def estimate(data):
+        return tuple(pd.DataFrame(data[col]).ewm(halflife=halflife, ignore_na=True).mean().to_numpy()
+                     for col in ['pfsn1', 'astra1'])
+    return estimate
+
+
+# rate estimator name -> function of backfill data giving (date x state) pfizer/sinovac and AZ rates
+# `current` is the model of the published projections
+ESTIMATORS = {'current': observed_rates(ROLL_WINDOW),
+              'prop_az': prop_az_rates(ROLL_WINDOW),
+              'mean_14d': observed_rates(14),
+              'mean_28d': observed_rates(28),
+              'last_day': observed_rates(1),
+              'ewm_7d': ewm_rates(7)}
+
+
+def backtest_errors(work_unit):
+    """
+    Projection errors of one (estimator, pop_level) work unit: for every as of row and target not hit by
+    then but hit later in the data, days between projected and realized hit date.
+    Targets not hit by the end of the data can't be scored and are left out, as are projections
+    with no date (no dose 1 rate)
+    """
+    estimator, pop_level = work_unit
+    data, as_of_idx, s_idx, pfsn_dose2, az_dose2 = BACKTEST_DATA
+    pfsn_rate, az_rate = ESTIMATORS[estimator](data)
+    target_dates, is_hit = project_as_of(data, pop_level, as_of_idx, s_idx, pfsn_rate, az_rate, pfsn_dose2, az_dose2)
+    realized_dates = realized_hit_dates(data, pop_level)[s_idx]
+
+    scored = ~is_hit & ~np.isnat(realized_dates)
+    row_idx, t_idx = np.nonzero(scored)
+    as_of = data['calendar'].to_numpy()[as_of_idx][row_idx]
+    projected = pd.DatetimeIndex(target_dates[row_idx, t_idx]).normalize()
+    realized = pd.DatetimeIndex(realized_dates[row_idx, t_idx])
+    horizon_days = (realized - as_of).days
+    return pd.DataFrame({
+        'estimator': estimator,
+        'pop_level': pop_level,
+        'state': data['states'][s_idx[row_idx]],
+        'target': np.array([target_name(target) for target in MILESTONE_TARGETS])[t_idx],
+        'as_of': as_of,
+        'horizon_days': horizon_days,
+        'horizon': pd.cut(horizon_days, HORIZON_BINS, labels=HORIZON_LABELS),
+        'error_days': (projected - realized).days,  # nan where no projection
+    }).dropna(subset=['error_days'])
+
+
+def summarize_errors(errors, by=['estimator', 'pop_level', 'state', 'target', 'horizon']):
+    """Error distribution per group: count, bias (mean error), mean absolute error and quantiles, in days"""
+    errors = errors.assign(abs_error_days=errors.error_days.abs())
+    grouped = errors.groupby(by, observed=True)
+    return pd.DataFrame({
+        'n': grouped.size(),
+        'bias': grouped.error_days.mean(),
+        'mae': grouped.abs_error_days.mean(),
+        'p10': grouped.error_days.quantile(0.1),
+        'median': grouped.error_days.median(),
+        'p90': grouped.error_days.quantile(0.9),
+    })
+
+
+def run_backtest(dfpop, estimators=list(ESTIMATORS), pop_levels=['total', 'adult'], start_date=None,
+                 processes=None, use_cache=True, mmap=False):
+    """
+    Score the milestone projections made as of every past date against when targets were actually hit
+    Projections as of a date only use data up to it (see backfill.py), so each row is the projection the
+    loader would have published that day with the given rate estimator. Data and pending dose 2 are
+    prepared once before forking, (estimator, pop_level) work units run over a process pool.
+    Returns table of errors, one row per estimator, pop level, state, target and as of date
+    """
+    global BACKTEST_DATA
+    data = prepare_backfill_data(as_of_frame(dfpop, use_cache, mmap), dfpop, pop_levels)
+    as_of_idx, s_idx = as_of_rows(data, start_date)
+    BACKTEST_DATA = (data, as_of_idx, s_idx,
+                     pending_dose2(data['pfsn1'], PFSN_DOSE_INT), pending_dose2(data['astra1'], AZ_DOSE_INT))
+
+    work_units = [(estimator, pop_level) for estimator in estimators for pop_level in pop_levels]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # zero rates project infinite days
+        if processes == 1:
+            results = list(map(backtest_errors, work_units))
+        else:
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                results = pool.map(backtest_errors, work_units)
+    return pd.concat(results, ignore_index=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Backtest milestone projections against realized target hits')
+    parser.add_argument('--estimators', nargs='+', default=list(ESTIMATORS), choices=list(ESTIMATORS),
+                        help='rate estimators to compare, `current` is the published model')
+    parser.add_argument('--levels', nargs='+', default=['total', 'adult'], choices=list(POP_BANDS))
+    parser.add_argument('--start', type=pd.Timestamp, default=None, help='first as of date, YYYY-MM-DD')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false')
+    parser.add_argument('--errors', default=None, help='also write every scored projection to this CSV')
+    parser.add_argument('-o', '--output', default='backtest.csv', help='error distributions per state, target and horizon')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    dfpop = scriptv2.read_population(static_pop)
+    errors = run_backtest(dfpop, args.estimators, args.levels, args.start, args.processes, args.use_cache)
+    if args.errors:
+        errors.to_csv(args.errors, index=False, date_format='%Y-%m-%d')
+    summarize_errors(errors).to_csv(args.output)
+    print(f'{len(errors)} projections scored in {time.perf_counter() - started:.1f}s, written to {args.output}')
+    # all states together, by horizon
+    overall = summarize_errors(errors, ['pop_level', 'horizon', 'estimator'])
+    print(overall[['n', 'bias', 'mae']].round(1).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import io
+import sys
+import json
+import time
+import argparse
+import warnings
+import platform
+import tempfile
+import subprocess
+import contextlib
+import tracemalloc
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from datetime import datetime
+
+import scriptv2
+from export import publish
+from schema import VAX_COLS, REG_COLS
+
+
+CITF_STATES = ['Johor', 'Kedah', 'Kelantan', 'Melaka', 'Negeri Sembilan', 'Pahang', 'Perak', 'Perlis',
+               'Pulau Pinang', 'Sabah', 'Sarawak', 'Selangor', 'Terengganu', 'W.P. Kuala Lumpur',
+               'W.P. Labuan', 'W.P. Putrajaya']
+START_DATE = '2021-02-24'
+
+
+def synthetic_states(n_states):
+    """The 16 CITF states, then numbered districts up to `n_states`"""
+    if n_states < len(CITF_STATES):
+        raise ValueError(f'need at least {len(CITF_STATES)} states for Klang Valley and national rows')
+    return CITF_STATES + [f'District {i:04d}' for i in range(len(CITF_STATES), n_states)]
+
+
+def generate_citf(out_dir, n_days, n_states, seed=0):
+    """
+    Write synthetic vaccination, registration and population CSVs with the CITF layout to `out_dir`
+    Dose 1 follows a saturating uptake curve per state, dose 2 follows dose 1 by 21 days
+    (pfizer/sinovac) or 63 days (AZ), children start after 150 days. Rows are sorted by date then state.
+    """
+    out_dir = Path(out_dir)
+    rng = np.random.default_rng(seed)
+    states = synthetic_states(n_states)
+    dates = pd.date_range(START_DATE, periods=n_days).strftime('%Y-%m-%d')
+    pops = rng.integers(90_000, 6_000_000, n_states)
+    t = np.arange(n_days)[:, None]
+
+    def lagged(x, lag):
+        return np.vstack([np.zeros((min(lag, n_days), n_states), dtype=x.dtype), x[:max(n_days - lag, 0)]])
+
+    # (days x states) daily doses
+    uptake = pops * 0.95 * (1 - np.exp(-t / rng.uniform(120, 300, n_states)))
+    dose1 = np.diff(uptake, axis=0, prepend=0) * rng.uniform(0.7, 1.3, (n_days, n_states))
+    pf1, sn1, az1, cn = [(dose1 * share).astype(np.int64) for share in [0.6, 0.3, 0.08, 0.02]]
+    pf2, sn2, az2 = lagged(pf1, 21), lagged(sn1, 21), lagged(az1, 63)
+    daily_partial = pf1 + sn1 + az1 + cn
+    daily_full = pf2 + sn2 + az2 + cn
+    daily_partial_child = (daily_partial * 0.1 * (t > 150)).astype(np.int64)
+    daily_full_child = lagged(daily_partial_child, 21)
+    vax = {'daily_partial': daily_partial, 'daily_full': daily_full, 'daily': daily_partial + daily_full - cn,
+           'daily_partial_child': daily_partial_child, 'daily_full_child': daily_full_child,
+           'cumul_partial': daily_partial.cumsum(0), 'cumul_full': daily_full.cumsum(0),
+           'cumul': (daily_partial + daily_full - cn).cumsum(0),
+           'cumul_partial_child': daily_partial_child.cumsum(0), 'cumul_full_child': daily_full_child.cumsum(0),
+           'pfizer1': pf1, 'pfizer2': pf2, 'sinovac1': sn1, 'sinovac2': sn2, 'astra1': az1, 'astra2': az2,
+           'cansino': cn, 'pending': np.zeros_like(cn)}
+
+    reg_total = np.minimum(uptake * 1.1 + pops * 0.05, pops * 0.97).astype(np.int64)
+    reg = {'total': reg_total, 'phase2': reg_total // 5, 'mysj': reg_total // 2, 'call': reg_total // 10,
+           'web': reg_total // 10, 'children': (reg_total * 0.1 * (t > 140)).astype(np.int64),
+           'elderly': reg_total // 6, 'comorb': reg_total // 8, 'oku': reg_total // 50}
+
+    def write(path, cols, values, with_state):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df = pd.DataFrame({'date': np.repeat(dates, n_states), 'state': np.tile(states, n_days)})
+        for col in cols:
+            df[col] = values[col].reshape(-1)
+        df.to_csv(path, index=False)
+        national = pd.DataFrame({'date': dates})
+        if with_state:
+            national['state'] = 'Malaysia'
+        for col in cols:
+            national[col] = values[col].sum(axis=1)
+        national.to_csv(path.with_name(path.name.replace('_state', '_malaysia')), index=False)
+
+    write(out_dir / 'vaccination' / 'vax_state.csv', VAX_COLS, vax, False)
+    write(out_dir / 'registration' / 'vaxreg_state.csv', REG_COLS, reg, True)
+
+    pop = pd.DataFrame({'state': ['Malaysia'] + states, 'idxs': range(n_states + 1),
+                        'pop': np.concatenate([[pops.sum()], pops])})
+    pop['pop_18'] = (pop['pop'] * 0.72).astype(np.int64)
+    pop['pop_60'] = (pop['pop'] * 0.1).astype(np.int64)
+    pop['pop_12'] = (pop['pop'] * 0.1).astype(np.int64)
+    (out_dir / 'static').mkdir(parents=True, exist_ok=True)
+    pop.to_csv(out_dir / 'static' / 'population.csv', index=False)
+    return out_dir
+
+
+def measure(stage_fn, repeat):
+    """Wall and CPU time over `repeat` runs, then one run under tracemalloc for peak allocation"""
+    wall, cpu = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        result = stage_fn()
+        wall.append(time.perf_counter() - wall_start)
+        cpu.append(time.process_time() - cpu_start)
+    tracemalloc.start()
+    stage_fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'wall_s_min': min(wall), 'wall_s_median': float(np.median(wall)),
+                    'cpu_s_median': float(np.median(cpu)), 'peak_mb': peak / 2**20}
+
+
+def bench_pipeline(data_dir, repeat=3):
+    """Time each loader stage on CITF-shaped data in `data_dir`, returns {stage: measurements}"""
+    data_dir = Path(data_dir)
+    vax_national_csv = data_dir / 'vaccination' / 'vax_malaysia.csv'
+    vax_state_csv = data_dir / 'vaccination' / 'vax_state.csv'
+    reg_national_csv = data_dir / 'registration' / 'vaxreg_malaysia.csv'
+    reg_state_csv = data_dir / 'registration' / 'vaxreg_state.csv'
+
+    dfpop = scriptv2.read_population(data_dir / 'static' / 'population.csv')
+    for state_name in dfpop.index:
+        scriptv2.state_abbr.setdefault(state_name, state_name.replace('District ', 'D'))
+
+    stages = {}
+    (latest_dfv, state_doses_data_byvax, state_target_hits, _), stages['preprocess_csv_vax'] = measure(
+        lambda: scriptv2.preprocess_csv(vax_national_csv, vax_state_csv, dfpop, use_cache=False), repeat)
+    (latest_dfr, _, _, _), stages['preprocess_csv_reg'] = measure(
+        lambda: scriptv2.preprocess_csv(reg_national_csv, reg_state_csv, dfpop, use_cache=False), repeat)
+
+    data_levels = ['total', 'adult']
+
+    def overall_progress():
+        # all bands and states in one pass, as in build_all_data
+        total_pop, total_reg = scriptv2.pop_level_totals(latest_dfv.index, dfpop, latest_dfr, data_levels)
+        return scriptv2.overall_progress_numbers(total_pop, total_reg, latest_dfv, data_levels)
+    progress, stages['calculate_overall_progress'] = measure(overall_progress, repeat)
+
+    def milestone_projections():
+        return [scriptv2.calculate_milestone_projections(
+            state_name, pop_level, progress['total_pop'][b_idx, s_idx], latest_dfv.avg_pfsn_rate[s_idx],
+            latest_dfv.avg_az_rate[s_idx], progress['latest_dose2_total'][b_idx, s_idx],
+            latest_dfv.pfsn_dose2[s_idx], latest_dfv.az_dose2[s_idx], latest_dfv.date_dt[s_idx],
+            state_target_hits[pop_level][state_name])
+            for b_idx, pop_level in enumerate(data_levels) for s_idx, state_name in enumerate(latest_dfv.index)]
+    _, stages['calculate_milestone_projections'] = measure(milestone_projections, repeat)
+
+    all_data, stages['summary_by_state'] = measure(lambda: scriptv2.build_all_data(
+        dfpop, latest_dfv, latest_dfr, state_doses_data_byvax, state_target_hits, data_levels), repeat)
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        def export():
+            # no manifest carried over between runs, so every run writes everything
+            manifest_path = Path(export_dir) / 'manifest.json'
+            manifest_path.unlink(missing_ok=True)
+            return publish(all_data, Path(export_dir) / 'data3.json', manifest_path, scriptv2.state_abbr, sharded=True)
+        _, stages['export'] = measure(export, repeat)
+    return stages
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark loader stages on synthetic CITF-shaped data')
+    parser.add_argument('--days', type=int, nargs='+', default=[365],
+                        help='days of history, e.g. 365 3650')
+    parser.add_argument('--states', type=int, nargs='+', default=[16],
+                        help='number of states/districts (min 16), e.g. 16 1000')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data-dir', default=Path(tempfile.gettempdir()) / 'vaxapp-bench',
+                        help='where synthetic data is generated, reused across runs of the same scale')
+    parser.add_argument('-o', '--output', default=None, help='results json, printed if not given')
+    args = parser.parse_args(argv)
+
+    results = {'commit': git_commit(), 'timestamp': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+               'repeat': args.repeat, 'runs': []}
+    for n_days in args.days:
+        for n_states in args.states:
+            data_dir = Path(args.data_dir) / f'{n_days}d-{n_states}s'
+            if not (data_dir / 'static' / 'population.csv').exists():
+                print(f'Generating {n_days} days x {n_states} states in {data_dir}', file=sys.stderr)
+                generate_citf(data_dir, n_days, n_states)
+            print(f'Benchmarking {n_days} days x {n_states} states', file=sys.stderr)
+            # pipeline progress prints and pandas warnings are not part of the benchmark
+            with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                stages = bench_pipeline(data_dir, args.repeat)
+            for stage, measurements in stages.items():
+                print(f'\t{stage:<34}{measurements["wall_s_median"]:>9.3f}s {measurements["peak_mb"]:>9.1f}MB', file=sys.stderr)
+            results['runs'].append({'days': n_days, 'states': n_states, 'stages': stages})
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=1))
+    else:
+        print(json.dumps(results, indent=1))
+
+
+if __name__ == "__main__":
+    main()
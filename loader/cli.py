@@ -0,0 +1,156 @@
+import sys
+import argparse
+from pathlib import Path
+
+# heavy modules (pandas, numpy, scriptv2) are imported by the subcommands that need them,
+# `check` runs on the standard library only
+from sources import SOURCE_MANIFEST_PATH, changed_sources, read_source_manifest
+
+
+EXIT_UNCHANGED = 3  # exit code when sources or output did not change, see load.sh
+
+
+def check(args):
+    """Compare source hashes against the last build, exits with EXIT_UNCHANGED if nothing changed"""
+    manifest = read_source_manifest()
+    if manifest is None:
+        print(f'No previous build recorded in {SOURCE_MANIFEST_PATH}')
+    else:
+        print(f"Last build: {manifest['built_at']}")
+    changed = changed_sources()
+    for path in changed:
+        print(f'Changed: {path}')
+    if not changed:
+        print('Sources unchanged')
+        return EXIT_UNCHANGED
+    return 0
+
+
+def build(args):
+    """Run the pipeline and publish, exits with EXIT_UNCHANGED if the output did not change"""
+    import logging
+    import instrument
+    import scriptv2
+    from schema import SchemaError
+
+    logger = logging.getLogger('loader')
+    logging.basicConfig(level=args.log_level, format='%(message)s')
+    # a published file deleted since the last build is written again even if sources are unchanged
+    export_path = Path(scriptv2.DATA_EXPORT_PATH)
+    outputs = [export_path, export_path.with_suffix('.bin')] + ([export_path.parent / 'index.json'] if args.sharded else [])
+    if args.if_changed and not changed_sources() and all(path.exists() for path in outputs):
+        logger.info('Sources unchanged')
+        return EXIT_UNCHANGED
+
+    instrument.start(args.trace_memory, args.profile is not None)
+    try:
+        _, changed_sections = scriptv2.build_and_publish(
+            args.incremental, args.use_cache, args.mmap, args.processes, args.sharded)
+    except SchemaError as e:
+        # before anything is computed from the bad file, the last export stays published
+        logger.error(f'Build stopped, {e}')
+        return 1
+    finally:
+        # failed runs keep their profile and the records of the stages they got through
+        instrument.stop(args.profile)
+        if args.report:
+            instrument.write_report(args.report)
+
+    for record in instrument.slowest('summary_by_state'):
+        logger.info(f"Slowest state: {record['state']} ({record['pop_level']}) {record['wall_s']:.3f}s")
+
+    if not changed_sections:
+        logger.info('No changes in output')
+        return EXIT_UNCHANGED
+    logger.info(f'{len(changed_sections)} sections changed')
+    return 0
+
+
+def sweep(args):
+    import sweep
+    sweep.main(args.args)
+    return 0
+
+
+def backfill(args):
+    import backfill
+    backfill.main(args.args)
+    return 0
+
+
+def backtest(args):
+    import backtest
+    backtest.main(args.args)
+    return 0
+
+
+def timeseries(args):
+    import timeseries
+    return timeseries.main(args.args)
+
+
+def bench(args):
+    import bench
+    bench.main(args.args)
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Vax progress loader')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_check = subparsers.add_parser('check', help='check whether CITF sources changed since the last build')
+    parser_check.set_defaults(run=check)
+
+    parser_build = subparsers.add_parser('build', help='build vax progress data from CITF CSVs and publish it')
+    parser_build.set_defaults(run=build)
+    parser_build.add_argument('--if-changed', action='store_true',
+                              help='skip the build if sources did not change since the last one')
+    parser_build.add_argument('--incremental', action='store_true',
+                              help='only process rows appended since the last run, full rebuild if history changed')
+    parser_build.add_argument('--no-cache', dest='use_cache', action='store_false',
+                              help='always parse CSVs instead of using the prepared frame cache')
+    parser_build.add_argument('--mmap', action='store_true',
+                              help='memory-map cached frames instead of reading them')
+    parser_build.add_argument('--processes', type=int, default=1,
+                              help='worker processes for per state summaries, output is the same for any count')
+    parser_build.add_argument('--sharded', action='store_true',
+                              help='also export each state to data/by_state/<abbr>.json with a data/index.json')
+    parser_build.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                              help='DEBUG shows per state progress, target hits and projections')
+    parser_build.add_argument('--report', default=None,
+                              help='append per stage timings of this run to a JSON-lines file')
+    parser_build.add_argument('--trace-memory', action='store_true',
+                              help='record peak allocation per stage with tracemalloc, slows the run down')
+    parser_build.add_argument('--profile', default=None,
+                              help='write cProfile stats of the whole run to this file')
+
+    # options of sweep, backfill, backtest, timeseries and bench are passed on to their modules
+    parser_sweep = subparsers.add_parser('sweep', help='what-if milestone projections, see sweep.py', add_help=False)
+    parser_sweep.set_defaults(run=sweep)
+    parser_backfill = subparsers.add_parser('backfill', help='projections as of every past date, see backfill.py',
+                                            add_help=False)
+    parser_backfill.set_defaults(run=backfill)
+    parser_backtest = subparsers.add_parser('backtest', help='score past projections against realized target hits, '
+                                            'see backtest.py', add_help=False)
+    parser_backtest.set_defaults(run=backtest)
+    parser_timeseries = subparsers.add_parser('timeseries', help='query daily history of any state and column, '
+                                              'see timeseries.py', add_help=False)
+    parser_timeseries.set_defaults(run=timeseries)
+    parser_bench = subparsers.add_parser('bench', help='benchmark loader stages, see bench.py', add_help=False)
+    parser_bench.set_defaults(run=bench)
+
+    args, extra_args = parser.parse_known_args(argv)
+    args.args = extra_args
+    if args.args and args.command not in ['sweep', 'backfill', 'backtest', 'timeseries', 'bench']:
+        parser.error(f"unrecognized arguments: {' '.join(args.args)}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import sys
+import json
+import gzip
+import struct
+import numpy as np
+
+
+# compact binary export, see encode_compact for the layout
+COMPACT_MAGIC = b'VXCB'
+COMPACT_VERSION = 1
+PREFIX = struct.Struct('<4sHI')  # magic, format version, header length
+ALIGN = 8
+
+# leaf shapes have fixed ids, containers are numbered after them
+LEAF_TYPES = ['null', 'bool', 'int', 'float', 'str']
+
+
+def leaf_type(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, str):
+        return 'str'
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def int_dtype(values, signed=True):
+    """Smallest little-endian int dtype holding all `values`"""
+    lo, hi = (min(values), max(values)) if values else (0, 0)
+    for size in [1, 2, 4, 8]:
+        info = np.iinfo(f'{"i" if signed else "u"}{size}')
+        if info.min <= lo and hi <= info.max:
+            return f'<{"i" if signed else "u"}{size}'
+    raise OverflowError(f'{lo}..{hi} does not fit 64 bits')
+
+
+def encode_compact(data):
+    """
+    Columnar binary form of JSON-like `data`, e.g. export data
+    Records of the same shape (keys and value types) share one schema entry, so key names are stored
+    once instead of per state and level. Scalars of the same field across all records go into one
+    typed array: ints in the smallest int type, floats as float64, bools as bytes, strings as indices
+    into one table of distinct strings. Layout, little-endian:
+        magic 'VXCB', uint16 format version, uint32 header length
+        header: JSON with keys, shapes, strings and columns (dtype, offset, length), padded to 8 bytes
+        body: column arrays, each at an 8 byte aligned offset from the body start
+    `decode_compact` gives back data equal to `data`, JSON output included
+    """
+    keys, key_ids = [], {}
+    shapes, shape_ids = [], {}
+    strings, string_ids = [], {}
+    columns = {}  # (container shape, slot) -> [leaf type, values]
+
+    def intern(table, table_ids, value):
+        if value not in table_ids:
+            table_ids[value] = len(table)
+            table.append(value)
+        return table_ids[value]
+
+    def shape_of(value):
+        """Shape tree: (shape id, child shape trees)"""
+        if isinstance(value, dict):
+            for key in value:
+                if not isinstance(key, str):
+                    raise TypeError(f'keys must be str, not {type(key).__name__}')
+            children = [shape_of(child) for child in value.values()]
+            shape = ('d', tuple(intern(keys, key_ids, key) for key in value),
+                     tuple(child[0] for child in children))
+        elif isinstance(value, (list, tuple)):
+            children = [shape_of(child) for child in value]
+            runs = []  # run-length encoded element shapes
+            for child in children:
+                if runs and runs[-1][0] == child[0]:
+                    runs[-1][1] += 1
+                else:
+                    runs.append([child[0], 1])
+            shape = ('l', tuple(tuple(run) for run in runs))
+        else:
+            return LEAF_TYPES.index(leaf_type(value)), None
+        return len(LEAF_TYPES) + intern(shapes, shape_ids, shape), children
+
+    def collect(value, tree):
+        """Append leaf values to their columns, in the order `decode_compact` reads them"""
+        shape_id, children = tree
+        if children is None:
+            return
+        slots = range(len(children)) if isinstance(value, dict) else run_slots(shapes[shape_id - len(LEAF_TYPES)])
+        for slot, child, child_tree in zip(slots, value.values() if isinstance(value, dict) else value, children):
+            if child_tree[1] is None:
+                if child is not None:
+                    columns.setdefault((shape_id, slot), [leaf_type(child), []])[1].append(child)
+            else:
+                collect(child, child_tree)
+
+    # root wrapped in a list, so a scalar root has a column too
+    tree = shape_of([data])
+    collect([data], tree)
+
+    header_columns, body = [], bytearray()
+    for (shape_id, slot), (col_type, values) in columns.items():
+        if col_type == 'str':
+            values = [intern(strings, string_ids, value) for value in values]
+            dtype = int_dtype(values, signed=False)
+        elif col_type == 'int':
+            dtype = int_dtype(values)
+        else:
+            dtype = {'bool': '|b1', 'float': '<f8'}[col_type]
+        body.extend(b'\0' * (-len(body) % ALIGN))
+        header_columns.append({'shape': shape_id, 'slot': slot, 'type': col_type, 'dtype': dtype,
+                               'offset': len(body), 'length': len(values)})
+        body.extend(np.asarray(values, dtype=dtype).tobytes())
+
+    header = json.dumps({
+        'version': COMPACT_VERSION,
+        'root': tree[0],
+        'keys': keys,
+        'shapes': [list(shape) for shape in shapes],
+        'strings': strings,
+        'columns': header_columns,
+    }, separators=(',', ':')).encode()
+    header += b' ' * (-(PREFIX.size + len(header)) % ALIGN)
+    return PREFIX.pack(COMPACT_MAGIC, COMPACT_VERSION, len(header)) + header + bytes(body)
+
+
+def run_slots(shape):
+    """Column slot of each element of a list shape: its run"""
+    return [run_idx for run_idx, (_, run_len) in enumerate(shape[1]) for _ in range(run_len)]
+
+
+def decode_compact(payload):
+    """Data from `encode_compact` bytes, raises ValueError on other formats or versions"""
+    magic, version, header_len = PREFIX.unpack_from(payload)
+    if magic != COMPACT_MAGIC:
+        raise ValueError('not a compact export')
+    if version != COMPACT_VERSION:
+        raise ValueError(f'compact export version {version}, can read {COMPACT_VERSION}')
+    header = json.loads(payload[PREFIX.size:PREFIX.size + header_len])
+    body_start = PREFIX.size + header_len
+    keys, shapes, strings = header['keys'], header['shapes'], header['strings']
+
+    # one iterator per column, leaves are read in the order they were written
+    columns = {}
+    for column in header['columns']:
+        values = np.frombuffer(payload, dtype=column['dtype'], count=column['length'],
+                               offset=body_start + column['offset']).tolist()
+        if column['type'] == 'str':
+            values = [strings[idx] for idx in values]
+        columns[(column['shape'], column['slot'])] = iter(values)
+
+    def build(shape_id, parent_id=None, slot=None):
+        if shape_id < len(LEAF_TYPES):
+            return None if LEAF_TYPES[shape_id] == 'null' else next(columns[(parent_id, slot)])
+        shape = shapes[shape_id - len(LEAF_TYPES)]
+        if shape[0] == 'd':
+            return {keys[key_id]: build(child_id, shape_id, slot)
+                    for slot, (key_id, child_id) in enumerate(zip(shape[1], shape[2]))}
+        return [build(child_id, shape_id, run_idx)
+                for run_idx, (child_id, run_len) in enumerate(shape[1]) for _ in range(run_len)]
+
+    return build(header['root'])[0]
+
+
+def main(argv=None):
+    """
+    Encode a JSON export, check that it decodes back to the same JSON and compare sizes
+    With a second path, the compact form is also written there, e.g. for the JS decoder tests
+    """
+    json_path, *out_path = argv or sys.argv[1:]
+    with open(json_path) as fp:
+        body = fp.read()
+    payload = encode_compact(json.loads(body))
+    if json.dumps(decode_compact(payload)) != json.dumps(json.loads(body)):
+        print('Round trip mismatch')
+        return 1
+    if out_path:
+        with open(out_path[0], 'wb') as fp:
+            fp.write(payload)
+    print(f'json {len(body):,} B ({len(gzip.compress(body.encode())):,} gzip), '
+          f'compact {len(payload):,} B ({len(gzip.compress(payload)):,} gzip)')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
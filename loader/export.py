@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+
+from compact import encode_compact
+
+
+def write_atomic(path, content):
+    """
+    Write text or bytes to a temp file next to `path` and rename it over `path`
+    Readers see either the old or the new file, never a half-written one
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(content, bytes) else 'w') as fp:
+            fp.write(content)
+        os.chmod(tmp_path, 0o644)  # mkstemp files are owner-only
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_if_changed(path, content):
+    """Atomically write `content` unless the file already holds it, returns True if written"""
+    path = Path(path)
+    if path.exists() and path.read_text() == content:
+        return False
+    write_atomic(path, content)
+    return True
+
+
+def hash_section(section_data):
+    """Stable content hash of one section, independent of dict key order"""
+    return hashlib.sha1(json.dumps(section_data, sort_keys=True).encode()).hexdigest()
+
+
+def section_hashes(all_data):
+    """
+    Hash each logical section of export data: every state's progress, timeline and doses_byvax
+    and the top_states and state ranking lists
+    """
+    hashes = {}
+    for state_name, state_data in all_data['by_state'].items():
+        for section, section_data in state_data.items():
+            hashes[f'by_state/{state_name}/{section}'] = hash_section(section_data)
+    for section in ['top_states', 'state']:
+        hashes[section] = hash_section(all_data[section])
+    return hashes
+
+
+def export_sharded(all_data, export_dir, state_abbr, changed_sections=None):
+    """
+    Write each state's `by_state` payload to `by_state/<abbr>.json` and a small `index.json`
+    with `top_states`, `state` and the shard file of each state
+    Each shard is serialized on its own. Without `changed_sections`, shards whose content did not
+    change are not rewritten; with it, only shards with a changed section are serialized at all.
+    Returns list of files written
+    """
+    export_dir = Path(export_dir)
+    written = []
+    shards = {}
+    for state_name, state_data in all_data['by_state'].items():
+        shard_path = Path('by_state') / f'{state_abbr[state_name]}.json'
+        shards[state_name] = str(shard_path)
+        if changed_sections is not None:
+            if (export_dir / shard_path).exists() and \
+                    not any(section.startswith(f'by_state/{state_name}/') for section in changed_sections):
+                continue
+            write_atomic(export_dir / shard_path, json.dumps(state_data))
+            written.append(shard_path)
+        elif write_if_changed(export_dir / shard_path, json.dumps(state_data)):
+            written.append(shard_path)
+
+    index_data = {
+        'top_states': all_data['top_states'],
+        'state': all_data['state'],
+        'shards': shards,
+    }
+    if write_if_changed(export_dir / 'index.json', json.dumps(index_data)):
+        written.append(Path('index.json'))
+    return written
+
+
+def publish(all_data, export_path, manifest_path, state_abbr, sharded=False):
+    """
+    Write export data only where it changed since the last run
+    Section hashes are compared against the manifest of the previous run; the full export file,
+    its compact binary form (same name, .bin, see compact.py) and shards are only rewritten if one of
+    their sections changed or the file is missing
+    Returns set of changed sections and files written because they were missing, empty if nothing changed
+    """
+    export_path, manifest_path = Path(export_path), Path(manifest_path)
+    compact_path = export_path.with_suffix('.bin')
+    prev_hashes = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    hashes = section_hashes(all_data)
+    changed_sections = {section for section in hashes.keys() | prev_hashes.keys()
+                        if hashes.get(section) != prev_hashes.get(section)}
+
+    # a file rewritten because it was missing counts as a change, so it gets committed
+    missing = {path.name for path in [export_path, compact_path] if not path.exists()}
+    if changed_sections or export_path.name in missing:
+        write_atomic(export_path, json.dumps(all_data))
+    if changed_sections or compact_path.name in missing:
+        write_atomic(compact_path, encode_compact(all_data))
+    changed_sections |= missing
+    if sharded:
+        changed_sections |= {str(path) for path in export_sharded(
+            all_data, export_path.parent, state_abbr, changed_sections)}
+    if changed_sections:
+        write_atomic(manifest_path, json.dumps(hashes, indent=1, sort_keys=True))
+    return changed_sections
@@ -0,0 +1,86 @@
+import os
+import json
+import shutil
+import hashlib
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+
+CACHE_VERSION = 2
+
+
+def cache_key(*parts):
+    """
+    Hash of fingerprints, e.g. source file digests from `sources.source_hashes`
+    Any change to a source file gives a new key, files are not read again here
+    """
+    key = hashlib.sha1(f'v{CACHE_VERSION}'.encode())
+    for part in parts:
+        key.update(str(part).encode())
+    return key.hexdigest()
+
+
+def save_frame(cache_dir, name, key, df):
+    """
+    Store frame as one .npy file per column and index level under `cache_dir/name-key`
+    String columns are stored as fixed width unicode so every file stays memory-mappable, categorical
+    ones as their codes plus a file of categories
+    Older entries with the same name are removed
+    """
+    entry_dir = Path(cache_dir) / f'{name}-{key}'
+    tmp_dir = entry_dir.with_name(entry_dir.name + '.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    meta = {'columns': [], 'index': []}
+    arrays = [('columns', col, df[col]) for col in df.columns] + \
+        [('index', level, df.index.get_level_values(level)) for level in df.index.names]
+    for i, (kind, label, values) in enumerate(arrays):
+        values = pd.Series(values)
+        is_str = values.dtype == object
+        item = {'name': label, 'file': f'{i}.npy', 'str': bool(is_str)}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            item['categories'] = f'{i}.categories.npy'
+            np.save(tmp_dir / item['categories'], values.cat.categories.to_numpy(dtype=str))
+            values = values.cat.codes.to_numpy()
+        elif is_str:
+            # nan kept as empty string
+            values = values.where(values.notna(), '').to_numpy(dtype=str)
+        else:
+            values = values.to_numpy()
+        np.save(tmp_dir / item['file'], values)
+        meta[kind].append(item)
+
+    with open(tmp_dir / 'meta.json', 'w') as fp:
+        json.dump(meta, fp)
+    for old_dir in Path(cache_dir).glob(f'{name}-*'):
+        if old_dir != tmp_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def load_frame(cache_dir, name, key, mmap=False):
+    """
+    Load frame saved by `save_frame`, None on cache miss
+    With `mmap`, numeric columns are mapped copy-on-write instead of read into memory
+    """
+    entry_dir = Path(cache_dir) / f'{name}-{key}'
+    if not (entry_dir / 'meta.json').exists():
+        return None
+    with open(entry_dir / 'meta.json') as fp:
+        meta = json.load(fp)
+
+    def read_array(item):
+        values = np.load(entry_dir / item['file'], mmap_mode='c' if mmap else None)
+        if 'categories' in item:
+            return pd.Categorical.from_codes(values, np.load(entry_dir / item['categories']).astype(object))
+        if item['str']:
+            values = values.astype(object)
+            values[values == ''] = np.nan
+        return values
+
+    index = pd.MultiIndex.from_arrays([read_array(item) for item in meta['index']],
+                                      names=[item['name'] for item in meta['index']])
+    return pd.DataFrame({item['name']: read_array(item) for item in meta['columns']},
+                        index=index, copy=False)
@@ -0,0 +1,89 @@
+import json
+import time
+import cProfile
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+
+
+# stage records of the current run, in completion order
+RUN_RECORDS = []
+RUN_ID = datetime.now().isoformat(timespec='seconds')
+
+# open stages, innermost last, to carry tracemalloc peaks up to enclosing stages
+_open_stages = []
+_profiler = None
+
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Record wall time, CPU time and peak traced allocation of the enclosed block
+    `fields` (state, pop_level ...) are stored with the record, and more can be set on the
+    yielded dict, e.g. rows processed. Peak is only recorded while tracemalloc is tracing.
+    """
+    record = dict(run_id=RUN_ID, stage=name, **fields)
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        if _open_stages:
+            _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    _open_stages.append({'peak': 0, 'record': record})
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall_start, 6)
+        record['cpu_s'] = round(time.process_time() - cpu_start, 6)
+        peak = _open_stages.pop()['peak']
+        if tracing and tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            record['peak_mb'] = round(peak / 2**20, 3)
+            if _open_stages:
+                _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+        RUN_RECORDS.append(record)
+
+
+def annotate(**fields):
+    """Add fields such as row counts to the innermost open stage record"""
+    if _open_stages:
+        _open_stages[-1]['record'].update(fields)
+
+
+def start(trace_memory=False, profile=False):
+    """Optionally start tracemalloc for peak allocation per stage and cProfile for the whole run"""
+    global _profiler
+    if trace_memory:
+        tracemalloc.start()
+    if profile:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def stop(profile_path=None):
+    """Stop tracing and profiling, profile stats are dumped to `profile_path` for pstats/snakeviz"""
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        if profile_path:
+            _profiler.dump_stats(profile_path)
+        _profiler = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def slowest(stage_name, n=3):
+    """Records of a stage with the highest wall time"""
+    records = [record for record in RUN_RECORDS if record['stage'] == stage_name]
+    return sorted(records, key=lambda record: record['wall_s'], reverse=True)[:n]
+
+
+def write_report(report_path):
+    """Append this run's stage records to a JSON-lines report, one record per line"""
+    report_path = Path(report_path)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'a') as fp:
+        for record in RUN_RECORDS:
+            fp.write(json.dumps(record) + '\n')
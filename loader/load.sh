@@ -24,12 +24,24 @@ then
     cd $VAXAPP_PATH
     git pull
     source $PYTHON_ENV
-    python "$VAXAPP_PATH/scriptv2.py"
+    python "$VAXAPP_PATH/cli.py" build --incremental --if-changed --sharded
+    LOADER_STATUS=$?
     deactivate
 
-    echo "[INFO]    Commit data.json and git push to master branch.."
+    # cli.py exits with 3 (EXIT_UNCHANGED) when the sources or the output did not change
+    if [ $LOADER_STATUS -eq 3 ]
+    then
+        echo "[INFO]    Output unchanged. Skip commit. Exiting..."
+        exit 0
+    elif [ $LOADER_STATUS -ne 0 ]
+    then
+        echo "[ERROR]   Loader script failed with status $LOADER_STATUS"
+        exit $LOADER_STATUS
+    fi
+
+    echo "[INFO]    Commit data3.json, data3.bin, per state shards and git push to master branch.."
     cd $VAXAPP_PATH
-    git add ../data/data3.json
+    git add ../data/data3.json ../data/data3.bin ../data/index.json ../data/by_state
     git commit -m "citf update for today"
     git push
 
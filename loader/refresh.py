@@ -0,0 +1,165 @@
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import instrument
+import scriptv2
+from sources import ROOT_PATH, SOURCE_FILES, root_folder
+from scriptv2 import DATA_EXPORT_PATH
+
+
+logger = logging.getLogger('loader.refresh')
+
+VAXAPP_PATH = ROOT_PATH / 'vaxapp-prod'
+PUSH_RETRY_INTERVAL = 60  # seconds between attempts after a failed commit or push
+
+
+def source_stats(paths=SOURCE_FILES):
+    """(mtime, size) of each source file the pipeline reads, None for missing ones"""
+    stats = {}
+    for path in paths:
+        try:
+            stat = path.stat()
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stats[path] = None
+    return stats
+
+
+async def run_git(repo_path, *git_args, check=True):
+    """Run a git command without blocking the loop, returns exit code. Failures are logged if `check`"""
+    proc = await asyncio.create_subprocess_exec(
+        'git', '-C', str(repo_path), *git_args,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    output, _ = await proc.communicate()
+    if check and proc.returncode != 0:
+        logger.warning(f'git {" ".join(git_args)} failed ({proc.returncode}): {output.decode().strip()}')
+    return proc.returncode
+
+
+async def pull_upstream(checkout_path, interval):
+    """Fast-forward the CITF checkout every `interval` seconds, the file watch picks up new data"""
+    while True:
+        await run_git(checkout_path, 'pull', '--ff-only', '--quiet')
+        await asyncio.sleep(interval)
+
+
+async def push_export(repo_path, export_path=DATA_EXPORT_PATH, sharded=False):
+    """
+    Commit and push the export, its compact form and the state shards and index if built, like load.sh does
+    Nothing is committed when the changes were committed before and only the push failed
+    Returns True once pushed
+    """
+    export_path = Path(export_path)
+    export_paths = [export_path, export_path.with_suffix('.bin')]
+    if sharded:
+        export_paths += [export_path.parent / 'index.json', export_path.parent / 'by_state']
+    if await run_git(repo_path, 'add', *map(str, export_paths)) != 0:
+        return False
+    # exits with 1 if anything is staged
+    if await run_git(repo_path, 'diff', '--cached', '--quiet', check=False) != 0 and \
+            await run_git(repo_path, 'commit', '--quiet', '-m', 'citf update for today') != 0:
+        return False
+    return await run_git(repo_path, 'push', '--quiet') == 0
+
+
+def build_once(build_args):
+    """Pipeline run for the executor thread, stage records are logged and dropped after each run"""
+    instrument.RUN_RECORDS.clear()
+    started = time.perf_counter()
+    all_data, changed_sections = scriptv2.build_and_publish(**build_args)
+    logger.info(f'Built in {time.perf_counter() - started:.1f}s, {len(changed_sections)} sections changed')
+    return all_data, changed_sections
+
+
+def update_service(service, all_data):
+    """Swap in views of a new build, for the executor thread: serializing and compressing them is slow"""
+    service.update(all_data)
+    service.load_timeseries()
+
+
+async def refresh_loop(build_args, poll_interval=2, debounce=10, push=False, service=None):
+    """
+    Watch source files and rebuild once they stop changing for `debounce` seconds, so a burst of
+    upstream commits or a pull writing several files gives one rebuild. The pipeline runs in a worker
+    thread in this process, imports and the frame cache stay warm between runs. The views served are
+    rebuilt in the same thread, so the loop keeps polling and pulling meanwhile.
+    Builds once at start. A failed push is logged and retried every PUSH_RETRY_INTERVAL seconds.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    built_stats = None
+    is_push_pending, last_push = False, None
+    while True:
+        stats = source_stats()
+        if stats != built_stats:
+            while True:
+                await asyncio.sleep(debounce if built_stats is not None else 0)
+                settled_stats = source_stats()
+                if settled_stats == stats:
+                    break
+                stats = settled_stats
+            built_stats = stats
+            try:
+                all_data, changed_sections = await loop.run_in_executor(executor, build_once, build_args)
+            except Exception:
+                logger.exception('Build failed, waiting for the next source change')
+            else:
+                if service is not None:
+                    await loop.run_in_executor(executor, update_service, service, all_data)
+                if changed_sections and push:
+                    is_push_pending, last_push = True, None
+        if is_push_pending and (last_push is None or time.monotonic() - last_push >= PUSH_RETRY_INTERVAL):
+            last_push = time.monotonic()
+            try:
+                is_push_pending = not await push_export(VAXAPP_PATH, sharded=build_args['sharded'])
+            except Exception:
+                logger.exception('Push failed')
+            if is_push_pending:
+                logger.warning(f'Export not pushed, retrying in {PUSH_RETRY_INTERVAL}s')
+        await asyncio.sleep(poll_interval)
+
+
+async def run(args, service=None):
+    # the pipeline runs in a thread next to the server and loop threads, and its process pools
+    # fork, which is not safe with other threads running: always build in one process
+    tasks = [refresh_loop({'incremental': args.incremental, 'use_cache': True, 'processes': 1,
+                           'sharded': args.sharded}, args.poll_interval, args.debounce, args.push, service)]
+    if args.pull_interval:
+        tasks.append(pull_upstream(root_folder, args.pull_interval))
+    await asyncio.gather(*tasks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild and publish vax progress data when CITF sources change')
+    parser.add_argument('--poll-interval', type=float, default=2, help='seconds between source file checks')
+    parser.add_argument('--debounce', type=float, default=10,
+                        help='seconds sources must stay unchanged before a rebuild')
+    parser.add_argument('--pull-interval', type=float, default=None,
+                        help='also git pull the CITF checkout every this many seconds')
+    parser.add_argument('--push', action='store_true', help='commit and push the export after changes, like load.sh')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--sharded', action='store_true')
+    parser.add_argument('--serve', type=int, default=None, metavar='PORT',
+                        help='also serve views of the latest build from memory on this port, see serve.py')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(message)s')
+
+    service = None
+    if args.serve:
+        import serve
+        service = serve.DataService()
+        threading.Thread(target=serve.serve, args=(service, '127.0.0.1', args.serve), daemon=True).start()
+    try:
+        asyncio.run(run(args, service))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
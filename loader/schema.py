@@ -0,0 +1,159 @@
+import io
+import hashlib
+import logging
+import warnings
+import pandas as pd
+import numpy as np
+from pathlib import Path
+
+
+logger = logging.getLogger('loader')
+
+# CITF column schema of the files the loader reads
+VAX_COLS = ['daily_partial', 'daily_full', 'daily', 'daily_partial_child', 'daily_full_child',
+            'cumul_partial', 'cumul_full', 'cumul', 'cumul_partial_child', 'cumul_full_child',
+            'pfizer1', 'pfizer2', 'sinovac1', 'sinovac2', 'astra1', 'astra2', 'cansino', 'pending']
+REG_COLS = ['total', 'phase2', 'mysj', 'call', 'web', 'children', 'elderly', 'comorb', 'oku']
+POP_COLS = ['pop', 'pop_18', 'pop_60', 'pop_12']
+
+# column types: 'date' is YYYY-MM-DD, kept as string with a parsed `date_dt` column added,
+# 'state' is categorical, ints are read as int64 and range checked before narrowing
+# (pandas wraps out of range values when reading straight into int32).
+# State counts fit int32, national rows and population are small and kept int64 so sums over
+# many states (see bench.py) can't overflow. The prepared frame narrows national counts back to
+# the state dtype where they fit (`scriptv2.combine_national_state`)
+SCHEMAS = {
+    'vax_malaysia': {'dataset': 'vax', 'columns': {'date': 'date', **{col: 'int64' for col in VAX_COLS}}},
+    'vax_state': {'dataset': 'vax', 'columns': {'date': 'date', 'state': 'state',
+                                                **{col: 'int32' for col in VAX_COLS}}},
+    'vaxreg_malaysia': {'dataset': 'reg', 'columns': {'date': 'date', 'state': 'state',
+                                                      **{col: 'int64' for col in REG_COLS}}},
+    'vaxreg_state': {'dataset': 'reg', 'columns': {'date': 'date', 'state': 'state',
+                                                   **{col: 'int32' for col in REG_COLS}}},
+    'population': {'dataset': 'pop', 'columns': {'state': 'str', 'idxs': 'int32',
+                                                 **{col: 'int64' for col in POP_COLS}}},
+}
+READ_DTYPES = {'date': str, 'state': 'category', 'str': str, 'int32': 'int64', 'int64': 'int64'}
+N_EXAMPLES = 3  # bad values shown per column
+
+
+class SchemaError(ValueError):
+    """CITF file that does not match its declared schema, message lists every problem found"""
+
+
+def source_schema(csv_path):
+    """Schema of a CITF file by its name, e.g. vax_state.csv"""
+    name = Path(csv_path).stem
+    if name not in SCHEMAS:
+        raise SchemaError(f'{name}: no schema declared, one of {list(SCHEMAS)}')
+    return SCHEMAS[name]
+
+
+def schema_fingerprint(csv_path):
+    return hashlib.sha1(str(source_schema(csv_path)).encode()).hexdigest()
+
+
+def parse_dates(values):
+    """
+    YYYY-MM-DD strings to datetime64[ns], parsed by numpy without format inference
+    Rows of a date repeat for every state, so each distinct date is parsed once
+    Raises ValueError on anything else, including other ISO forms numpy accepts such as 2021-06
+    """
+    codes, uniques = pd.factorize(np.asarray(values))
+    uniques = np.asarray(uniques, dtype=str)
+    dates = uniques.astype('datetime64[D]')
+    if (np.datetime_as_string(dates) != uniques).any():
+        raise ValueError('dates not in YYYY-MM-DD')
+    return dates.astype('datetime64[ns]')[codes]
+
+
+def bad_examples(values, is_bad):
+    bad_idx = np.flatnonzero(is_bad)
+    examples = ', '.join(f'row {idx + 1}: {values[idx]!r}' for idx in bad_idx[:N_EXAMPLES])
+    return f"{len(bad_idx)} bad, e.g. {examples}"
+
+
+def value_problems(df, columns):
+    """Problems of every typed column of a frame read as strings"""
+    problems = []
+    for col, col_type in columns.items():
+        values = df[col].to_numpy(dtype=object)
+        if col_type == 'date':
+            dates = pd.to_datetime(df[col].where(df[col].str.fullmatch(r'\d{4}-\d{2}-\d{2}')),
+                                   format='%Y-%m-%d', errors='coerce')
+            is_bad = dates.isna().to_numpy()
+            expected = 'YYYY-MM-DD dates'
+        elif col_type in ['state', 'str']:
+            is_bad = (df[col].isna() | (df[col].str.strip() == '')).to_numpy()
+            expected = 'non-empty'
+        else:
+            numbers = pd.to_numeric(df[col], errors='coerce')
+            info = np.iinfo(col_type)
+            is_bad = (numbers.isna() | (numbers % 1 != 0) | (numbers < info.min) | (numbers > info.max)).to_numpy()
+            expected = f'{col_type} counts'
+        if is_bad.any():
+            problems.append(f'{col}: expected {expected}, {bad_examples(values, is_bad)}')
+    return problems
+
+
+def read_source_csv(csv_path, rows=None, header_columns=None):
+    """
+    Read a CITF file with the schema declared for it: only schema columns, pinned dtypes and dates
+    parsed as YYYY-MM-DD. With `rows`, a buffer of the file's rows without header (e.g. rows appended
+    since the last run) is read instead, `header_columns` being the columns of the file's header.
+    Columns not in the schema are ignored with a warning. Missing columns or values that don't fit
+    their type raise SchemaError listing them, before anything is computed from the file.
+    """
+    name = Path(csv_path).stem
+    columns = source_schema(csv_path)['columns']
+    if header_columns is None:
+        with open(csv_path, 'rb') as fp:
+            header_columns = fp.readline().decode().strip().split(',')
+    missing = [col for col in columns if col not in header_columns]
+    unexpected = [col for col in header_columns if col not in columns]
+    if missing:
+        raise SchemaError(f'{name}: schema drift\n  missing columns: {", ".join(missing)}'
+                          + (f'\n  unexpected columns: {", ".join(unexpected)}' if unexpected else ''))
+    if unexpected:
+        logger.warning(f'{name}: ignoring columns not in schema: {", ".join(unexpected)}')
+
+    csv_source, read_args = csv_path, {'usecols': list(columns)}
+    if rows is not None:
+        # buffer is read twice on errors
+        csv_source = io.BytesIO(rows.read())
+        read_args.update(header=None, names=header_columns)
+        if not csv_source.getvalue().strip():
+            df = pd.DataFrame({col: pd.Series(dtype=col_type if col_type.startswith('int') else READ_DTYPES[col_type])
+                               for col, col_type in columns.items()})
+            return df.assign(**{f'{col}_dt': pd.Series(dtype='datetime64[ns]')
+                                for col, col_type in columns.items() if col_type == 'date'})
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # empty values cast to int, reported below
+            df = pd.read_csv(csv_source, dtype={col: READ_DTYPES[col_type] for col, col_type in columns.items()},
+                             **read_args)
+        # one frame built from checked columns, in file order
+        checked, parsed = {}, {}
+        for col in df.columns:
+            col_type = columns[col]
+            if col_type in ['int32', 'int64']:
+                values, info = df[col].to_numpy(), np.iinfo(col_type)
+                if len(values) and (values.min() < info.min or values.max() > info.max):
+                    raise ValueError(f'{col} out of {col_type} range')
+                checked[col] = values.astype(col_type)
+            elif col_type == 'date':
+                checked[col] = df[col]
+                parsed[f'{col}_dt'] = parse_dates(df[col])  # fails on empty values too
+            else:
+                if df[col].isna().any():
+                    raise ValueError(f'{col} has empty values')
+                checked[col] = df[col]
+        return pd.DataFrame({**checked, **parsed}, copy=False)
+    except ValueError:
+        # read again as strings to find every bad value
+        if hasattr(csv_source, 'seek'):
+            csv_source.seek(0)
+        problems = value_problems(pd.read_csv(csv_source, dtype=str, keep_default_na=False, **read_args), columns)
+        if not problems:
+            raise
+    raise SchemaError(f'{name}: schema drift\n  ' + '\n  '.join(problems))
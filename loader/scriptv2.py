@@ -1,21 +1,31 @@
+import io
 import os
+import sys
 import json
+import logging
+import multiprocessing
+import pickle
+import hashlib
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from datetime import timedelta, date, datetime
+from frame_cache import cache_key, load_frame, save_frame
+from export import publish
+from timeseries import TIMESERIES_PATH, build_store, current_key
+from schema import read_source_csv, schema_fingerprint, source_schema
+from sources import (ROOT_PATH, vax_national_csv, vax_state_csv, reg_national_csv, reg_state_csv,
+                     static_pop, LOADER_STATE_PATH, file_sha1, source_hashes, write_source_manifest)
+import instrument
 
 
-# paths
-ROOT_PATH = Path('/opt')
-root_folder = ROOT_PATH / 'covid19-public'
-vax_national_csv = root_folder / 'vaccination' / 'vax_malaysia.csv'
-vax_state_csv = root_folder / 'vaccination' / 'vax_state.csv'
-reg_national_csv = root_folder / 'registration' / 'vaxreg_malaysia.csv'
-reg_state_csv = root_folder / 'registration' / 'vaxreg_state.csv'
-static_pop = root_folder / 'static' / 'population.csv'
-
+# paths, sources in sources.py
 DATA_EXPORT_PATH = f'{str(ROOT_PATH)}/vaxapp-prod/data/data3.json'
+LOADER_STATE_VERSION = 2
+# prepared national + state frames keyed by source csv content
+LOADER_CACHE_PATH = ROOT_PATH / 'vaxapp-prod' / 'loader' / '.cache'
+# section hashes of last export, to skip publishing unchanged output
+EXPORT_MANIFEST_PATH = LOADER_STATE_PATH / 'manifest.json'
 
 HERD_TARGET_PCT = 0.8
 PHASE2_TARGET_PCT = 0.2
@@ -23,6 +33,8 @@ PHASE3_TARGET_PCT = 0.4
 PHASE4_TARGET_PCT = 0.6
 NINETY_TARGET_PCT = 0.9
 FULL_TARGET_PCT = 1.0
+MILESTONE_TARGETS = [PHASE2_TARGET_PCT, PHASE3_TARGET_PCT, PHASE4_TARGET_PCT,
+                     HERD_TARGET_PCT, NINETY_TARGET_PCT, FULL_TARGET_PCT]
 PERIOD_WINDOW = 14  # for daily doses data
 ROLL_WINDOW = 7  # for vaccination rate
 N_TOP_STATES = 5
@@ -35,6 +47,13 @@ AVG_DOSE_INT = round((21*PROP_OTHERS) + (63*PROP_AZ))
 PFSN_DOSE_INT = 21
 AZ_DOSE_INT = 63
 
+# population bands (pop levels): population column, cumulative dose 1 and dose 2 columns of vax data
+# and registrations column of registration data. Adult columns are derived in add_vax_columns and
+# add_reg_columns, a band needs nothing else, all bands go through the same vectorized passes
+POP_BANDS = {'total': {'pop': 'pop', 'dose1': 'cumul_partial', 'dose2': 'cumul_full', 'reg': 'total'},
+             'adult': {'pop': 'pop_18', 'dose1': 'cumul_partial_adult', 'dose2': 'cumul_full_adult', 'reg': 'adult'},
+             'child': {'pop': 'pop_12', 'dose1': 'cumul_partial_child', 'dose2': 'cumul_full_child', 'reg': 'children'}}
+
 state_abbr = {'Johor': 'JHR',
               'Kedah': 'KDH',
               'Kelantan': 'KTN',
@@ -48,10 +67,36 @@ state_abbr = {'Johor': 'JHR',
               'Sarawak': 'SWK',
               'Terengganu': 'TRG',
               'W.P. Labuan': 'LBN',
-              'Klang Valley': 'KV',
               'Malaysia': 'MY'}
 
-summarized_states = ['W.P. Kuala Lumpur', 'W.P. Putrajaya', 'Selangor']
+# aggregate regions, summed from their member states into rows of their own
+# `summarize`: exported in place of its members, `export`: exported at all
+REGIONS = {'Klang Valley': {'abbr': 'KV', 'members': ['Selangor', 'W.P. Kuala Lumpur', 'W.P. Putrajaya'],
+                            'summarize': True, 'export': True},
+           'Northern': {'abbr': 'NTH', 'members': ['Perlis', 'Kedah', 'Pulau Pinang', 'Perak'],
+                        'summarize': False, 'export': False},
+           'East Coast': {'abbr': 'ECR', 'members': ['Kelantan', 'Terengganu', 'Pahang'],
+                          'summarize': False, 'export': False},
+           'Borneo': {'abbr': 'BRN', 'members': ['Sabah', 'Sarawak', 'W.P. Labuan'],
+                      'summarize': False, 'export': False}}
+state_abbr.update({region_name: region['abbr'] for region_name, region in REGIONS.items()})
+
+summarized_states = [state_name for region in REGIONS.values() if region['summarize']
+                     for state_name in region['members']]
+# dropped from the latest day frames, so not exported
+hidden_states = summarized_states + [region_name for region_name, region in REGIONS.items() if not region['export']]
+
+# per state progress is logged at DEBUG, run summary at INFO
+logger = logging.getLogger('loader')
+
+# per state cumulative sums by vax type: latest_dfv column -> daily doses column
+CUMUL_COLS = {'pfizer1_cumul': 'pfizer1',
+              'pfizer2_cumul': 'pfizer2',
+              'sinovac1_cumul': 'sinovac1',
+              'sinovac2_cumul': 'sinovac2',
+              'astra1_cumul': 'astra1',
+              'astra2_cumul': 'astra2',
+              'cansino2_cumul': 'cansino'}
 
 # for console printing
 class bcolors:
@@ -66,31 +111,296 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 
-def preprocess_csv(national_csv, state_csv, dfpop):
+def region_membership(states, regions=REGIONS):
     """
-    Main pre-process funciton to combine national and state CSVs
-    National level data is treated as a State
-    Returns aggregated summary by state for latest date in data set
-    For vaccination CSV, also returns doses data by state and target hits
+    Compile regions into a (regions x states) membership matrix over `states`, 1 where a state is a member
+    Dense, regions over the 16 states fit in a few hundred cells and stay a plain numpy matmul
     """
+    states = pd.Index(states)
+    membership = np.zeros((len(regions), len(states)))
+    for r_idx, (region_name, region) in enumerate(regions.items()):
+        s_idx = states.get_indexer(region['members'])
+        if (s_idx < 0).any():
+            missing = [state_name for state_name, idx in zip(region['members'], s_idx) if idx < 0]
+            raise ValueError(f'{region_name} members not in data: {missing}')
+        membership[r_idx, s_idx] = 1
+    return membership
+
+
+def regions_fingerprint(regions=REGIONS):
+    return hashlib.sha1(json.dumps(regions, sort_keys=True).encode()).hexdigest()
+
+
+def read_population(pop_csv):
+    """Population by state indexed by state name, with region populations added"""
+    dfpop = read_source_csv(pop_csv).set_index('state')
+    # every column summed over members of every region at once
+    dfpop_regions = pd.DataFrame(region_membership(dfpop.index) @ dfpop.to_numpy(dtype=float),
+                                 index=pd.Index(list(REGIONS), name='state'), columns=dfpop.columns)
+    return pd.concat([dfpop, dfpop_regions.astype(dfpop.dtypes.to_dict())])
 
-    # read national csv
-    dfvn = pd.read_csv(national_csv)
-    dfvn['state'] = 'Malaysia'
 
-    # read state csv
-    dfvs = pd.read_csv(state_csv)
-    dfvs = pd.concat([dfvs, dfvn])  # concat national and state
-    dfvs['date_dt'] = pd.to_datetime(dfvs.date, format='%Y-%m-%d')
+def add_region_rows(dfvs, regions=REGIONS):
+    """
+    Append rows of every region to a (date_dt, state) frame, summed from its member states
+    The frame is unstacked once into a (date x column x state) array and all regions come out of one
+    matmul with the membership matrix, instead of a cross section per member and region.
+    A region has rows for dates any member has, nan where a member has no row on the date.
+    """
+    cols = dfvs.columns.drop('date')
+    dfvs_wide = dfvs[cols].unstack('state')
+    dates = dfvs_wide.index
+    states = dfvs_wide.columns.get_level_values('state')[:len(dfvs_wide.columns) // len(cols)]
+    values = dfvs_wide.to_numpy(dtype=float).reshape(len(dates), len(cols), len(states))
+    membership = region_membership(states, regions)
+
+    # a missing member row makes the region nan, as a sum of aligned frames would
+    is_nan = np.isnan(values)
+    sums = np.where(is_nan, 0, values) @ membership.T
+    sums[(is_nan @ membership.T) > 0] = np.nan
+    present = pd.Series(1.0, index=dfvs.index).unstack('state', fill_value=0)[states].to_numpy()
+    region_present = (present @ membership.T) > 0
+
+    index = pd.MultiIndex.from_product([dates, list(regions)], names=['date_dt', 'state'])
+    dfvs_regions = pd.DataFrame(sums.transpose(0, 2, 1).reshape(-1, len(cols)),
+                                index=index, columns=cols)[region_present.ravel()]
+    # back to int where the states' column is, unless a missing member made it nan
+    for col in cols:
+        if dfvs[col].dtype.kind in 'iu' and not dfvs_regions[col].isna().any():
+            dfvs_regions[col] = dfvs_regions[col].astype(dfvs[col].dtype)
+    dfvs_regions.insert(dfvs.columns.get_loc('date'), 'date',
+                        dfvs_regions.index.get_level_values('date_dt').strftime('%Y-%m-%d'))
+    return pd.concat([dfvs, dfvs_regions])
+
+
+def combine_national_state(dfvn, dfvs):
+    """
+    Combine national and state rows into one (date_dt, state) indexed frame
+    National level data is treated as a State and regions are summed from their states
+    Counts keep the dtypes of the state file where they fit and `state` stays categorical
+    """
+    state_dtypes = dfvs.dtypes
+    dfvn['state'] = 'Malaysia'
+    dfvs = pd.concat([dfvs, dfvn])  # concat national and state, date_dt parsed by `read_source_csv`
     dfvs.set_index(['date_dt', 'state'], inplace=True)
+    dfvs = add_region_rows(dfvs).sort_index()
+    # national counts are int64 (schema.py) and regions are summed in it, narrowed back once all rows are in
+    for col in dfvs.columns:
+        dtype = state_dtypes[col]
+        if dtype.kind == 'i' and dfvs[col].dtype.kind == 'i' and dfvs[col].dtype != dtype and \
+                (dfvs[col].empty or (np.iinfo(dtype).min <= dfvs[col].min() and dfvs[col].max() <= np.iinfo(dtype).max)):
+            dfvs[col] = dfvs[col].astype(dtype)
+    return categorical_states(dfvs)
 
-    # create KV summary
-    dfvs_kv = dfvs.xs('Selangor', level=1) + dfvs.xs('W.P. Kuala Lumpur',
-                                                     level=1) + dfvs.xs('W.P. Putrajaya', level=1)
-    dfvs_kv['state'] = 'Klang Valley'
-    dfvs_kv['date'] = dfvs.xs('Selangor', level=1)['date']  # fixed summed date
-    dfvs_kv.set_index('state', append=True, inplace=True)
-    dfvs = pd.concat([dfvs, dfvs_kv]).sort_index()    
+
+def categorical_states(dfvs):
+    """(date_dt, state) frame with the `state` level categorical, as `read_source_csv` reads it"""
+    states = dfvs.index.levels[dfvs.index.names.index('state')]
+    dfvs.index = dfvs.index.set_levels(states.astype('category'), level='state')
+    return dfvs
+
+
+def add_vax_columns(dfvs, dfpop):
+    """
+    Derived columns for vax dataset: adult counts and dose 2 pct of every pop band
+    CSV columns are left as read, daily child doses come from the CSV (required by its schema)
+    """
+    dfvs['cumul_full_adult'] = dfvs.cumul_full - dfvs.cumul_full_child
+    dfvs['cumul_partial_adult'] = dfvs.cumul_partial - dfvs.cumul_partial_child
+    for pop_level, band in POP_BANDS.items():
+        dfvs[f'dose2_pct_{pop_level}'] = dfvs[band['dose2']]/dfpop[band['pop']]
+    dfvs['pfsn1'] = dfvs['pfizer1'] + dfvs['sinovac1']
+    return dfvs
+
+
+def add_reg_columns(dfrs):
+    """Derived columns for registration dataset: adult registrations"""
+    dfrs['adult'] = dfrs.total - dfrs.children
+    return dfrs
+
+
+def read_prepared_csv(national_csv, state_csv, dfpop, use_cache=True, mmap=False, hashes=None):
+    """
+    Read national and state CSVs into the combined (date_dt, state) frame with region rows
+    CSVs are checked against their schema (schema.py). Cached in columnar form keyed by content hash of
+    both CSVs (from `hashes` by path if given, see `sources.source_hashes`), population, regions and
+    schemas, so a cache hit skips CSV and date parsing. `mmap` maps cached columns instead of reading them.
+    """
+    if not use_cache:
+        return combine_national_state(read_source_csv(national_csv), read_source_csv(state_csv))
+
+    name = Path(state_csv).stem
+    hashes = source_hashes([national_csv, state_csv]) if hashes is None else hashes
+    key = cache_key(hashes[str(national_csv)], hashes[str(state_csv)], population_fingerprint(dfpop), regions_fingerprint(),
+                    schema_fingerprint(national_csv), schema_fingerprint(state_csv))
+    dfvs = load_frame(LOADER_CACHE_PATH, name, key, mmap)
+    if dfvs is None:
+        dfvs = combine_national_state(read_source_csv(national_csv), read_source_csv(state_csv))
+        save_frame(LOADER_CACHE_PATH, name, key, dfvs)
+    return dfvs
+
+
+def rolling_state_stats(dfvs, latest_date):
+    """
+    Rolling average rates and dose 2 pending by state, up to `latest_date`
+    The longest window is unstacked once into (date x state) arrays and every statistic is a
+    date mask over them, instead of a groupby per statistic
+    Returns frame of rates indexed by state, and {name: (states x days) frame} of dose 1 given in the
+    last dose interval days. Days a state has no rows for are dropped and its remaining days zero padded.
+    """
+    n_days = max(ROLL_WINDOW + 1, AVG_DOSE_INT, PFSN_DOSE_INT, AZ_DOSE_INT)
+    dfvs_window = dfvs[latest_date - pd.offsets.Day(n_days - 1):latest_date]
+    rate_cols = ['daily_partial', 'daily_full', 'daily', 'pfizer1', 'sinovac1', 'pfsn1', 'astra1']
+    # missing (date, state) rows filled only to keep int dtype, masked out by `present`
+    dfvs_wide = dfvs_window[rate_cols].unstack('state', fill_value=0)
+    present = pd.Series(True, index=dfvs_window.index).unstack('state', fill_value=False)
+    states = present.columns
+    dates = present.index
+    present = present.to_numpy()
+
+    def window(n_days, days_back=0):
+        window_end = latest_date - pd.offsets.Day(days_back)
+        return (dates >= window_end - pd.offsets.Day(n_days - 1)) & (dates <= window_end)
+
+    def window_mean(col, n_days, days_back=0):
+        in_window = window(n_days, days_back)
+        return dfvs_wide[col][in_window].where(present[in_window]).mean()
+
+    def window_matrix(col, n_days):
+        in_window = window(n_days)
+        values, has_row = dfvs_wide[col].to_numpy()[in_window].T, present[in_window].T
+        if not has_row.all():
+            # move days with rows to the front, keeping date order
+            order = np.argsort(~has_row, axis=1, kind='stable')
+            values = np.where(np.take_along_axis(has_row, order, axis=1),
+                              np.take_along_axis(values, order, axis=1), 0)
+        return pd.DataFrame(values, index=states)
+
+    dfvs_rates = pd.DataFrame({
+        'avg_dose1_rate': window_mean('daily_partial', ROLL_WINDOW),
+        'avg_dose2_rate': window_mean('daily_full', ROLL_WINDOW),
+        'avg_total_rate': window_mean('daily', ROLL_WINDOW),
+        'avg_pf_rate': window_mean('pfizer1', ROLL_WINDOW),
+        'avg_sn_rate': window_mean('sinovac1', ROLL_WINDOW),
+        'avg_pfsn_rate': window_mean('pfsn1', ROLL_WINDOW),
+        'avg_az_rate': window_mean('astra1', ROLL_WINDOW),
+        # compare with shifted back (old) rate
+        'avg_dose1_rate_shifted': window_mean('daily_partial', ROLL_WINDOW, days_back=1),
+    })
+    dose2_pending = {
+        # from latest date in dataset, dose 1 of last avg dose interval days is projected dose 2
+        'projected_dose2': window_matrix('daily_partial', AVG_DOSE_INT),
+        'pf_dose2': window_matrix('pfizer1', PFSN_DOSE_INT),
+        'sn_dose2': window_matrix('sinovac1', PFSN_DOSE_INT),
+        'pfsn_dose2': window_matrix('pfsn1', PFSN_DOSE_INT),
+        'az_dose2': window_matrix('astra1', AZ_DOSE_INT),
+    }
+    return dfvs_rates, dose2_pending
+
+
+class LatestVax:
+    """
+    Latest day of vax data for all states as a struct of arrays, in place of a frame with list cells
+    Scalars are kept as one array per column, read as attributes, dose 1 given in the last dose interval
+    days (pending dose 2) as (states x days) matrices. `state` gives the per state record `summary_by_state` consumes.
+    """
+    __slots__ = ['index', 'columns', 'projected_dose2', 'pfsn_dose2', 'az_dose2', '_state_idx']
+
+    def __init__(self, latest_dfv, dose2_pending):
+        self.index = latest_dfv.index
+        self.columns = {col: pd.DatetimeIndex(values) if values.dtype.kind == 'M' else values.to_numpy()
+                        for col, values in latest_dfv.items()}
+        self._state_idx = {state_name: s_idx for s_idx, state_name in enumerate(self.index)}
+        for name in ['projected_dose2', 'pfsn_dose2', 'az_dose2']:
+            setattr(self, name, dose2_pending[name].reindex(self.index, fill_value=0).to_numpy())
+
+    def __getattr__(self, col):
+        # private names and slots not set yet (unpickling, copy) are never columns,
+        # looking them up in `columns` would call back into __getattr__
+        if col.startswith('_') or col in LatestVax.__slots__:
+            raise AttributeError(col)
+        try:
+            return self.columns[col]
+        except KeyError:
+            raise AttributeError(col) from None
+
+    def __len__(self):
+        return len(self.index)
+
+    def state(self, state_name):
+        return StateVax(self, self._state_idx[state_name])
+
+
+class StateVax:
+    """Latest values of one state, `LatestVax` columns read as attributes and its rows of the dose 2 matrices"""
+    __slots__ = ['latest', 's_idx']
+
+    def __init__(self, latest, s_idx):
+        self.latest = latest
+        self.s_idx = s_idx
+
+    def __getattr__(self, col):
+        # same guard as `LatestVax.__getattr__`
+        if col.startswith('_') or col in StateVax.__slots__:
+            raise AttributeError(col)
+        try:
+            return self.latest.columns[col][self.s_idx]
+        except KeyError:
+            raise AttributeError(col) from None
+
+    @property
+    def name(self):
+        return self.latest.index[self.s_idx]
+
+    @property
+    def projected_dose2(self):
+        return self.latest.projected_dose2[self.s_idx]
+
+    @property
+    def pfsn_dose2(self):
+        return self.latest.pfsn_dose2[self.s_idx]
+
+    @property
+    def az_dose2(self):
+        return self.latest.az_dose2[self.s_idx]
+
+
+def preprocess_csv(national_csv, state_csv, dfpop, incremental=False, use_cache=True, mmap=False, hashes=None):
+    """
+    Main pre-process funciton to combine national and state CSVs
+    National level data is treated as a State
+    Returns aggregated summary by state for latest date in data set, as `LatestVax` for vaccination CSV
+    For vaccination CSV, also returns doses data by state and target hits
+    Last is the full (date_dt, state) frame the summary was computed from, derived columns included
+    With `incremental`, only rows appended since the last run are read and processed
+    Otherwise the combined frame comes from `read_prepared_csv` and its cache
+    `hashes` are source digests by path from `sources.source_hashes`, the CSVs are hashed here if not given
+    """
+    if hashes is None and (use_cache or incremental):
+        hashes = source_hashes([national_csv, state_csv])
+    is_vax = source_schema(state_csv)['dataset'] == 'vax'
+    state_file = LOADER_STATE_PATH / f'{Path(state_csv).stem}.pkl'
+    loader_state = load_loader_state(
+        state_file, dfpop, national_csv, state_csv, hashes) if incremental else None
+    if loader_state is not None:
+        dfvs, cumuls, state_target_hits, is_state_changed = loader_state
+    else:
+        is_state_changed = True
+        dfvs = read_prepared_csv(national_csv, state_csv, dfpop, use_cache, mmap, hashes)
+        cumuls, state_target_hits = None, {}
+        if is_vax:
+            # cumulative by vax type
+            cumuls = dfvs.groupby('state')[list(CUMUL_COLS.values())].sum()
+            dfvs = add_vax_columns(dfvs, dfpop)
+            # extract milestones that were hit: when (date) and doses administered
+            state_target_hits = find_target_hits(dfvs)
+
+    # the common daily no-op run doesn't re-pickle the full history
+    if incremental and is_state_changed:
+        save_loader_state(state_file, dfpop, national_csv, state_csv, hashes,
+                          dfvs, cumuls, state_target_hits)
+
+    instrument.annotate(rows=len(dfvs))
 
     # get latest day slice
     dfvs_dateindex = dfvs.index.get_level_values('date_dt')
@@ -99,125 +409,31 @@ def preprocess_csv(national_csv, state_csv, dfpop):
 
     # vax rate by state - only for vax dataset
     state_doses_data_byvax = {}
-    state_target_hits = {}
-    if 'pfizer1' in dfvs.columns.tolist():
-        # cumulative by vax type
-        pfizer1_cumul = dfvs.groupby('state')['pfizer1'].sum()
-        pfizer2_cumul = dfvs.groupby('state')['pfizer2'].sum()
-        sinovac1_cumul = dfvs.groupby('state')['sinovac1'].sum()
-        sinovac2_cumul = dfvs.groupby('state')['sinovac2'].sum()
-        astra1_cumul = dfvs.groupby('state')['astra1'].sum()
-        astra2_cumul = dfvs.groupby('state')['astra2'].sum()
-        cansino2_cumul = dfvs.groupby('state')['cansino'].sum()
-        
-        dfvs['cumul_full_adult'] = dfvs.cumul_full - dfvs.cumul_full_child
-        dfvs['cumul_partial_adult'] = dfvs.cumul_partial - dfvs.cumul_partial_child
-        dfvs['dose2_pct_adult'] = dfvs.cumul_full_adult/dfpop['pop_18']
-        dfvs['dose2_pct_child'] = dfvs.cumul_full_child/dfpop['pop_12']
-        dfvs['dose2_pct_total'] = dfvs.cumul_full/dfpop['pop']
-        dfvs['pfsn1'] = dfvs['pfizer1'] + dfvs['sinovac1']
-
-        dfvs['daily_partial_child'] = dfvs.groupby('state')['cumul_partial_child'].diff()
-        dfvs['daily_full_child'] = dfvs.groupby('state')['cumul_full_child'].diff()
-
-        latest_dfv = dfvs.loc[latest_date]
+    dose2_pending = None
+    if is_vax:
+        latest_dfv = dfvs.loc[latest_date].copy()
         latest_lastday_dfv = dfvs.loc[latest_date - timedelta(days=1)]
 
-        # extract milestones that were hit: when (date) and doses administered
-        state_target_hits = {}
-        for pop_level in ['adult', 'total', 'child']:
-            state_target_hits[pop_level] = {}
-            for state_name, state_period in dfvs.groupby('state'):
-                state_target_hits[pop_level][state_name] = state_target_hits[pop_level][state_name] if state_name in state_target_hits[pop_level].keys() else {
-                }
-
-                for target in [PHASE2_TARGET_PCT, PHASE3_TARGET_PCT, PHASE4_TARGET_PCT, HERD_TARGET_PCT, NINETY_TARGET_PCT, FULL_TARGET_PCT]:
-                    if pop_level == 'adult':
-                        dose2_pct = state_period.dose2_pct_adult
-                    elif pop_level == 'child':
-                        dose2_pct = state_period.dose2_pct_child
-                    else:
-                        dose2_pct = state_period.dose2_pct_total
-
-                    target_period = state_period[dose2_pct > target]
-                    if not target_period.empty:
-                        target_hit_date = datetime.combine(
-                            target_period[:1].iloc[0].name[0], datetime.min.time())
-                        if pop_level == 'adult':
-                            target_hit_dose2 = target_period[:1].iloc[0].cumul_full_adult
-                        elif pop_level == 'child':
-                            target_hit_dose2 = target_period[:1].iloc[0].cumul_full_child
-                        else:
-                            target_hit_dose2 = target_period[:1].iloc[0].cumul_full
-
-                        state_target_hits[pop_level][state_name][target] = (target_hit_date, target_hit_dose2)
-                        print(f'{state_name} hit {target} target at {target_hit_date} achieving {target_hit_dose2}')        
-
-        # calculate last n day daily dose rate
-        dfvs_lastweek = dfvs[latest_date -
-                             pd.offsets.Day(ROLL_WINDOW - 1):latest_date]
-        avg_dose1_rate = dfvs_lastweek.groupby('state')['daily_partial'].mean()
-        avg_dose2_rate = dfvs_lastweek.groupby('state')['daily_full'].mean()
-        avg_total_rate = dfvs_lastweek.groupby('state')['daily'].mean()
-
-        avg_pf_rate = dfvs_lastweek.groupby('state')['pfizer1'].mean()
-        avg_sn_rate = dfvs_lastweek.groupby('state')['sinovac1'].mean()
-        avg_pfsn_rate = dfvs_lastweek.groupby('state')['pfsn1'].mean()
-        avg_az_rate = dfvs_lastweek.groupby('state')['astra1'].mean()
-        avg_child_rate = dfvs_lastweek.groupby('state')['daily_partial_child'].mean()
-
-        # compare with shifted back (old) rate
-        dfvs_lastweek_shifted = dfvs[latest_date -
-                                     pd.offsets.Day(ROLL_WINDOW):latest_date - pd.offsets.Day(1)]
-        avg_dose1_rate_shifted = dfvs_lastweek_shifted.groupby('state')['daily_partial'].mean()
-
-        # from latest date in dataset, 24 days projected sum of dose 2 based on last 24 days dose 1
-        dfvs_dose_interval = dfvs[latest_date -
-                                  pd.offsets.Day(AVG_DOSE_INT - 1):]
-        states_projected_dose2_total = dfvs_dose_interval.groupby('state')[
-            'daily_partial'].sum()
-        states_projected_dose2_total_list = dfvs_dose_interval.groupby('state')[
-            'daily_partial'].apply(list)
-
-        states_pf_dose2_list = dfvs[latest_date - pd.offsets.Day(
-            PFSN_DOSE_INT - 1):latest_date].groupby('state')['pfizer1'].apply(list).fillna(0)
-        states_sn_dose2_list = dfvs[latest_date - pd.offsets.Day(
-            PFSN_DOSE_INT - 1):latest_date].groupby('state')['sinovac1'].apply(list).fillna(0)
-        states_pfsn_dose2_list = dfvs[latest_date - pd.offsets.Day(
-            PFSN_DOSE_INT - 1):latest_date].groupby('state')['pfsn1'].apply(list).fillna(0)
-        states_az_dose2_list = dfvs[latest_date - pd.offsets.Day(
-            AZ_DOSE_INT - 1):latest_date].groupby('state')['astra1'].apply(list).fillna(0)
-
-        latest_dfv.loc[:, 'avg_dose1_rate'] = avg_dose1_rate
-        latest_dfv.loc[:, 'avg_dose2_rate'] = avg_dose2_rate
-        latest_dfv.loc[:, 'avg_total_rate'] = avg_total_rate
-        latest_dfv.loc[:, 'avg_pfsn_rate'] = avg_pfsn_rate
-        latest_dfv.loc[:, 'avg_az_rate'] = avg_az_rate
-        latest_dfv.loc[:, 'projected_dose2_total_list'] = states_projected_dose2_total_list
-        latest_dfv.loc[:, 'states_pfsn_dose2_list'] = states_pfsn_dose2_list
-        latest_dfv.loc[:, 'states_az_dose2_list'] = states_az_dose2_list
+        # rolling rates and dose 2 pending, all states at once
+        dfvs_rolling, dose2_pending = rolling_state_stats(dfvs, latest_date)
+        for col in ['avg_dose1_rate', 'avg_dose2_rate', 'avg_total_rate', 'avg_pfsn_rate', 'avg_az_rate']:
+            latest_dfv.loc[:, col] = dfvs_rolling[col]
 
         latest_dfv.loc[:, 'is_daily_rate_incr'] = latest_dfv.daily > latest_lastday_dfv.daily
         latest_dfv.loc[:,
-                       'is_avg_rate_incr'] = avg_dose1_rate > avg_dose1_rate_shifted
+                       'is_avg_rate_incr'] = dfvs_rolling.avg_dose1_rate > dfvs_rolling.avg_dose1_rate_shifted
 
-        latest_dfv.loc[:, 'pfizer1_cumul'] = pfizer1_cumul
-        latest_dfv.loc[:, 'pfizer2_cumul'] = pfizer2_cumul
-        latest_dfv.loc[:, 'sinovac1_cumul'] = sinovac1_cumul
-        latest_dfv.loc[:, 'sinovac2_cumul'] = sinovac2_cumul
-        latest_dfv.loc[:, 'astra1_cumul'] = astra1_cumul
-        latest_dfv.loc[:, 'astra2_cumul'] = astra2_cumul
-        latest_dfv.loc[:, 'astra2_cumul'] = astra2_cumul
-        latest_dfv.loc[:, 'cansino2_cumul'] = cansino2_cumul
+        for cumul_col, vax_col in CUMUL_COLS.items():
+            latest_dfv.loc[:, cumul_col] = cumuls[vax_col]
 
         # aggregate daily doses data by state
         dfvs_period_window = dfvs[latest_date -
                                   pd.offsets.Day(PERIOD_WINDOW - 1):]
-        for state_name, state_period in dfvs_period_window.groupby('state'):
-            state_doses_data_byvax[state_name] = prepare_doses_byvax_data(
-                state_period, avg_pf_rate[state_name], avg_sn_rate[state_name], avg_az_rate[state_name], states_pf_dose2_list[state_name], states_sn_dose2_list[state_name], states_az_dose2_list[state_name])
+        state_doses_data_byvax = prepare_doses_byvax_data(
+            dfvs_period_window, dfvs_rolling.avg_pf_rate, dfvs_rolling.avg_sn_rate, dfvs_rolling.avg_az_rate,
+            dose2_pending['pf_dose2'], dose2_pending['sn_dose2'], dose2_pending['az_dose2'])
     else:
-        latest_dfv = dfvs.loc[latest_date]
+        latest_dfv = add_reg_columns(dfvs.loc[latest_date].copy())
         date_lastday_idx_slice = latest_date - timedelta(days=1)
         # workaround for missing dates in index
         # would've filled na if not for this bug: https://github.com/pandas-dev/pandas/issues/25460
@@ -229,159 +445,369 @@ def preprocess_csv(national_csv, state_csv, dfpop):
 
     latest_dfv['date_dt'] = pd.to_datetime(
         latest_dfv.date, format='%Y-%m-%d', errors='ignore')
-    latest_dfv = latest_dfv.drop(summarized_states)
-    return latest_dfv, state_doses_data_byvax, state_target_hits
-
-
-
-def prepare_doses_byvax_data(dfvn, avg_pf_rate, avg_sn_rate, avg_az_rate, pf_dose2_list, sn_dose2_list, az_dose2_list):
-    daily_data = []
-    last_date = None
-    for _, day_row in dfvn[-PERIOD_WINDOW:].iterrows():
-        daily_dict = {
-            'date': day_row['date'],
-            'dose1_pfizer': day_row['pfizer1'],
-            'dose1_sino': day_row['sinovac1'],
-            'dose1_astra': day_row['astra1'],
-            'dose1_display': f"{day_row['daily_partial']:,}",
-            'dose2_pfizer': day_row['pfizer2'],
-            'dose2_sino': day_row['sinovac2'],
-            'dose2_astra': day_row['astra2'],
-            'dose2_cansino': day_row['cansino'],
-            'dose2_display': f"{day_row['daily_full']:,}",
-            'full_display': f"{day_row['daily']:,}",
-        }
-        daily_data.append(daily_dict)
-        last_date = day_row.name[0]
-
-    for ind in range(7):
-        avg_rate_total = int(round(avg_pf_rate + avg_sn_rate + avg_az_rate,0))
-        dose2_total = pf_dose2_list[ind] + sn_dose2_list[ind] + az_dose2_list[ind]
-        full_total = avg_rate_total + dose2_total
-        daily_dict = {
-            'date': (last_date + timedelta(days=ind+1)).strftime("%Y-%m-%d"),
-            'dose1_pfizer': round(avg_pf_rate,0),
-            'dose1_sino': round(avg_sn_rate,0),
-            'dose1_astra': round(avg_az_rate,0),
-            'dose1_display': f"{avg_rate_total:,}",
-            'dose2_pfizer': pf_dose2_list[ind],
-            'dose2_sino': sn_dose2_list[ind],
-            'dose2_astra': az_dose2_list[ind],
-            'dose2_cansino': 0, #TODO: include average rate of cansino doses
-            'dose2_display': f"{dose2_total:,}",
-            'full_display': f"{full_total:,}",
-            'projection': True
-        }
-        daily_data.append(daily_dict)
-    return daily_data
+    latest_dfv = latest_dfv.drop(hidden_states)
+    if dose2_pending is not None:
+        latest_dfv = LatestVax(latest_dfv, dose2_pending)
+    return latest_dfv, state_doses_data_byvax, state_target_hits, dfvs
 
 
-def estimate_complete_by_target(target_pct, target_pop, pfsn_vax_rate, az_vax_rate, current_vax_total, pfsn_dose2_list=[], az_dose2_list=[], start_date=date.today()):
+def population_fingerprint(dfpop):
+    return hashlib.sha1(pd.util.hash_pandas_object(dfpop).values.tobytes()).hexdigest()
+
+
+def read_appended_rows(csv_path, source):
     """
-    Given target percent, target pop and current progress and rate, 
-    calculate days remaining to hit target.
+    Read only the rows appended to csv since `source` (size, sha1, columns) was recorded
+    Returns None if the previously processed bytes were changed upstream
     """
-    target_pop = target_pop*target_pct
-
-    az_dose2_list_21 = az_dose2_list[:PFSN_DOSE_INT]
-    az_dose2_list_beyond_21 = az_dose2_list[PFSN_DOSE_INT:]
-
-    remaining = 0
-    days_remaining = 0
-    days_remaining_21d_after = 0
-    # project 21 days and beyond
-    projected_sum_21d = current_vax_total + \
-        sum(pfsn_dose2_list) + sum(az_dose2_list_21)
-    days_remaining_21d = 0
-    if projected_sum_21d < target_pop:
-        days_remaining_21d = PFSN_DOSE_INT
-        current_vax_total = projected_sum_21d
-        remaining = target_pop - current_vax_total
-    else:
-        #
-        for i in range(PFSN_DOSE_INT):
-            current_vax_total = current_vax_total + \
-                pfsn_dose2_list[i] + az_dose2_list[i]
+    if os.path.getsize(csv_path) < source['size'] or file_sha1(csv_path, source['size']) != source['sha1']:
+        return None
+    with open(csv_path, 'rb') as fp:
+        fp.seek(source['size'])
+        tail = fp.read()
+    return read_source_csv(csv_path, io.BytesIO(tail), source['columns'])
 
-            if current_vax_total > target_pop:
-                break
-            else:
-                remaining = target_pop - current_vax_total
-            days_remaining_21d += 1
-    #         print(
-    #             f'Day {days_remaining_21d}: Fully vaxed: {current_vax_total}, remaining {remaining}')
-    # print(
-    #     f'End of {days_remaining_21d} days: Fully vaxed: {current_vax_total}, remaining {remaining}')
 
-    # project next 42 days (21 days to 63 days)
-    if remaining > 0:
-        # target 42 days and beyond
-        projected_sum_63d = current_vax_total + \
-            sum(az_dose2_list_beyond_21) + \
-            (pfsn_vax_rate*(AZ_DOSE_INT-PFSN_DOSE_INT))
-        days_remaining_21d_after = 0
-        if projected_sum_63d < target_pop:
-            days_remaining_21d_after = AZ_DOSE_INT-PFSN_DOSE_INT
-            current_vax_total = projected_sum_63d
-            remaining = target_pop - current_vax_total
-
-            # if still remaining beyond 63 days
-            if remaining > 0:
-                days_remaining = remaining/(pfsn_vax_rate + az_vax_rate)
-                remaining = 0
-                # print(f'End of {days_remaining+days_remaining_21d+days_remaining_21d_after} days (++ {days_remaining} days): Fully vaxed: {current_vax_total}, remaining {remaining}')
+def load_loader_state(state_file, dfpop, national_csv, state_csv, hashes):
+    """
+    Bring persisted dfvs, cumulative sums and target hits up to date with newly appended rows
+    Returns them and whether they differ from the persisted state: rows were appended or the csvs
+    no longer match the recorded `hashes` (digests by path, see `sources.source_hashes`)
+    Returns None if there is no usable state and a full rebuild is needed:
+    no previous run, population, regions, bands, targets or source schemas changed, or upstream revised
+    historical rows
+    """
+    if not state_file.exists():
+        return None
+    with open(state_file, 'rb') as fp:
+        loader_state = pickle.load(fp)
+    if loader_state['version'] != LOADER_STATE_VERSION or loader_state['targets'] != MILESTONE_TARGETS \
+            or loader_state['pop'] != population_fingerprint(dfpop) \
+            or loader_state.get('regions') != regions_fingerprint() or loader_state.get('bands') != POP_BANDS \
+            or loader_state.get('schemas') != [schema_fingerprint(national_csv), schema_fingerprint(state_csv)]:
+        logger.warning(f'{bcolors.WARNING}Loader state outdated{bcolors.ENDC}: full rebuild')
+        return None
+
+    delta_n = read_appended_rows(national_csv, loader_state['sources'][str(national_csv)])
+    delta_s = read_appended_rows(state_csv, loader_state['sources'][str(state_csv)])
+    if delta_n is None or delta_s is None:
+        logger.warning(f'{bcolors.WARNING}Historical rows revised upstream{bcolors.ENDC}: full rebuild')
+        return None
+
+    dfvs, cumuls, state_target_hits = loader_state['dfvs'], loader_state['cumuls'], loader_state['target_hits']
+    if delta_n.empty and delta_s.empty:
+        is_changed = any(loader_state['sources'][str(csv_path)]['sha1'] != hashes[str(csv_path)]
+                         for csv_path in [national_csv, state_csv])
+        return dfvs, cumuls, state_target_hits, is_changed
+
+    dfvs_delta = combine_national_state(delta_n, delta_s)
+    last_date = dfvs.index.get_level_values('date_dt').max()
+    if dfvs_delta.index.get_level_values('date_dt').min() <= last_date:
+        logger.warning(f'{bcolors.WARNING}Appended rows overlap processed dates{bcolors.ENDC}: full rebuild')
+        return None
+    logger.info(f'Incremental update: {len(dfvs_delta)} new rows after {last_date:%Y-%m-%d}')
+
+    if cumuls is not None:
+        cumuls = cumuls.add(dfvs_delta.groupby('state')[cumuls.columns.tolist()].sum(), fill_value=0)
+        dfvs_delta = add_vax_columns(dfvs_delta, dfpop)
+        # only targets not yet hit can be crossed in the new rows
+        delta_hits = find_target_hits(dfvs_delta)
+        for pop_level, state_hits in delta_hits.items():
+            for state_name, hits in state_hits.items():
+                prev_hits = state_target_hits[pop_level].setdefault(state_name, {})
+                for target, hit in hits.items():
+                    prev_hits.setdefault(target, hit)
+    dfvs = categorical_states(pd.concat([dfvs, dfvs_delta]))
+    return dfvs, cumuls, state_target_hits, True
+
+
+def save_loader_state(state_file, dfpop, national_csv, state_csv, hashes, dfvs, cumuls, state_target_hits):
+    """
+    Persist processed data with the size and hash of the source csvs it was built from
+    `hashes` are the digests the build started from, if a csv changed since then the sizes don't
+    match them and the next run rebuilds in full
+    """
+    sources = {}
+    for csv_path in [national_csv, state_csv]:
+        with open(csv_path, 'rb') as fp:
+            header = fp.readline().decode().strip()
+        sources[str(csv_path)] = {'size': os.path.getsize(csv_path),
+                                  'sha1': hashes[str(csv_path)],
+                                  'columns': header.split(',')}
+    loader_state = {'version': LOADER_STATE_VERSION,
+                    'targets': MILESTONE_TARGETS,
+                    'pop': population_fingerprint(dfpop),
+                    'regions': regions_fingerprint(),
+                    'bands': POP_BANDS,
+                    'schemas': [schema_fingerprint(national_csv), schema_fingerprint(state_csv)],
+                    'sources': sources,
+                    'dfvs': dfvs,
+                    'cumuls': cumuls,
+                    'target_hits': state_target_hits}
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = state_file.with_suffix('.tmp')
+    with open(tmp_file, 'wb') as fp:
+        pickle.dump(loader_state, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, state_file)
+
+
+def find_target_hits(dfvs, targets=MILESTONE_TARGETS):
+    """
+    Find first date each state crossed each target, for every pop band in one pass.
+    Pivots the cumulative dose 2 pct of all bands to a (band x date x state) array, takes the running
+    max down the date axis and counts rows below each target to get the first crossing row.
+    Returns {pop_level: {state: {target: (date hit, dose 2 on that date)}}}
+    """
+    dates = dfvs.index.get_level_values('date_dt').unique().sort_values()
+    states = dfvs.index.get_level_values('state').unique().sort_values()
+    grid = pd.MultiIndex.from_product([dates, states], names=['date_dt', 'state'])
+
+    # (band x date x state) arrays, missing days are nan and never count as a hit
+    # only the band columns are reindexed, not the whole frame
+    band_cols = [f'dose2_pct_{pop_level}' for pop_level in POP_BANDS] + [band['dose2'] for band in POP_BANDS.values()]
+    dfvs_grid = dfvs[band_cols].reindex(grid)
+    pct = np.stack([dfvs_grid[f'dose2_pct_{pop_level}'].to_numpy(dtype=float).reshape(len(dates), len(states))
+                    for pop_level in POP_BANDS])
+    dose2 = np.stack([dfvs_grid[band['dose2']].to_numpy().reshape(len(dates), len(states))
+                      for band in POP_BANDS.values()])
+    pct_runmax = np.fmax.accumulate(pct, axis=1)
+
+    # first row where running max > target == number of rows not above target, (band x state x target)
+    first_hit = (~(pct_runmax[..., None] > np.asarray(targets))).sum(axis=1)
 
-        else:
-            # target within next 42 days
-            for i in range(AZ_DOSE_INT-PFSN_DOSE_INT):
-                current_vax_total = current_vax_total + pfsn_vax_rate + \
-                    az_dose2_list_beyond_21[i]
-                if current_vax_total > target_pop:
-                    break
-                else:
-                    remaining = target_pop - current_vax_total
-
-                days_remaining_21d_after += 1
-            #     print(
-            #         f'Day {days_remaining_21d+days_remaining_21d_after}: Fully vaxed: {round(current_vax_total,2)}, pfsn: {round(pfsn_vax_rate,2)}, az2: {round(az_dose2_list_beyond_21[i],2)}, remaining {round(remaining,2)}')
-            # print(f'End of {days_remaining_21d+days_remaining_21d_after} days (+ {days_remaining_21d_after} days): Fully vaxed: {current_vax_total}, remaining {remaining}')
-
-    days_remaining = days_remaining+days_remaining_21d+days_remaining_21d_after
+    state_target_hits = {}
+    for b_idx, pop_level in enumerate(POP_BANDS):
+        state_target_hits[pop_level] = {state_name: {} for state_name in states}
+        for s_idx, state_name in enumerate(states):
+            for t_idx, target in enumerate(targets):
+                d_idx = first_hit[b_idx, s_idx, t_idx]
+                if d_idx < len(dates):
+                    target_hit_date = datetime.combine(dates[d_idx], datetime.min.time())
+                    target_hit_dose2 = dose2[b_idx, d_idx, s_idx]
+                    state_target_hits[pop_level][state_name][target] = (target_hit_date, target_hit_dose2)
+                    logger.debug(f'{state_name} hit {target} target at {target_hit_date} achieving {target_hit_dose2}')
+    return state_target_hits
+
+
+def prepare_doses_byvax_data(dfvs_period, avg_pf_rate, avg_sn_rate, avg_az_rate, pf_dose2, sn_dose2, az_dose2):
+    """
+    Daily doses by vax type for all states: last `PERIOD_WINDOW` days plus 7 projected days
+    Built column-wise from the period window frame and the (states x days) dose 2 pending frames
+    Returns {state: [daily records]}
+    """
+    # state contiguous rows, last PERIOD_WINDOW days per state
+    dfvs_period = dfvs_period.sort_index(level=['state', 'date_dt']).groupby('state').tail(PERIOD_WINDOW)
+    states, state_counts = np.unique(dfvs_period.index.get_level_values('state'), return_counts=True)
+    state_ends = np.cumsum(state_counts)
+
+    def fmt_counts(values):
+        return [f'{x:,}' for x in values.tolist()]
+
+    daily_cols = {
+        'date': dfvs_period['date'].tolist(),
+        'dose1_pfizer': dfvs_period['pfizer1'].tolist(),
+        'dose1_sino': dfvs_period['sinovac1'].tolist(),
+        'dose1_astra': dfvs_period['astra1'].tolist(),
+        'dose1_display': fmt_counts(dfvs_period['daily_partial']),
+        'dose2_pfizer': dfvs_period['pfizer2'].tolist(),
+        'dose2_sino': dfvs_period['sinovac2'].tolist(),
+        'dose2_astra': dfvs_period['astra2'].tolist(),
+        'dose2_cansino': dfvs_period['cansino'].tolist(),
+        'dose2_display': fmt_counts(dfvs_period['daily_full']),
+        'full_display': fmt_counts(dfvs_period['daily']),
+    }
+    daily_records = [dict(zip(daily_cols.keys(), row)) for row in zip(*daily_cols.values())]
+
+    # projected next 7 days: dose 1 at average rate, dose 2 from dose 1 given one interval ago
+    pf_rate = avg_pf_rate[states].to_numpy()
+    sn_rate = avg_sn_rate[states].to_numpy()
+    az_rate = avg_az_rate[states].to_numpy()
+    pf_dose2 = pf_dose2.loc[states].to_numpy()[:, :7]
+    sn_dose2 = sn_dose2.loc[states].to_numpy()[:, :7]
+    az_dose2 = az_dose2.loc[states].to_numpy()[:, :7]
+    avg_rate_total = np.rint(pf_rate + sn_rate + az_rate).astype(int)
+    dose2_total = pf_dose2 + sn_dose2 + az_dose2
+    full_total = avg_rate_total[:, None] + dose2_total
+
+    last_dates = dfvs_period.index.get_level_values('date_dt')[state_ends - 1]
+    proj_cols = {
+        'date': [[(last_date + timedelta(days=ind+1)).strftime("%Y-%m-%d") for ind in range(7)] for last_date in last_dates],
+        'dose1_pfizer': np.repeat(np.round(pf_rate, 0)[:, None], 7, axis=1).tolist(),
+        'dose1_sino': np.repeat(np.round(sn_rate, 0)[:, None], 7, axis=1).tolist(),
+        'dose1_astra': np.repeat(np.round(az_rate, 0)[:, None], 7, axis=1).tolist(),
+        'dose1_display': [[f'{x:,}'] * 7 for x in avg_rate_total.tolist()],
+        'dose2_pfizer': pf_dose2.tolist(),
+        'dose2_sino': sn_dose2.tolist(),
+        'dose2_astra': az_dose2.tolist(),
+        'dose2_cansino': [[0] * 7] * len(states),  # TODO: include average rate of cansino doses
+        'dose2_display': [[f'{x:,}' for x in row] for row in dose2_total.tolist()],
+        'full_display': [[f'{x:,}' for x in row] for row in full_total.tolist()],
+    }
+
+    state_doses_data_byvax = {}
+    for s_idx, state_name in enumerate(states):
+        state_start = state_ends[s_idx] - state_counts[s_idx]
+        daily_data = daily_records[state_start:state_ends[s_idx]]
+        daily_data.extend(dict(zip(proj_cols.keys(), row), projection=True)
+                          for row in zip(*(col[s_idx] for col in proj_cols.values())))
+        state_doses_data_byvax[state_name] = daily_data
+    return state_doses_data_byvax
+
+
+def dose2_matrix(dose2_lists, n_days):
+    """Stack per state pending dose 2 lists into a (states x n_days) array, zero padded"""
+    matrix = np.zeros((len(dose2_lists), n_days))
+    if isinstance(dose2_lists, np.ndarray) and dose2_lists.ndim == 2:
+        # already a matrix, e.g. from `rolling_state_stats` or backfill windows
+        dose2_lists = dose2_lists[:, :n_days]
+        matrix[:, :dose2_lists.shape[1]] = dose2_lists
+        return matrix
+    for s_idx, dose2_list in enumerate(dose2_lists):
+        dose2_list = np.atleast_1d(np.asarray(dose2_list, dtype=float))[:n_days]
+        matrix[s_idx, :len(dose2_list)] = dose2_list
+    return matrix
+
+
+def sequential_cumsum(first, *increments):
+    """
+    Running totals of `first` + increments[0][.., 0] + increments[1][.., 0] + increments[0][.., 1] ...
+    added in the same order as a Python loop so float results match it exactly
+    Returns running total after each full step, shape (..., n_days)
+    """
+    n_days = increments[0].shape[-1]
+    steps = np.empty(first.shape + (1 + len(increments)*n_days,))
+    steps[..., 0] = first
+    for i, increment in enumerate(increments):
+        steps[..., 1 + i::len(increments)] = increment
+    return np.cumsum(steps, axis=-1)[..., len(increments)::len(increments)]
+
+
+def first_above(running, target):
+    """Index of first day running total > target (n_days if never) and whether it was found"""
+    above = running > target[..., None]
+    return np.where(above.any(axis=-1), above.argmax(axis=-1), running.shape[-1]), above.any(axis=-1)
+
+
+def project_days_to_targets(target_pcts, target_pops, pfsn_vax_rates, az_vax_rates, current_vax_totals, pfsn_dose2_lists, az_dose2_lists, pfsn_dose_int=PFSN_DOSE_INT, az_dose_int=AZ_DOSE_INT):
+    """
+    Days remaining to hit each target for many states in one call, array form of
+    `estimate_complete_by_target`. Pending dose 2 come from dose 1 given one interval ago:
+    first `pfsn_dose_int` days from pfizer/sinovac and AZ lists, up to `az_dose_int` days from AZ
+    list and pfizer/sinovac average rate, then both average rates.
+    Running totals are cumulative sums over the projected curve, crossing day is the first day above target.
+    Returns (states x targets) array of days remaining
+    """
+    n_az_after = az_dose_int - pfsn_dose_int
+    target_pop = np.asarray(target_pops, dtype=float)[:, None] * np.asarray(target_pcts, dtype=float)[None, :]
+    pfsn_vax_rate = np.asarray(pfsn_vax_rates, dtype=float)[:, None]
+    az_vax_rate = np.asarray(az_vax_rates, dtype=float)[:, None]
+    current_vax_total = np.asarray(current_vax_totals, dtype=float)
+    pfsn_dose2 = dose2_matrix(pfsn_dose2_lists, pfsn_dose_int)
+    az_dose2 = dose2_matrix(az_dose2_lists, az_dose_int)
+    az_dose2_21, az_dose2_beyond_21 = az_dose2[:, :pfsn_dose_int], az_dose2[:, pfsn_dose_int:]
+
+    # project 21 days: (states x 21)
+    projected_sum_21d = (current_vax_total + sequential_cumsum(np.zeros(len(pfsn_dose2)), pfsn_dose2)[:, -1]) + \
+        sequential_cumsum(np.zeros(len(az_dose2)), az_dose2_21)[:, -1]
+    running_21d = sequential_cumsum(current_vax_total, pfsn_dose2, az_dose2_21)
+    running_21d = np.broadcast_to(running_21d[:, None, :], target_pop.shape + (pfsn_dose_int,))
+    hit_day, _ = first_above(running_21d, target_pop)
+    hit_day_clip = np.minimum(hit_day, pfsn_dose_int - 1)
+    vax_total_at_hit = np.take_along_axis(running_21d, hit_day_clip[..., None], axis=-1)[..., 0]
+    vax_total_before_hit = np.take_along_axis(running_21d, np.maximum(hit_day - 1, 0)[..., None], axis=-1)[..., 0]
+
+    within_21d = (projected_sum_21d[:, None] >= target_pop)
+    days_remaining_21d = np.where(within_21d, hit_day, pfsn_dose_int)
+    current_total_21d = np.where(within_21d, vax_total_at_hit, projected_sum_21d[:, None])
+    # remaining is only updated on days the target was not passed
+    remaining = np.where(within_21d, np.where(hit_day > 0, target_pop - vax_total_before_hit, 0),
+                         target_pop - projected_sum_21d[:, None])
+
+    # project next 42 days (21 days to 63 days)
+    projected_sum_63d = (current_total_21d + sequential_cumsum(np.zeros(len(az_dose2)), az_dose2_beyond_21)[:, -1][:, None]) + \
+        (pfsn_vax_rate*n_az_after)
+    within_63d = projected_sum_63d >= target_pop
+    running_63d = sequential_cumsum(current_total_21d, np.broadcast_to(pfsn_vax_rate[..., None], target_pop.shape + (n_az_after,)),
+                                    np.broadcast_to(az_dose2_beyond_21[:, None, :], target_pop.shape + (n_az_after,)))
+    hit_day_63d, _ = first_above(running_63d, target_pop)
+    remaining_63d = target_pop - projected_sum_63d
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_remaining_beyond = np.where(remaining_63d > 0, remaining_63d/(pfsn_vax_rate + az_vax_rate), 0)
+
+    is_after_21d = remaining > 0
+    days_remaining_21d_after = np.where(is_after_21d, np.where(within_63d, hit_day_63d, n_az_after), 0)
+    days_remaining = np.where(is_after_21d & ~within_63d, days_remaining_beyond, 0)
+    return (days_remaining + days_remaining_21d) + days_remaining_21d_after
+
+
+def projected_target_date(days_remaining, start_date):
+    """Target date from projected days remaining, days kept as int when projection lands on a whole day"""
+    days_remaining = float(days_remaining)
+    if days_remaining.is_integer():
+        days_remaining = int(days_remaining)
     target_date = start_date + timedelta(days=days_remaining + 1)
 
     if target_date <= date.today():
-        print(f'\t{bcolors.OKBLUE}Check{bcolors.ENDC}: Target date has passed')
+        logger.debug(f'\t{bcolors.OKBLUE}Check{bcolors.ENDC}: Target date has passed')
 
     return days_remaining, target_date
 
 
-def summary_by_state(state_name, dfpop, dfvs, dfrs, pop_level='adult', state_target_hits={}):
-    """Calculate progress summary and projections by state"""
-    dfr = dfrs.loc[state_name]
-    
-    if pop_level == 'adult':
-        total_pop = dfpop.loc[state_name]['pop_18']
-        total_reg = dfr.total - dfr.children
-    elif pop_level == 'child':
-        total_pop = dfpop.loc[state_name]['pop_12']
-        total_reg = dfr.children
-    else:
-        total_pop = dfpop.loc[state_name]['pop']
-        total_reg = dfr.total
+def estimate_complete_by_target(target_pct, target_pop, pfsn_vax_rate, az_vax_rate, current_vax_total, pfsn_dose2_list=[], az_dose2_list=[], start_date=date.today()):
+    """
+    Given target percent, target pop and current progress and rate, 
+    calculate days remaining to hit target.
+    """
+    days_remaining = project_days_to_targets([target_pct], [target_pop], [pfsn_vax_rate], [az_vax_rate],
+                                             [current_vax_total], [pfsn_dose2_list], [az_dose2_list])[0, 0]
+    return projected_target_date(days_remaining, start_date)
+
+
+def pop_level_totals(state_name, dfpop, dfrs, pop_level='adult'):
+    """
+    Population and registrations of a state, or of a list of states as series, for the given pop level
+    With a list of pop levels, (bands x states) arrays for a list of states
+    """
+    if not isinstance(pop_level, str):
+        totals = [pop_level_totals(state_name, dfpop, dfrs, band) for band in pop_level]
+        return tuple(np.stack([np.asarray(band_totals[i]) for band_totals in totals]) for i in range(2))
+    band = POP_BANDS[pop_level]
+    return dfpop.loc[state_name][band['pop']], dfrs.loc[state_name][band['reg']]
+
+
+def band_values(dfvn, pop_level, field):
+    """Latest `POP_BANDS` column of one pop level, or (bands x states) array of a list of them"""
+    if isinstance(pop_level, str):
+        return getattr(dfvn, POP_BANDS[pop_level][field])
+    return np.stack([getattr(dfvn, POP_BANDS[band][field]) for band in pop_level])
+
+
+def summary_by_state(state_name, dfpop, dfvs, dfrs, pop_level='adult', state_target_hits={}, progress_numbers=None):
+    """
+    Calculate progress summary and projections by state
+    `progress_numbers` is the state's part of `overall_progress_numbers` for all states, computed here if not given
+    """
+    total_pop, total_reg = pop_level_totals(state_name, dfpop, dfrs, pop_level)
 
     # get latest values
-    dfv = dfvs.loc[state_name]
-    progress_data = {}
-    progress_data[pop_level], pfsn_vax_rate, az_vax_rate, pfsn_dose2_list, az_dose2_list, latest_dose2_total = calculate_overall_progress(
-        total_pop, total_reg, dfv, pop_level)
+    dfv = dfvs.state(state_name)
+    if progress_numbers is None:
+        with instrument.stage('calculate_overall_progress', state=state_name, pop_level=pop_level):
+            progress_numbers = overall_progress_numbers(total_pop, total_reg, dfv, pop_level)
+    progress_data = {pop_level: format_progress(progress_numbers)}
+    pfsn_vax_rate, az_vax_rate = dfv.avg_pfsn_rate, dfv.avg_az_rate
+    pfsn_dose2_list, az_dose2_list = dfv.pfsn_dose2, dfv.az_dose2
+    latest_dose2_total = progress_numbers['latest_dose2_total']
 
     # projection_start_date = date.today() + timedelta(AVG_DOSE_INT-1)
     projection_start_date = dfv.date_dt
 
     # build timeline data
     milestones = {}
-    milestones[pop_level], herd_date_total, herd_days_total = calculate_milestone_projections(state_name,
-        pop_level, total_pop, pfsn_vax_rate, az_vax_rate, latest_dose2_total, pfsn_dose2_list, az_dose2_list, projection_start_date, state_target_hits[state_name])
+    with instrument.stage('calculate_milestone_projections', state=state_name, pop_level=pop_level):
+        milestones[pop_level], herd_date_total, herd_days_total = calculate_milestone_projections(state_name,
+            pop_level, total_pop, pfsn_vax_rate, az_vax_rate, latest_dose2_total, pfsn_dose2_list, az_dose2_list, projection_start_date, state_target_hits[state_name],
+            progress_numbers.get('days_to_targets'))
 
     
     # visualize next 7 days
@@ -413,260 +839,230 @@ def summary_by_state(state_name, dfpop, dfvs, dfrs, pop_level='adult', state_tar
         'herd_date_dp': progress_data[pop_level]['herd_date_dp']
     }
 
-    # exceed bar charts - fix by chipping the extra off the FULL bar
-    sum_pct = sum([state_chart_data['full'], state_chart_data['partial'],
-                  state_chart_data['reg'], state_chart_data['unreg']])
-    if sum_pct > 1.0:
-        exceed = sum_pct - 1
-        if 'unreg' in state_chart_data.keys() and state_chart_data['unreg'] > 0 and abs(exceed) > 0:
-            if state_chart_data['unreg'] > 0 and exceed > state_chart_data['unreg']:
-                exceed -= state_chart_data['unreg']
-                state_chart_data['unreg'] = 0
-            else:
-                state_chart_data['unreg'] -= exceed
-                exceed = 0
-
-        if 'reg' in state_chart_data.keys() and state_chart_data['reg'] > 0 and abs(exceed) > 0:
-            if abs(exceed) > state_chart_data['reg']:
-                exceed -= state_chart_data['reg']
-                state_chart_data['reg'] = 0
-            else:
-                state_chart_data['reg'] -= exceed
-                exceed = 0
-        if 'partial' in state_chart_data.keys() and state_chart_data['partial'] > 0 and abs(exceed) > 0:
-            if abs(exceed) > state_chart_data['partial']:
-                exceed -= state_chart_data['partial']
-                state_chart_data['partial'] = 0
-            else:
-                state_chart_data['partial'] -= exceed
-                exceed = 0
-
-        if 'full' in state_chart_data.keys() and state_chart_data['full'] > 0 and abs(exceed) > 0:
-            if abs(exceed) > state_chart_data['full']:
-                exceed -= state_chart_data['full']
-                state_chart_data['full'] = 0
-            else:
-                state_chart_data['full'] -= abs(exceed)
-                exceed = 0
-
-        sum_pct_new = sum([state_chart_data['full'], state_chart_data['partial'],
-                  state_chart_data['reg'], state_chart_data['unreg']])
-
-        print(f'State chart: {state_name} ori sum_pct {sum_pct} new sum_pct {sum_pct_new}')
+    # exceed bar charts - fix by chipping the extra off the exported (rounded) shares, from unreg down to full
+    chart_segments = ['full', 'partial', 'reg', 'unreg']
+    chart_bars = [state_chart_data[segment] for segment in chart_segments]
+    clamped_bars, is_chart_adjusted = clamp_bar_segments(chart_bars)
+    if is_chart_adjusted:
+        state_chart_data.update(zip(chart_segments, clamped_bars.tolist()))
+        logger.debug(f"State chart: {state_name} ori sum_pct {sum(chart_bars)} new sum_pct {clamped_bars.sum()}")
 
     return progress_data, milestones, state_chart_data, herd_date_total, first_dose_7d, second_dose_7d
 
 
-def calculate_overall_progress(total_pop, total_reg, dfvn, pop_level):
+def clamp_bar_segments(segments, n_cut=None, carry=True):
+    """
+    Take the excess over 100% off stacked progress bars, for all states at once
+    `segments` is (n_states x n_segments) shares in bar order (full, partial, reg, unreg), or one bar.
+    The excess is cut from the last `n_cut` segments (all by default), last segment first. With `carry`,
+    excess left once a segment reaches zero moves on to the segment before it, otherwise only the
+    last non-zero segment is cut and the bar may stay over 100%.
+    Returns clamped copy of `segments` and mask of bars that were cut
+    """
+    segments = np.array(segments, dtype=float)
+    n_segments = segments.shape[-1]
+    n_cut = n_segments if n_cut is None else n_cut
+    sum_pct = segments.sum(axis=-1)
+    exceed = np.where(sum_pct > 1.0, sum_pct - 1.0, 0.0)
+    is_adjusted = np.zeros(sum_pct.shape, dtype=bool)
+    for seg_idx in range(n_segments - 1, n_segments - 1 - n_cut, -1):
+        segment = segments[..., seg_idx]
+        is_cut = (segment > 0) & (exceed > 0)
+        cut = np.minimum(segment, exceed)
+        segments[..., seg_idx] = np.where(is_cut, segment - cut, segment)
+        exceed = np.where(is_cut, exceed - cut if carry else 0.0, exceed)
+        is_adjusted |= is_cut
+    return segments, is_adjusted
+
+
+def overall_progress_numbers(total_pop, total_reg, dfvn, pop_level):
     """
-    State level progress milestones and rates based on latest data.
-    Takes in filtered `total_pop` and `total_reg` based on total or adult level.
-    Returns: 
-        progress data dictionary
-        projected_dose2_date: 
-            Average dose 1 rate: projection based on dose 1 + dose interval = future dose 2 rate
-        projected_dose2_total:
-            Project total of dose 2 in next dose interval days based on dose 1 + latest actual dose 2
+    Numeric core of state level progress: counts, shares and rates based on latest data.
+    Takes in filtered `total_pop` and `total_reg` of the pop level.
+    Element-wise, so it runs for one state (`StateVax` and scalars), for all states at once
+    (`LatestVax` and arrays in the same state order) or for all bands and states with a list of
+    pop levels and (bands x states) totals. No display strings, see `format_progress`.
+    Returns dict of numbers, per state values broadcast against the per band ones
     """
     # get latest values
     latest_total = dfvn.cumul  # total administered
-    latest_cansino_cumul = dfvn.cansino2_cumul
 
     # cumul_partial is now unique individuals vaxxed (incl at least dose 1, cansino)
-    if pop_level == 'adult':
-        latest_dose1_total = dfvn.cumul_partial_adult
-        latest_dose2_total = dfvn.cumul_full_adult
-    elif pop_level == 'child':
-        latest_dose1_total = dfvn.cumul_partial_child
-        latest_dose2_total = dfvn.cumul_full_child
-    else:
-        latest_dose1_total = dfvn.cumul_partial
-        latest_dose2_total = dfvn.cumul_full
-    
+    latest_dose1_total = band_values(dfvn, pop_level, 'dose1')
+    latest_dose2_total = band_values(dfvn, pop_level, 'dose2')
+
     # received only one dose (partially vaxxed) - waiting for 2nd dose 
     # cansino gets cancelled out here
     latest_partial_vax = latest_dose1_total - latest_dose2_total 
-    latest_daily_rate = dfvn.daily
-    latest_daily_dose1 = dfvn.daily_partial
-    latest_daily_dose2 = dfvn.daily_full
-    latest_date = dfvn.index.max()
-
-    # boolean to indicate increase or decrease in daily rate
-    is_daily_rate_incr = dfvn.is_daily_rate_incr
-    latest_rate_per_100 = latest_daily_rate/total_pop*100
-
-    projected_dose2_total_list = dfvn.projected_dose2_total_list
-
-    avg_dose1_rate = dfvn.avg_dose1_rate
-    avg_dose2_rate = dfvn.avg_dose2_rate
-    avg_total_rate = dfvn.avg_total_rate
-    avg_rate_per_100 = dfvn.avg_total_rate/total_pop*100
-
-    is_avg_rate_incr = dfvn.is_avg_rate_incr
-
-    # calculating percentages - vax type breakdown pct wrt to dose group
-    dose2_pct = latest_dose2_total/total_pop  # fully vaxxed
-    dose2_pf_pct = dfvn.pfizer2_cumul/latest_dose2_total  # fully vaxxed
-    dose2_sn_pct = dfvn.sinovac2_cumul/latest_dose2_total  # fully vaxxed
-    dose2_az_pct = dfvn.astra2_cumul/latest_dose2_total  # fully vaxxed
-    dose2_cn_pct = dfvn.cansino2_cumul/latest_dose2_total  # fully vaxxed
-    partial_pct = latest_partial_vax/total_pop  # partially vaxxed
 
     # if pop_level == "adult":
     #     # assuming kids are vax mostly with pfizer
     #     partial_pf = dfvn.pfizer1_cumul - dfvn.pfizer2_cumul - dfvn.cumul_partial_child
     # else:
     partial_pf = dfvn.pfizer1_cumul - dfvn.pfizer2_cumul
-
-    partial_pf_pct = partial_pf/latest_partial_vax  # partially vaxxed
-    partial_sn_pct = (dfvn.sinovac1_cumul - dfvn.sinovac2_cumul) / \
-        latest_partial_vax  # partially vaxxed
-    partial_az_pct = (dfvn.astra1_cumul - dfvn.astra2_cumul) / \
-        latest_partial_vax  # partially vaxxed
-
-    # percentages wrt full progress bar
-    dose2_sn_bar_pct = dfvn.sinovac2_cumul/total_pop
-    dose2_pf_bar_pct = dfvn.pfizer2_cumul/total_pop
-    dose2_az_bar_pct = dfvn.astra2_cumul/total_pop
-    dose2_cn_bar_pct = dfvn.cansino2_cumul/total_pop
-    partial_pf_bar_pct = partial_pf / \
-        total_pop
-    partial_sn_bar_pct = (dfvn.sinovac1_cumul - dfvn.sinovac2_cumul) / \
-        total_pop
-    partial_az_bar_pct = (dfvn.astra1_cumul - dfvn.astra2_cumul) / \
-        total_pop
+    partial_sn = dfvn.sinovac1_cumul - dfvn.sinovac2_cumul
+    partial_az = dfvn.astra1_cumul - dfvn.astra2_cumul
 
     # registered but unvaccinated
     # this should contrasted from latest cumul_partial
-    total_reg_unvaxed = max(total_reg - latest_dose1_total, 0)
-    total_reg_unvaxed_pct = max(total_reg_unvaxed/total_pop, 0)
-
-    total_unreg = max(total_pop - total_reg, 0)
-    total_unreg_pct = max(total_unreg/total_pop, 0)
+    total_reg_unvaxed = np.maximum(total_reg - latest_dose1_total, 0)
+    total_unreg = np.maximum(total_pop - total_reg, 0)
+
+    numbers = {
+        'date_dt': dfvn.date_dt,
+        'total_pop': total_pop,
+        'total_reg': total_reg,
+        'latest_total': latest_total,
+        'latest_dose1_total': latest_dose1_total,
+        'latest_dose2_total': latest_dose2_total,
+        'latest_partial_vax': latest_partial_vax,
+        'latest_daily_rate': dfvn.daily,
+        'latest_daily_dose1': dfvn.daily_partial,
+        'latest_daily_dose2': dfvn.daily_full,
+        'latest_rate_per_100': dfvn.daily/total_pop*100,
+        # boolean to indicate increase or decrease in daily rate
+        'is_daily_rate_incr': dfvn.is_daily_rate_incr,
+        'avg_dose1_rate': dfvn.avg_dose1_rate,
+        'avg_dose2_rate': dfvn.avg_dose2_rate,
+        'avg_total_rate': dfvn.avg_total_rate,
+        'avg_rate_per_100': dfvn.avg_total_rate/total_pop*100,
+        'is_avg_rate_incr': dfvn.is_avg_rate_incr,
+
+        # calculating percentages - vax type breakdown pct wrt to dose group
+        'dose2_pct': latest_dose2_total/total_pop,  # fully vaxxed
+        'dose2_pf_pct': dfvn.pfizer2_cumul/latest_dose2_total,
+        'dose2_sn_pct': dfvn.sinovac2_cumul/latest_dose2_total,
+        'dose2_az_pct': dfvn.astra2_cumul/latest_dose2_total,
+        'dose2_cn_pct': dfvn.cansino2_cumul/latest_dose2_total,
+        'dose2_pf': dfvn.pfizer2_cumul,
+        'dose2_sn': dfvn.sinovac2_cumul,
+        'dose2_az': dfvn.astra2_cumul,
+        'dose2_cn': dfvn.cansino2_cumul,
+        'partial_pct': latest_partial_vax/total_pop,  # partially vaxxed
+        'partial_pf_pct': partial_pf/latest_partial_vax,
+        'partial_sn_pct': partial_sn/latest_partial_vax,
+        'partial_az_pct': partial_az/latest_partial_vax,
+        'partial_pf': partial_pf,
+        'partial_sn': partial_sn,
+        'partial_az': partial_az,
+
+        # percentages wrt full progress bar
+        'dose2_pf_bar_pct': dfvn.pfizer2_cumul/total_pop,
+        'dose2_sn_bar_pct': dfvn.sinovac2_cumul/total_pop,
+        'dose2_az_bar_pct': dfvn.astra2_cumul/total_pop,
+        'dose2_cn_bar_pct': dfvn.cansino2_cumul/total_pop,
+        'partial_pf_bar_pct': partial_pf/total_pop,
+        'partial_sn_bar_pct': partial_sn/total_pop,
+        'partial_az_bar_pct': partial_az/total_pop,
+
+        'total_reg_unvaxed': total_reg_unvaxed,
+        'total_reg_unvaxed_pct': np.maximum(total_reg_unvaxed/total_pop, 0),
+        'total_unreg': total_unreg,
+        'total_unreg_pct': np.maximum(total_unreg/total_pop, 0),
+    }
 
     # adjust for more than 100% - else graphs will break
-    partial_pct_disp = None
-    sum_pct = sum(
-        [dose2_pct, partial_pct, total_reg_unvaxed_pct, total_unreg_pct])
-    if sum_pct > 1.0:
-        print(f'sum_pct: {sum_pct}')
-        # adjust unreg_pct if not zero
-        if total_unreg_pct > 0:
-            print('\t Adjusting total_unreg_pct')
-            total_unreg_pct = max(total_unreg_pct - (sum_pct - 1.0), 0)
-        elif total_reg_unvaxed_pct > 0:
-            print('\t Adjusting total_reg_unvaxed_pct')
-            total_reg_unvaxed_pct = total_reg_unvaxed_pct - (sum_pct - 1.0)
-            if total_reg_unvaxed_pct < 0:
-                diff = abs(total_reg_unvaxed_pct)
-                total_reg_unvaxed_pct = 0
-                # partial_pct_disp = partial_pct 
-                # partial_pf_pct_disp = partial_pf_pct*partial_pct_disp
-                # partial_sn_pct_disp = partial_sn_pct*partial_pct_disp
-                # partial_az_pct_disp = partial_az_pct*partial_pct_disp
-        print(
-            f'\tNew sum_pct {sum([dose2_pct, partial_pct, total_reg_unvaxed_pct, total_unreg_pct])}')
-
-    # build json
+    # take the excess off unreg if not zero, else off reg_unvaxed
+    bars = np.stack([numbers['dose2_pct'], numbers['partial_pct'],
+                     numbers['total_reg_unvaxed_pct'], numbers['total_unreg_pct']], axis=-1)
+    numbers['sum_pct'] = bars.sum(axis=-1)
+    bars, numbers['is_bar_adjusted'] = clamp_bar_segments(bars, n_cut=2, carry=False)
+    numbers['total_reg_unvaxed_pct'], numbers['total_unreg_pct'] = bars[..., 2], bars[..., 3]
+
+    # one state: numpy 0-d results back to scalars
+    return {name: value[()] if isinstance(value, np.ndarray) and value.ndim == 0 else value
+            for name, value in numbers.items()}
+
+
+def format_progress(numbers):
+    """
+    Progress data dictionary for export from `overall_progress_numbers` of one state
+    Only display strings are rendered here
+    """
+    total_unreg_pct = numbers['total_unreg_pct']
+    total_reg_unvaxed_pct = numbers['total_reg_unvaxed_pct']
+    dose2_pct = numbers['dose2_pct']
+    partial_pct = numbers['partial_pct']
+
+    def pct_dp(pct):
+        return f'{pct*100:.1f}%'
+
     progress_data = {
-        'today_date_dp': dfvn.date_dt.strftime('%d %b'),
-        'total_pop_dp': f'{total_pop:,}',
+        'today_date_dp': numbers['date_dt'].strftime('%d %b'),
+        'total_pop_dp': f"{numbers['total_pop']:,}",
 
         'full': dose2_pct,
-        'full_dp': f'{dose2_pct*100:.1f}%',
-        'full_count_dp': f'{latest_dose2_total:,}',
-
-        'full_pf': round(dose2_pf_pct, 3),
-        'full_pf_bar': round(dose2_pf_bar_pct, 3),
-        'full_pf_bar_dp': f'{dose2_pf_bar_pct*100:.1f}%',
-        'full_pf_dp': f'{dose2_pf_pct*100:.1f}%',
-        'full_pf_count_dp': f'{dfvn.pfizer2_cumul:,}',
-
-        'full_sn': round(dose2_sn_pct, 3),
-        'full_sn_bar': round(dose2_sn_bar_pct, 3),
-        'full_sn_bar_dp': f'{dose2_sn_bar_pct*100:.1f}%',
-        'full_sn_dp': f'{dose2_sn_pct*100:.1f}%',
-        'full_sn_count_dp': f'{dfvn.sinovac2_cumul:,}',
-
-        'full_az': round(dose2_az_pct, 3),
-        'full_az_bar': round(dose2_az_bar_pct, 3),
-        'full_az_bar_dp': f'{dose2_az_bar_pct*100:.1f}%',
-        'full_az_dp': f'{dose2_az_pct*100:.1f}%',
-        'full_az_count_dp': f'{dfvn.astra2_cumul:,}',
-
-        'full_cn': round(dose2_cn_pct, 3),
-        'full_cn_bar': round(dose2_cn_bar_pct, 3),
-        'full_cn_bar_dp': f'{dose2_cn_bar_pct*100:.1f}%',
-        'full_cn_dp': f'{dose2_cn_pct*100:.1f}%',
-        'full_cn_count_dp': f'{dfvn.cansino2_cumul:,}',
-
-        # if partial_pct_disp is None else partial_pct_disp,
-        'partial': round(partial_pct, 3),
-        'partial_dp': f'{partial_pct*100:.1f}%',
-        'partial_count_dp': f'{latest_partial_vax:,}',
-
-        'partial_pf': round(partial_pf_pct, 3),
-        'partial_pf_bar': round(partial_pf_bar_pct, 3),
-        'partial_pf_bar_dp': f'{partial_pf_bar_pct*100:.1f}%',
-        'partial_pf_dp': f'{partial_pf_pct*100:.1f}%',
-        'partial_pf_count_dp': f'{partial_pf:,}',
-
-        'partial_sn': round(partial_sn_pct, 3),
-        'partial_sn_bar': round(partial_sn_bar_pct, 3),
-        'partial_sn_bar_dp': f'{partial_sn_bar_pct*100:.1f}%',
-        'partial_sn_dp': f'{partial_sn_pct*100:.1f}%',
-        'partial_sn_count_dp': f'{(dfvn.sinovac1_cumul - dfvn.sinovac2_cumul):,}',
-
-        'partial_az': round(partial_az_pct, 3),
-        'partial_az_bar': round(partial_az_bar_pct, 3),
-        'partial_az_bar_dp': f'{partial_az_bar_pct*100:.1f}%',
-        'partial_az_dp': f'{partial_az_pct*100:.1f}%',
-        'partial_az_count_dp': f'{(dfvn.astra1_cumul - dfvn.astra2_cumul):,}',
-
-        'total_count_dp': f'{latest_total:,}',
-        'total_dose1_dp': f'{latest_dose1_total:,}',
+        'full_dp': pct_dp(dose2_pct),
+        'full_count_dp': f"{numbers['latest_dose2_total']:,}",
+    }
+
+    # vax type breakdown, full then partial
+    for dose_group, dose_key in [('full', 'dose2'), ('partial', 'partial')]:
+        if dose_group == 'partial':
+            # if partial_pct_disp is None else partial_pct_disp,
+            progress_data['partial'] = round(partial_pct, 3)
+            progress_data['partial_dp'] = pct_dp(partial_pct)
+            progress_data['partial_count_dp'] = f"{numbers['latest_partial_vax']:,}"
+        vax_types = ['pf', 'sn', 'az', 'cn'] if dose_group == 'full' else ['pf', 'sn', 'az']
+        for vax in vax_types:
+            vax_pct = numbers[f'{dose_key}_{vax}_pct']
+            vax_bar_pct = numbers[f'{dose_key}_{vax}_bar_pct']
+            progress_data[f'{dose_group}_{vax}'] = round(vax_pct, 3)
+            progress_data[f'{dose_group}_{vax}_bar'] = round(vax_bar_pct, 3)
+            progress_data[f'{dose_group}_{vax}_bar_dp'] = pct_dp(vax_bar_pct)
+            progress_data[f'{dose_group}_{vax}_dp'] = pct_dp(vax_pct)
+            progress_data[f'{dose_group}_{vax}_count_dp'] = f"{numbers[f'{dose_key}_{vax}']:,}"
+
+    progress_data.update({
+        'total_count_dp': f"{numbers['latest_total']:,}",
+        'total_dose1_dp': f"{numbers['latest_dose1_total']:,}",
 
         'reg': round(total_reg_unvaxed_pct, 3),
-        'reg_dp': f'{total_reg_unvaxed_pct*100:.1f}%',
-        'reg_count_dp': f'{total_reg_unvaxed:,}',
-        'total_reg_count_dp': f'{total_reg:,}',
+        'reg_dp': pct_dp(total_reg_unvaxed_pct),
+        'reg_count_dp': f"{numbers['total_reg_unvaxed']:,}",
+        'total_reg_count_dp': f"{numbers['total_reg']:,}",
 
         'unreg': round(total_unreg_pct, 3),
-        'unreg_dp': f'{total_unreg_pct*100:.1f}%',
+        'unreg_dp': pct_dp(total_unreg_pct),
         'unreg_dp_tw': f'w-[{total_unreg_pct*100:.1f}%]',
-        'unreg_count_dp': f'{total_unreg:,}',
-
-        'rate_latest': f'{latest_daily_rate:,}',
-        'rate_latest_d1': f'{latest_daily_dose1:,}',
-        'rate_latest_d2': f'{latest_daily_dose2:,}',
-        'rate_latest_100': f'{latest_rate_per_100:.1f}',
-        'is_rate_latest_incr': bool(is_daily_rate_incr),
-
-        'rate_avg': f'{int(avg_total_rate):,}',
-        'rate_avg_d1': f'{int(avg_dose1_rate):,}',
-        'rate_avg_d2': f'{int(avg_dose2_rate):,}',
-        'rate_avg_100': f'{avg_rate_per_100:.1f}',
-        'is_rate_avg_incr': bool(is_avg_rate_incr),
-    }
-    return progress_data, dfvn.avg_pfsn_rate, dfvn.avg_az_rate,  dfvn.states_pfsn_dose2_list, dfvn.states_az_dose2_list, latest_dose2_total
+        'unreg_count_dp': f"{numbers['total_unreg']:,}",
+
+        'rate_latest': f"{numbers['latest_daily_rate']:,}",
+        'rate_latest_d1': f"{numbers['latest_daily_dose1']:,}",
+        'rate_latest_d2': f"{numbers['latest_daily_dose2']:,}",
+        'rate_latest_100': f"{numbers['latest_rate_per_100']:.1f}",
+        'is_rate_latest_incr': bool(numbers['is_daily_rate_incr']),
+
+        'rate_avg': f"{int(numbers['avg_total_rate']):,}",
+        'rate_avg_d1': f"{int(numbers['avg_dose1_rate']):,}",
+        'rate_avg_d2': f"{int(numbers['avg_dose2_rate']):,}",
+        'rate_avg_100': f"{numbers['avg_rate_per_100']:.1f}",
+        'is_rate_avg_incr': bool(numbers['is_avg_rate_incr']),
+    })
+    return progress_data
 
 
-def calculate_milestone_projections(state_name, pop_level, total_pop, pfsn_vax_rate, az_vax_rate, latest_dose2_total, pfsn_dose2_list=[], az_dose2_list=[], start_date=datetime.today(), target_hits={}):
+def calculate_milestone_projections(state_name, pop_level, total_pop, pfsn_vax_rate, az_vax_rate, latest_dose2_total, pfsn_dose2_list=[], az_dose2_list=[], start_date=datetime.today(), target_hits={}, days_to_targets=None):
     """
     Run estimations for each milestone to build timeline data
+    `days_to_targets` are days remaining to each of MILESTONE_TARGETS when already projected for all bands and states
     Returns estimation projection results for herd target for progress_data
     """
     milestones = {}  # (days remaining, target date, dose2)
-    for target in [PHASE2_TARGET_PCT, PHASE3_TARGET_PCT, PHASE4_TARGET_PCT, HERD_TARGET_PCT, NINETY_TARGET_PCT, FULL_TARGET_PCT]:
+    if days_to_targets is None:
+        # project all targets in one go
+        days_to_targets = project_days_to_targets(MILESTONE_TARGETS, [total_pop], [pfsn_vax_rate], [az_vax_rate],
+                                                  [latest_dose2_total], [pfsn_dose2_list], [az_dose2_list])[0]
+    for target in MILESTONE_TARGETS:
         if target in target_hits.keys():  # (date hit, dose 2)
             milestones[target] = ((target_hits[target][0] - pd.Timestamp(datetime.today())).days + 1, # 'subtract' one day here as past date + extra hours counted as one day
                                   target_hits[target][0], int(target_hits[target][1]))
         else:
             # return - (days remaining, target date)
-            days_remaining, target_date = estimate_complete_by_target(
-                target, total_pop, pfsn_vax_rate, az_vax_rate, latest_dose2_total, pfsn_dose2_list, az_dose2_list, start_date)
+            days_remaining, target_date = projected_target_date(
+                days_to_targets[MILESTONE_TARGETS.index(target)], start_date)
             milestones[target] = (days_remaining, target_date, None)
-        print(
+        logger.debug(
             f'{milestones[target][0]} days to target {target} ({milestones[target][1]}). ')
 
     # build dict
@@ -777,26 +1173,66 @@ def calculate_milestone_projections(state_name, pop_level, total_pop, pfsn_vax_r
     return milestones_list, milestones[HERD_TARGET_PCT][1], milestones[HERD_TARGET_PCT][0] 
 
 
-if __name__ == "__main__":
+# summary inputs shared with forked workers, set by `build_all_data`
+SUMMARY_INPUTS = None
 
-    # prepare population data
-    dfpop = pd.read_csv(static_pop)
-    # create klang valley population
-    kv_pop = dfpop[(dfpop.state == 'Selangor') | (
-        dfpop.state == 'W.P. Kuala Lumpur') | (dfpop.state == 'W.P. Putrajaya')].sum()
-    kv_pop.state = 'Klang Valley'
-    kv_pop.name = 17
-    dfpop = dfpop.append(kv_pop)
-    dfpop.set_index('state', inplace=True)
 
-    # preprocess vax and reg CSVs
-    latest_dfv, state_doses_data_byvax, state_target_hits = preprocess_csv(
-        vax_national_csv, vax_state_csv, dfpop)
-    latest_dfr, _, _ = preprocess_csv(
-        reg_national_csv, reg_state_csv, dfpop)
+def summarize_work_unit(work_unit):
+    """Run `summary_by_state` for one (pop_level, state) work unit, returns summary and its stage records"""
+    pop_level, state_name = work_unit
+    dfpop, latest_dfv, latest_dfr, state_target_hits, progress_numbers = SUMMARY_INPUTS
+    logger.debug(
+        f'Processing state: {bcolors.WARNING}{state_name} ({pop_level}){bcolors.ENDC}')
+    n_records = len(instrument.RUN_RECORDS)
+    with instrument.stage('summary_by_state', state=state_name, pop_level=pop_level):
+        summary = summary_by_state(state_name, dfpop, latest_dfv, latest_dfr, pop_level, state_target_hits[pop_level],
+                                   progress_numbers[pop_level][state_name])
+    # stage records go back with the result when run in a worker process
+    return summary, instrument.RUN_RECORDS[n_records:]
+
+
+def build_all_data(dfpop, latest_dfv, latest_dfr, state_doses_data_byvax, state_target_hits, data_levels=['total', 'adult'], processes=1):
+    """
+    Build export data from summaries of every (pop_level, state) work unit
+    Work units run over a process pool when `processes` > 1, results are merged in work unit
+    order so the output is identical to a serial run
+    """
+    global SUMMARY_INPUTS
+    # progress numbers of all bands and states at once, formatted per state in the work units
+    with instrument.stage('calculate_overall_progress', bands=len(data_levels), states=len(latest_dfv)):
+        total_pop, total_reg = pop_level_totals(latest_dfv.index, dfpop, latest_dfr, data_levels)
+        numbers = overall_progress_numbers(total_pop, total_reg, latest_dfv, data_levels)
+    with instrument.stage('project_days_to_targets', bands=len(data_levels), states=len(latest_dfv)):
+        # every (band, state) in one call, rates and pending dose 2 are the same for all bands of a state
+        n_bands = len(data_levels)
+        numbers['days_to_targets'] = project_days_to_targets(
+            MILESTONE_TARGETS, total_pop.ravel(), np.tile(latest_dfv.avg_pfsn_rate, n_bands),
+            np.tile(latest_dfv.avg_az_rate, n_bands), numbers['latest_dose2_total'].ravel(),
+            np.tile(latest_dfv.pfsn_dose2, (n_bands, 1)), np.tile(latest_dfv.az_dose2, (n_bands, 1))
+        ).reshape(n_bands, len(latest_dfv), len(MILESTONE_TARGETS))
+    progress_numbers = {}
+    for b_idx, pop_level in enumerate(data_levels):
+        is_adjusted = numbers['is_bar_adjusted'][b_idx]
+        for state_name, sum_pct in zip(latest_dfv.index[is_adjusted], numbers['sum_pct'][b_idx][is_adjusted]):
+            logger.debug(f'Progress bar of {state_name} ({pop_level}) adjusted, sum_pct: {sum_pct}')
+        # per state values are shared by all bands
+        progress_numbers[pop_level] = {
+            state_name: {name: values[b_idx, s_idx] if np.ndim(values) > 1 else values[s_idx]
+                         for name, values in numbers.items()}
+            for s_idx, state_name in enumerate(latest_dfv.index)}
+    SUMMARY_INPUTS = (dfpop, latest_dfv, latest_dfr, state_target_hits, progress_numbers)
+    work_units = [(pop_level, state_name)
+                  for pop_level in data_levels for state_name in latest_dfv.index]
+    if processes == 1:
+        summaries = list(map(summarize_work_unit, work_units))
+    else:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            summaries = pool.map(summarize_work_unit, work_units)
+        for _, records in summaries:
+            instrument.RUN_RECORDS.extend(records)
+    summaries = dict(zip(work_units, [summary for summary, _ in summaries]))
 
     # START BUILDING JSON DATA
-    data_levels = ['total', 'adult']
     state_charts_data = {}
     top_states_data = {}
     by_state_data = {}
@@ -804,12 +1240,10 @@ if __name__ == "__main__":
         # PROCESS ALL STATES
         states_list = []
         state_charts_data[pop_level] = []
-        for state_name, _ in latest_dfv.iterrows():
-            print(
-                f'Processing state: {bcolors.WARNING}{state_name} ({pop_level}){bcolors.ENDC}')
+        for state_name in latest_dfv.index:
             by_state_data[state_name] = by_state_data.get(state_name, {})
-            progress_data, milestones_data, state_chart_data, herd_date, first_dose_7d, second_dose_7d = summary_by_state(
-                state_name, dfpop, latest_dfv, latest_dfr, pop_level, state_target_hits[pop_level])
+            progress_data, milestones_data, state_chart_data, herd_date, first_dose_7d, second_dose_7d = summaries[(
+                pop_level, state_name)]
 
             if state_name != "Malaysia":
                 state_charts_data[pop_level].append(state_chart_data)
@@ -836,11 +1270,65 @@ if __name__ == "__main__":
         top_states_data[pop_level] = sorted(
             states_list, key=lambda state: state['herd_n_days'])[:5]
 
-    all_data = {
+    return {
         'by_state': by_state_data,  # combined progress, timeline, doses
         'top_states': top_states_data,
         'state': state_charts_data
     }
 
-    with open(DATA_EXPORT_PATH, 'w') as fp:
-        json.dump(all_data, fp)
+
+def update_timeseries(hashes, frames):
+    """
+    Rebuild the time-series store of daily vax and reg columns (see timeseries.py) if sources or regions
+    changed since it was built. `frames` are the (date_dt, state) frames by dataset preprocessing already
+    has in memory, full or incremental, only their CSV columns are stored.
+    Returns whether it was rebuilt
+    """
+    key = cache_key(json.dumps(hashes, sort_keys=True), regions_fingerprint())
+    if current_key(TIMESERIES_PATH) == key:
+        return False
+    source_frames = {}
+    for state_csv, df in frames.items():
+        schema = source_schema(state_csv)
+        source_frames[schema['dataset']] = df[[col for col, col_type in schema['columns'].items()
+                                               if col_type.startswith('int')]]
+    build_store(TIMESERIES_PATH, key, source_frames, state_abbr)
+    return True
+
+
+def build_and_publish(incremental=False, use_cache=True, mmap=False, processes=1, sharded=False):
+    """
+    Run the whole pipeline from CITF CSVs and publish the export where it changed
+    Returns export data and set of changed sections
+    """
+    # hashed before reading, a source changing during the build is picked up by the next check
+    hashes = source_hashes()
+
+    # prepare population data
+    dfpop = read_population(static_pop)
+
+    # preprocess vax and reg CSVs
+    with instrument.stage('preprocess_csv', dataset='vax'):
+        latest_dfv, state_doses_data_byvax, state_target_hits, dfvs = preprocess_csv(
+            vax_national_csv, vax_state_csv, dfpop, incremental, use_cache, mmap, hashes)
+    with instrument.stage('preprocess_csv', dataset='reg'):
+        latest_dfr, _, _, dfrs = preprocess_csv(
+            reg_national_csv, reg_state_csv, dfpop, incremental, use_cache, mmap, hashes)
+
+    all_data = build_all_data(dfpop, latest_dfv, latest_dfr,
+                              state_doses_data_byvax, state_target_hits, processes=processes)
+
+    with instrument.stage('timeseries'):
+        instrument.annotate(rebuilt=update_timeseries(hashes, {vax_state_csv: dfvs, reg_state_csv: dfrs}))
+
+    with instrument.stage('export', sharded=sharded):
+        changed_sections = publish(all_data, DATA_EXPORT_PATH, EXPORT_MANIFEST_PATH, state_abbr, sharded)
+        instrument.annotate(sections_changed=len(changed_sections))
+    write_source_manifest(hashes)
+    return all_data, changed_sections
+
+
+if __name__ == "__main__":
+    # same as `cli.py build`
+    import cli
+    sys.exit(cli.main(['build'] + sys.argv[1:]))
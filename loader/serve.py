@@ -0,0 +1,222 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from http import HTTPStatus
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip variants without it
+    brotli = None
+
+import timeseries
+from scriptv2 import DATA_EXPORT_PATH, state_abbr
+
+
+logger = logging.getLogger('loader.serve')
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+
+def serialize_view(data):
+    """
+    Pre-serialized view: JSON bytes, its ETag and compressed variants by content coding
+    Done once per data update so requests only pick bytes
+    """
+    body = json.dumps(data).encode()
+    encoded = {'gzip': gzip.compress(body, GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return {'etag': f'"{hashlib.sha1(body).hexdigest()[:20]}"', 'identity': body, **encoded}
+
+
+def build_views(all_data, state_abbr):
+    """
+    All views served, by path:
+        /data3.json                   full export, same as the file
+        /index                        top_states, state charts and {abbr: state name}
+        /top_states[/<pop_level>]     ranking of states by herd date
+        /state[/<pop_level>]          state chart data
+        /by_state/<abbr>              progress, timeline and doses of one state, all pop levels
+        /by_state/<abbr>/<pop_level>  same for one pop level
+    and /timeseries, queried per request, see `timeseries_view`
+    """
+    views = {
+        '/data3.json': all_data,
+        '/index': {'top_states': all_data['top_states'], 'state': all_data['state'],
+                   'states': {state_abbr[state_name]: state_name for state_name in all_data['by_state']}},
+    }
+    for section in ['top_states', 'state']:
+        views[f'/{section}'] = all_data[section]
+        for pop_level, section_data in all_data[section].items():
+            views[f'/{section}/{pop_level}'] = section_data
+    for state_name, state_data in all_data['by_state'].items():
+        state_path = f'/by_state/{state_abbr[state_name]}'
+        views[state_path] = state_data
+        for pop_level in state_data['progress']:
+            views[f'{state_path}/{pop_level}'] = {
+                'progress': state_data['progress'][pop_level],
+                'timeline': state_data['timeline'][pop_level],
+                'doses_byvax': state_data['doses_byvax'],
+            }
+    return {path: serialize_view(data) for path, data in views.items()}
+
+
+def timeseries_view(store, query_string):
+    """
+    /timeseries?start=&end=&columns=&states=&freq=&points= as `timeseries.query`, columns and states
+    comma separated. Raises KeyError or ValueError on bad parameters
+    """
+    params = {name: values[-1] for name, values in parse_qs(query_string).items()}
+    unknown = params.keys() - {'start', 'end', 'columns', 'states', 'freq', 'points'}
+    if unknown:
+        raise ValueError(f"unknown parameters {', '.join(sorted(unknown))}")
+    if 'points' in params and not (params['points'].isdigit() and int(params['points']) > 0):
+        raise ValueError(f"points must be a positive integer, got {params['points']!r}")
+    return serialize_view(timeseries.query(
+        store, params.get('start'), params.get('end'),
+        params['columns'].split(',') if 'columns' in params else None,
+        params['states'].split(',') if 'states' in params else None,
+        params.get('freq'), int(params['points']) if 'points' in params else None))
+
+
+class DataService:
+    """
+    Latest views in memory. `update` swaps in a whole new set of views at once, so a request
+    sees either the old or the new data
+    """
+
+    def __init__(self):
+        self.views = {}
+        self.updated_at = None
+        self.timeseries = None
+
+    def update(self, all_data):
+        self.views = build_views(all_data, state_abbr)
+        self.updated_at = time.time()
+        logger.info(f'Serving {len(self.views)} views')
+
+    def load_export(self, export_path=DATA_EXPORT_PATH):
+        with open(export_path) as fp:
+            self.update(json.load(fp))
+
+    def load_timeseries(self, store_path=timeseries.TIMESERIES_PATH):
+        """Map the current time-series store if the loader switched to a new one"""
+        key = timeseries.current_key(store_path)
+        if key is not None and (self.timeseries is None or self.timeseries['key'] != key):
+            self.timeseries = timeseries.open_store(store_path)
+            logger.info(f'Serving time series of {len(self.timeseries["states"])} states')
+
+    def watch_export(self, export_path=DATA_EXPORT_PATH, interval=5):
+        """Reload whenever the export file or time-series store is replaced, the loader writes both atomically"""
+        last_stat = None
+        while True:
+            try:
+                stat = os.stat(export_path)
+                if (stat.st_mtime_ns, stat.st_size) != last_stat:
+                    self.load_export(export_path)
+                    last_stat = (stat.st_mtime_ns, stat.st_size)
+            except (OSError, ValueError) as e:
+                logger.warning(f'Could not load {export_path}: {e}')
+            try:
+                self.load_timeseries()
+            except (OSError, ValueError) as e:
+                logger.warning(f'Could not load time series: {e}')
+            time.sleep(interval)
+
+
+def make_handler(service):
+    class DataRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_HEAD(self):
+            self.send_view(head_only=True)
+
+        def do_GET(self):
+            self.send_view()
+
+        def send_view(self, head_only=False):
+            path, _, query_string = self.path.partition('?')
+            path = path.rstrip('/') or '/'
+            if path == '/':
+                view = serialize_view(sorted(service.views) + ['/timeseries'])
+            elif path == '/timeseries' and service.timeseries is not None:
+                try:
+                    view = timeseries_view(service.timeseries, query_string)
+                except (KeyError, ValueError) as e:
+                    self.send_error_view(HTTPStatus.BAD_REQUEST, str(e.args[0]), head_only)
+                    return
+            elif path in service.views:
+                view = service.views[path]
+            else:
+                view = None
+            if view is None:
+                self.send_error_view(HTTPStatus.NOT_FOUND, f'no view {path}', head_only)
+                return
+
+            if view['etag'] in [etag.strip() for etag in self.headers.get('If-None-Match', '').split(',')]:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', view['etag'])
+                self.end_headers()
+                return
+
+            accepted = [coding.split(';')[0].strip() for coding in self.headers.get('Accept-Encoding', '').split(',')]
+            coding = next((coding for coding in ['br', 'gzip'] if coding in accepted and coding in view), 'identity')
+            body = view[coding]
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', view['etag'])
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept-Encoding')
+            if coding != 'identity':
+                self.send_header('Content-Encoding', coding)
+            self.end_headers()
+            if not head_only:
+                self.wfile.write(body)
+
+        def send_error_view(self, status, message, head_only=False):
+            body = json.dumps({'error': message}).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if not head_only:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return DataRequestHandler
+
+
+def serve(service, host='127.0.0.1', port=8040):
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    logger.info(f'Data service on http://{host}:{port}')
+    server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve export data views from memory with ETag and gzip/brotli')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8040)
+    parser.add_argument('--export', default=DATA_EXPORT_PATH, help='export file to serve and watch for updates')
+    parser.add_argument('--interval', type=float, default=5, help='seconds between checks of the export file')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level='INFO', format='%(message)s')
+
+    service = DataService()
+    threading.Thread(target=service.watch_export, args=(args.export, args.interval), daemon=True).start()
+    serve(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import json
+import hashlib
+from pathlib import Path
+from datetime import datetime
+
+
+# paths, no pandas/numpy here so `cli.py check` starts fast
+ROOT_PATH = Path('/opt')
+root_folder = ROOT_PATH / 'covid19-public'
+vax_national_csv = root_folder / 'vaccination' / 'vax_malaysia.csv'
+vax_state_csv = root_folder / 'vaccination' / 'vax_state.csv'
+reg_national_csv = root_folder / 'registration' / 'vaxreg_malaysia.csv'
+reg_state_csv = root_folder / 'registration' / 'vaxreg_state.csv'
+static_pop = root_folder / 'static' / 'population.csv'
+SOURCE_FILES = [vax_national_csv, vax_state_csv, reg_national_csv, reg_state_csv, static_pop]
+
+# processed data persisted between runs for incremental mode
+LOADER_STATE_PATH = ROOT_PATH / 'vaxapp-prod' / 'loader' / '.state'
+# source hashes of the last build
+SOURCE_MANIFEST_PATH = LOADER_STATE_PATH / 'sources.json'
+
+
+def file_sha1(path, size=None):
+    """
+    sha1 of a file, of its first `size` bytes if given. The one place source files are hashed:
+    the frame cache and the loader state are keyed by these digests
+    """
+    sha1 = hashlib.sha1()
+    remaining = size
+    with open(path, 'rb') as fp:
+        while remaining is None or remaining > 0:
+            chunk = fp.read(1 << 20 if remaining is None else min(1 << 20, remaining))
+            if not chunk:
+                break
+            sha1.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return sha1.hexdigest()
+
+
+def source_hashes(paths=SOURCE_FILES):
+    """sha1 of each source file, None for missing ones"""
+    return {str(path): file_sha1(path) if path.exists() else None for path in paths}
+
+
+def read_source_manifest(manifest_path=SOURCE_MANIFEST_PATH):
+    """Source hashes and time of the last build, None if there was none"""
+    try:
+        return json.loads(Path(manifest_path).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_source_manifest(hashes, manifest_path=SOURCE_MANIFEST_PATH):
+    manifest_path = Path(manifest_path)
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest = {'built_at': datetime.now().isoformat(timespec='seconds'), 'sources': hashes}
+    manifest_path.write_text(json.dumps(manifest, indent=1))
+
+
+def changed_sources(manifest_path=SOURCE_MANIFEST_PATH):
+    """Source files whose content differs from the last build, all of them if there was no build"""
+    manifest = read_source_manifest(manifest_path)
+    built_hashes = manifest['sources'] if manifest is not None else {}
+    return [path for path, sha1 in source_hashes().items() if built_hashes.get(path) != sha1]
@@ -0,0 +1,141 @@
+import os
+import argparse
+import itertools
+import multiprocessing
+import pandas as pd
+import numpy as np
+from datetime import timedelta
+
+import scriptv2
+from backfill import MAX_PROJECTION_DAYS
+from scriptv2 import (HERD_TARGET_PCT, MILESTONE_TARGETS, POP_BANDS, PROP_AZ, PFSN_DOSE_INT, AZ_DOSE_INT, ROLL_WINDOW,
+                      vax_national_csv, vax_state_csv, static_pop)
+
+
+# prepared data shared with forked workers, set once by `run_sweep`
+SWEEP_DATA = None
+
+
+def prepare_sweep_data(dfpop, pop_levels, n_days, use_cache=True, mmap=False):
+    """
+    Load vax data once and keep only what projections need, as (date x state) arrays:
+    last `n_days` of pfizer/sinovac and AZ dose 1, latest dose 2 and population by level and target hits
+    """
+    dfvs = scriptv2.read_prepared_csv(vax_national_csv, vax_state_csv, dfpop, use_cache, mmap)
+    dfvs = scriptv2.add_vax_columns(dfvs, dfpop)
+    state_target_hits = scriptv2.find_target_hits(dfvs)
+    dfvs = dfvs.drop(scriptv2.hidden_states, level='state')
+
+    latest_date = dfvs.index.get_level_values('date_dt').max()
+    dfvs_window = dfvs[latest_date - pd.offsets.Day(n_days - 1):]
+    pfsn1 = dfvs_window['pfsn1'].unstack('state')
+    states = pfsn1.columns.tolist()
+    latest_dfv = dfvs.loc[latest_date].reindex(states)
+
+    return {
+        'states': states,
+        'pop_levels': pop_levels,
+        'latest_date': latest_date,
+        'pfsn1': pfsn1.to_numpy(dtype=float),
+        'astra1': dfvs_window['astra1'].unstack('state')[states].to_numpy(dtype=float),
+        'pop': np.array([dfpop.loc[states, POP_BANDS[level]['pop']].to_numpy(dtype=float) for level in pop_levels]),
+        'dose2': np.array([latest_dfv[POP_BANDS[level]['dose2']].to_numpy(dtype=float) for level in pop_levels]),
+        'target_hits': state_target_hits,
+    }
+
+
+def scenario_grid(prop_az, pfsn_dose_int, az_dose_int, roll_window, rate_mult):
+    """All combinations of parameters, skipping dose intervals where AZ is not the longer one"""
+    return [{'prop_az': p_az, 'pfsn_dose_int': pfsn_int, 'az_dose_int': az_int,
+             'roll_window': roll, 'rate_mult': mult}
+            for p_az, pfsn_int, az_int, roll, mult in itertools.product(prop_az, pfsn_dose_int, az_dose_int, roll_window, rate_mult)
+            if az_int > pfsn_int]
+
+
+def run_scenario(scenario):
+    """
+    Milestone projections for all states and pop levels under one scenario
+    Pending dose 2 are the last dose interval days of dose 1, rates the mean over the last `roll_window`
+    days scaled by `rate_mult`. With `prop_az` the combined rate is split into pfizer/sinovac and AZ by it,
+    otherwise the observed split is kept.
+    Herd dates projected more than MAX_PROJECTION_DAYS out, or never (zero rate), are left empty
+    Returns rows of herd target results
+    """
+    data = SWEEP_DATA
+    pfsn_dose2 = np.nan_to_num(data['pfsn1'][-scenario['pfsn_dose_int']:].T)
+    az_dose2 = np.nan_to_num(data['astra1'][-scenario['az_dose_int']:].T)
+    pfsn_rate = np.nanmean(data['pfsn1'][-scenario['roll_window']:], axis=0) * scenario['rate_mult']
+    az_rate = np.nanmean(data['astra1'][-scenario['roll_window']:], axis=0) * scenario['rate_mult']
+    if scenario['prop_az'] is not None:
+        total_rate = pfsn_rate + az_rate
+        pfsn_rate, az_rate = total_rate * (1 - scenario['prop_az']), total_rate * scenario['prop_az']
+    prop_az = PROP_AZ if scenario['prop_az'] is None else scenario['prop_az']
+    avg_dose_int = round((scenario['pfsn_dose_int']*(1 - prop_az)) + (scenario['az_dose_int']*prop_az))
+
+    rows = []
+    herd_idx = MILESTONE_TARGETS.index(HERD_TARGET_PCT)
+    for l_idx, pop_level in enumerate(data['pop_levels']):
+        with np.errstate(divide='ignore', invalid='ignore'):  # zero rates project infinite days
+            days_to_targets = scriptv2.project_days_to_targets(
+                MILESTONE_TARGETS, data['pop'][l_idx], pfsn_rate, az_rate, data['dose2'][l_idx], pfsn_dose2, az_dose2,
+                scenario['pfsn_dose_int'], scenario['az_dose_int'])
+        for s_idx, state_name in enumerate(data['states']):
+            herd_hit = data['target_hits'][pop_level].get(state_name, {}).get(HERD_TARGET_PCT)
+            if herd_hit is not None:
+                herd_date = pd.Timestamp(herd_hit[0])
+                herd_days = (herd_date - data['latest_date']).days
+            else:
+                herd_days = days_to_targets[s_idx, herd_idx]
+                in_range = np.isfinite(herd_days) and herd_days < MAX_PROJECTION_DAYS
+                herd_date = data['latest_date'] + timedelta(days=herd_days + 1) if in_range else pd.NaT
+            rows.append(dict(scenario, avg_dose_int=avg_dose_int, state=state_name, pop_level=pop_level,
+                             herd_hit=herd_hit is not None, herd_days=round(float(herd_days), 1),
+                             herd_date=herd_date.strftime('%Y-%m-%d') if pd.notna(herd_date) else None))
+    return rows
+
+
+def run_sweep(scenarios, dfpop, pop_levels=['total', 'adult'], processes=None, use_cache=True, mmap=False):
+    """
+    Run milestone projections for every scenario over a process pool
+    Data is prepared once before forking so workers share it without copying
+    Returns table of herd dates, one row per scenario, state and pop level
+    """
+    global SWEEP_DATA
+    n_days = max(max(s['az_dose_int'], s['pfsn_dose_int'], s['roll_window']) for s in scenarios)
+    SWEEP_DATA = prepare_sweep_data(dfpop, pop_levels, n_days, use_cache, mmap)
+
+    if processes == 1:
+        results = map(run_scenario, scenarios)
+    else:
+        n_processes = processes or os.cpu_count() or 1
+        with multiprocessing.get_context('fork').Pool(n_processes) as pool:
+            results = pool.map(run_scenario, scenarios, chunksize=max(1, len(scenarios) // (4*n_processes)))
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Batch what-if milestone projections over vaccine mix and dose intervals')
+    parser.add_argument('--prop-az', type=float, nargs='+', default=[None],
+                        help='share of AZ in dose 1 rate, observed split if not given')
+    parser.add_argument('--pfsn-dose-int', type=int, nargs='+', default=[PFSN_DOSE_INT])
+    parser.add_argument('--az-dose-int', type=int, nargs='+', default=[AZ_DOSE_INT])
+    parser.add_argument('--roll-window', type=int, nargs='+', default=[ROLL_WINDOW])
+    parser.add_argument('--rate-mult', type=float, nargs='+', default=[1.0],
+                        help='multiplier on dose 1 rate, e.g. 2 for doubled supply')
+    parser.add_argument('--levels', nargs='+', default=['total', 'adult'], choices=list(POP_BANDS))
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('-o', '--output', default='sweep.csv')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = scenario_grid(args.prop_az, args.pfsn_dose_int, args.az_dose_int, args.roll_window, args.rate_mult)
+    dfpop = scriptv2.read_population(static_pop)
+    dfsweep = run_sweep(scenarios, dfpop, args.levels, args.processes)
+    dfsweep.to_csv(args.output, index=False)
+    print(f'{len(scenarios)} scenarios, {len(dfsweep)} rows written to {args.output}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# loader modules import each other as top-level modules, as when run from loader/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,63 @@
+import json
+import struct
+import pytest
+from pathlib import Path
+
+from compact import COMPACT_MAGIC, PREFIX, decode_compact, encode_compact, int_dtype
+
+
+# records of one shape repeated, runs of mixed element types, every leaf type and int width
+SAMPLE = {
+    'by_state': {
+        state_name: {
+            'progress': {'full': 0.712, 'partial': 0.05, 'herd_days': -3 + idx, 'full_dp': f'{71.2 + idx:.1f}%',
+                         'is_rate_latest_incr': idx % 2 == 0, 'herd_date_dp': None},
+            'timeline': [{'name': 'begin', 'n_count': 0}, {'name': 'herd', 'n_count': 25_000_000 + idx}],
+        }
+        for idx, state_name in enumerate(['Johor', 'Kedah', 'W.P. Kuala Lumpur'])
+    },
+    'mixed': [1, 2, 'a', None, True, 3.5, [], {}, [1, [2, [3]]], -2**40, 2**63 - 1, 'Pulau Pinang é'],
+    'empty': {},
+}
+
+
+@pytest.mark.parametrize('data', [SAMPLE, [], {}, 'text', None, [None, None], [True, False, 0, 1]])
+def test_round_trip(data):
+    decoded = decode_compact(encode_compact(data))
+    assert json.dumps(decoded) == json.dumps(data)
+
+
+def test_bool_and_int_kept_apart():
+    decoded = decode_compact(encode_compact([True, 1, False, 0]))
+    assert [type(value) for value in decoded] == [bool, int, bool, int]
+
+
+def test_export_round_trip():
+    body = (Path(__file__).parents[2] / 'data' / 'data3.json').read_text()
+    assert json.dumps(decode_compact(encode_compact(json.loads(body)))) == json.dumps(json.loads(body))
+
+
+def test_body_aligned():
+    payload = encode_compact(SAMPLE)
+    _, _, header_len = PREFIX.unpack_from(payload)
+    header = json.loads(payload[PREFIX.size:PREFIX.size + header_len])
+    assert (PREFIX.size + header_len) % 8 == 0
+    assert all(column['offset'] % 8 == 0 for column in header['columns'])
+
+
+def test_rejects_other_formats():
+    payload = encode_compact(SAMPLE)
+    with pytest.raises(ValueError, match='not a compact export'):
+        decode_compact(b'XXXX' + payload[4:])
+    with pytest.raises(ValueError, match='version'):
+        decode_compact(struct.pack('<4sH', COMPACT_MAGIC, 99) + payload[6:])
+
+
+def test_int_dtype():
+    assert int_dtype([0, 127]) == '<i1'
+    assert int_dtype([-129, 0]) == '<i2'
+    assert int_dtype([0, 255], signed=False) == '<u1'
+    assert int_dtype([2**31]) == '<i8'
+    assert int_dtype([]) == '<i1'
+    with pytest.raises(OverflowError):
+        int_dtype([2**64])
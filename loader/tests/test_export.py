@@ -0,0 +1,37 @@
+import pytest
+
+from export import publish
+
+
+ALL_DATA = {
+    'by_state': {'Johor': {'progress': {'full': 0.7}, 'timeline': [], 'doses_byvax': {}}},
+    'top_states': [{'name': 'Johor'}],
+    'state': [{'name': 'Johor', 'full': 0.7}],
+}
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return tmp_path / 'data3.json', tmp_path / 'manifest.json'
+
+
+def test_unchanged_publish_writes_nothing(paths):
+    export_path, manifest_path = paths
+    assert publish(ALL_DATA, export_path, manifest_path, {'Johor': 'JHR'})
+    assert publish(ALL_DATA, export_path, manifest_path, {'Johor': 'JHR'}) == set()
+
+
+@pytest.mark.parametrize('name', ['data3.json', 'data3.bin'])
+def test_missing_file_counts_as_changed(paths, name):
+    export_path, manifest_path = paths
+    publish(ALL_DATA, export_path, manifest_path, {'Johor': 'JHR'})
+    (export_path.parent / name).unlink()
+    assert publish(ALL_DATA, export_path, manifest_path, {'Johor': 'JHR'}) == {name}
+    assert (export_path.parent / name).exists()
+
+
+def test_missing_shard_counts_as_changed(paths):
+    export_path, manifest_path = paths
+    publish(ALL_DATA, export_path, manifest_path, {'Johor': 'JHR'}, sharded=True)
+    (export_path.parent / 'by_state' / 'JHR.json').unlink()
+    assert publish(ALL_DATA, export_path, manifest_path, {'Johor': 'JHR'}, sharded=True) == {'by_state/JHR.json'}
@@ -0,0 +1,34 @@
+import copy
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+
+from scriptv2 import LatestVax
+
+
+@pytest.fixture
+def latest():
+    latest_dfv = pd.DataFrame({'daily': [10, 20], 'cumul': [100, 200]}, index=['Johor', 'Kedah'])
+    dose2_pending = {name: pd.DataFrame(np.arange(6).reshape(2, 3), index=['Johor', 'Kedah'])
+                     for name in ['projected_dose2', 'pfsn_dose2', 'az_dose2']}
+    return LatestVax(latest_dfv, dose2_pending)
+
+
+def test_columns_as_attributes(latest):
+    assert latest.daily.tolist() == [10, 20]
+    assert latest.state('Kedah').cumul == 200
+    assert latest.state('Kedah').pfsn_dose2.tolist() == [3, 4, 5]
+    with pytest.raises(AttributeError):
+        latest.missing
+    with pytest.raises(AttributeError):
+        latest.state('Johor').missing
+
+
+@pytest.mark.parametrize('clone', [copy.copy, copy.deepcopy, lambda obj: pickle.loads(pickle.dumps(obj))])
+def test_copy_and_pickle(latest, clone):
+    # fork pool results and cached objects are pickled
+    cloned = clone(latest)
+    assert cloned.cumul.tolist() == [100, 200]
+    assert cloned.state('Johor').daily == 10
+    assert clone(latest.state('Kedah')).daily == 20
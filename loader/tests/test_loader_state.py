@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+import schema
+import scriptv2
+
+
+@pytest.fixture
+def csvs(tmp_path):
+    """One day of national and state vax rows, named like the CITF files their schemas are declared for"""
+    paths = []
+    for name, state in [('vax_malaysia', None), ('vax_state', 'Johor')]:
+        row = {'date': '2021-06-01', **({'state': state} if state else {}), **{col: 1 for col in schema.VAX_COLS}}
+        path = tmp_path / f'{name}.csv'
+        pd.DataFrame([row]).to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def test_schema_change_invalidates_state(tmp_path, csvs, monkeypatch):
+    national_csv, state_csv = csvs
+    state_file = tmp_path / 'vax_state.pkl'
+    dfpop = pd.DataFrame({'pop': [100]}, index=['Johor'])
+    hashes = scriptv2.source_hashes(csvs)
+    dfvs = pd.DataFrame({'cumul': [1]})
+    scriptv2.save_loader_state(state_file, dfpop, national_csv, state_csv, hashes, dfvs, None, {})
+    assert scriptv2.load_loader_state(state_file, dfpop, national_csv, state_csv, hashes)[0] is not None
+
+    columns = {**schema.SCHEMAS['vax_state']['columns'], 'pending': 'int64'}
+    monkeypatch.setitem(schema.SCHEMAS, 'vax_state', {**schema.SCHEMAS['vax_state'], 'columns': columns})
+    assert scriptv2.load_loader_state(state_file, dfpop, national_csv, state_csv, hashes) is None
+
+
+def test_unchanged_sources_need_no_save(tmp_path, csvs):
+    national_csv, state_csv = csvs
+    state_file = tmp_path / 'vax_state.pkl'
+    dfpop = pd.DataFrame({'pop': [100]}, index=['Johor'])
+    hashes = scriptv2.source_hashes(csvs)
+    scriptv2.save_loader_state(state_file, dfpop, national_csv, state_csv, hashes, pd.DataFrame(), None, {})
+    assert scriptv2.load_loader_state(state_file, dfpop, national_csv, state_csv, hashes)[-1] is False
+
+    # no rows appended, but the recorded size and hash no longer match the file
+    with open(state_csv, 'a') as fp:
+        fp.write('\n')
+    hashes = scriptv2.source_hashes(csvs)
+    assert scriptv2.load_loader_state(state_file, dfpop, national_csv, state_csv, hashes)[-1] is True
+
+
+def test_counts_keep_state_dtypes():
+    dfvn = pd.DataFrame({'date': ['2021-06-01'], 'cumul': pd.array([5], dtype='int64'),
+                         'date_dt': pd.to_datetime(['2021-06-01'])})
+    # every region member, regions are summed from them
+    states = [state_name for region in scriptv2.REGIONS.values() for state_name in region['members']]
+    dfvs = pd.DataFrame({'date': ['2021-06-01'] * len(states), 'state': pd.Categorical(states),
+                         'cumul': pd.array([2, 2, 1] + [0] * (len(states) - 3), dtype='int32'),
+                         'date_dt': pd.to_datetime(['2021-06-01'] * len(states))})
+    combined = scriptv2.combine_national_state(dfvn, dfvs)
+    assert combined['cumul'].dtype == 'int32'
+    assert isinstance(combined.index.get_level_values('state').dtype, pd.CategoricalDtype)
+    assert combined.loc[(pd.Timestamp('2021-06-01'), 'Malaysia'), 'cumul'] == 5
+    assert combined.loc[(pd.Timestamp('2021-06-01'), 'Klang Valley'), 'cumul'] == 5
+
+    # national sums that don't fit the state dtype stay int64
+    dfvn['cumul'] = pd.array([2**40], dtype='int64')
+    assert scriptv2.combine_national_state(dfvn, dfvs.copy())['cumul'].dtype == 'int64'
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from scriptv2 import clamp_bar_segments
+
+
+def test_bars_within_100_are_unchanged():
+    bars = [[0.5, 0.2, 0.1, 0.2], [0.3, 0.1, 0.1, 0.1]]
+    clamped, is_adjusted = clamp_bar_segments(bars)
+    assert np.array_equal(clamped, bars)
+    assert not is_adjusted.any()
+
+
+def test_excess_carried_from_unreg_down_to_full():
+    # excess 0.3: unreg 0.1 and reg 0.15 go to zero, the rest comes off partial
+    clamped, is_adjusted = clamp_bar_segments([0.75, 0.3, 0.15, 0.1])
+    assert clamped == pytest.approx([0.75, 0.25, 0.0, 0.0])
+    assert clamped.sum() == pytest.approx(1.0)
+    assert bool(is_adjusted)
+
+
+def test_zero_segments_are_skipped():
+    clamped, is_adjusted = clamp_bar_segments([[0.9, 0.2, 0.0, 0.0], [0.6, 0.3, 0.2, 0.0]])
+    assert clamped == pytest.approx(np.array([[0.9, 0.1, 0.0, 0.0], [0.6, 0.3, 0.1, 0.0]]))
+    assert is_adjusted.tolist() == [True, True]
+
+
+def test_progress_rule_cuts_last_non_zero_of_reg_and_unreg_only():
+    # progress shares: excess off unreg if not zero, else off reg, never carried on
+    bars = [[0.7, 0.2, 0.1, 0.15], [0.7, 0.2, 0.15, 0.0], [0.9, 0.2, 0.0, 0.0], [0.7, 0.3, 0.05, 0.02]]
+    clamped, is_adjusted = clamp_bar_segments(bars, n_cut=2, carry=False)
+    assert clamped == pytest.approx(np.array([[0.7, 0.2, 0.1, 0.0],
+                                              [0.7, 0.2, 0.1, 0.0],
+                                              [0.9, 0.2, 0.0, 0.0],
+                                              [0.7, 0.3, 0.05, 0.0]]))
+    assert is_adjusted.tolist() == [True, True, False, True]
+
+
+def test_input_is_not_modified():
+    bars = np.array([[0.8, 0.3, 0.1, 0.1]])
+    clamp_bar_segments(bars)
+    assert bars.tolist() == [[0.8, 0.3, 0.1, 0.1]]
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from scriptv2 import MILESTONE_TARGETS, PFSN_DOSE_INT, AZ_DOSE_INT, project_days_to_targets
+
+
+def reference_days_to_target(target_pct, target_pop, pfsn_vax_rate, az_vax_rate, current_vax_total,
+                             pfsn_dose2_list, az_dose2_list):
+    """Per state loop `project_days_to_targets` replaced, kept as the reference it must match"""
+    target_pop = target_pop*target_pct
+    az_dose2_list_21 = az_dose2_list[:PFSN_DOSE_INT]
+    az_dose2_list_beyond_21 = az_dose2_list[PFSN_DOSE_INT:]
+
+    remaining = 0
+    days_remaining = 0
+    days_remaining_21d_after = 0
+    projected_sum_21d = current_vax_total + sum(pfsn_dose2_list) + sum(az_dose2_list_21)
+    days_remaining_21d = 0
+    if projected_sum_21d < target_pop:
+        days_remaining_21d = PFSN_DOSE_INT
+        current_vax_total = projected_sum_21d
+        remaining = target_pop - current_vax_total
+    else:
+        for i in range(PFSN_DOSE_INT):
+            current_vax_total = current_vax_total + pfsn_dose2_list[i] + az_dose2_list[i]
+            if current_vax_total > target_pop:
+                break
+            else:
+                remaining = target_pop - current_vax_total
+            days_remaining_21d += 1
+
+    if remaining > 0:
+        projected_sum_63d = current_vax_total + sum(az_dose2_list_beyond_21) + \
+            (pfsn_vax_rate*(AZ_DOSE_INT-PFSN_DOSE_INT))
+        days_remaining_21d_after = 0
+        if projected_sum_63d < target_pop:
+            days_remaining_21d_after = AZ_DOSE_INT-PFSN_DOSE_INT
+            current_vax_total = projected_sum_63d
+            remaining = target_pop - current_vax_total
+            if remaining > 0:
+                # numpy floats, so a zero rate gives inf like the batched form
+                days_remaining = np.float64(remaining)/(pfsn_vax_rate + az_vax_rate)
+        else:
+            for i in range(AZ_DOSE_INT-PFSN_DOSE_INT):
+                current_vax_total = current_vax_total + pfsn_vax_rate + az_dose2_list_beyond_21[i]
+                if current_vax_total > target_pop:
+                    break
+                else:
+                    remaining = target_pop - current_vax_total
+                days_remaining_21d_after += 1
+
+    return days_remaining+days_remaining_21d+days_remaining_21d_after
+
+
+def random_states(rng, n_states):
+    """Rates, totals and pending dose 2 spread from far off every target to past all of them"""
+    target_pops = rng.integers(50_000, 5_000_000, n_states).astype(float)
+    current_vax_totals = target_pops * rng.uniform(0, 1.05, n_states)
+    pfsn_vax_rates = target_pops * rng.uniform(0, 0.01, n_states)
+    az_vax_rates = target_pops * rng.uniform(0, 0.002, n_states)
+    # some states with no doses in the rate window
+    no_rate = rng.random(n_states) < 0.15
+    pfsn_vax_rates[no_rate], az_vax_rates[no_rate] = 0, 0
+    pfsn_dose2 = target_pops[:, None] * rng.uniform(0, 0.004, (n_states, PFSN_DOSE_INT))
+    az_dose2 = target_pops[:, None] * rng.uniform(0, 0.001, (n_states, AZ_DOSE_INT))
+    return target_pops, pfsn_vax_rates, az_vax_rates, current_vax_totals, pfsn_dose2, az_dose2
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batched_projection_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    target_pops, pfsn_rates, az_rates, totals, pfsn_dose2, az_dose2 = random_states(rng, 400)
+    with np.errstate(divide='ignore'):
+        batched = project_days_to_targets(MILESTONE_TARGETS, target_pops, pfsn_rates, az_rates, totals,
+                                          pfsn_dose2, az_dose2)
+    with np.errstate(divide='ignore'):
+        expected = np.array([[reference_days_to_target(target, target_pops[s], pfsn_rates[s], az_rates[s], totals[s],
+                                                       list(pfsn_dose2[s]), list(az_dose2[s]))
+                              for target in MILESTONE_TARGETS] for s in range(len(target_pops))])
+    np.testing.assert_array_equal(batched, expected)
+
+
+def test_zero_rate_and_already_hit():
+    target_pops = np.array([1000.0, 1000.0, 1000.0])
+    totals = np.array([100.0, 1000.0, 100.0])  # far off, every target already hit, crossed while dose 2 are given
+    pfsn_dose2 = np.zeros((3, PFSN_DOSE_INT))
+    pfsn_dose2[2] = 50
+    az_dose2 = np.zeros((3, AZ_DOSE_INT))
+    with np.errstate(divide='ignore'):
+        days = project_days_to_targets([0.5, 0.9], target_pops, [0, 0, 0], [0, 0, 0], totals, pfsn_dose2, az_dose2)
+    assert np.isinf(days[0]).all()
+    assert (days[1] == 0).all()
+    # 100 + 50 a day is not above 500 until 9 days on, nor above 900 until 17 days on
+    np.testing.assert_array_equal(days[2], [8, 16])
+    with np.errstate(divide='ignore'):
+        for s in range(3):
+            for t_idx, target in enumerate([0.5, 0.9]):
+                assert days[s, t_idx] == reference_days_to_target(target, target_pops[s], 0, 0, totals[s],
+                                                                  list(pfsn_dose2[s]), list(az_dose2[s]))
+
+
+def test_exact_ties_match_loop():
+    # running totals landing exactly on the target, the loop only counts a crossing above it
+    target_pops = np.full(4, 1000.0)
+    totals = np.array([400.0, 500.0, 0.0, 450.0])
+    pfsn_dose2 = np.full((4, PFSN_DOSE_INT), 25.0)
+    az_dose2 = np.full((4, AZ_DOSE_INT), 0.0)
+    batched = project_days_to_targets([0.5, 0.8], target_pops, [25.0] * 4, [5.0] * 4, totals, pfsn_dose2, az_dose2)
+    for s in range(4):
+        for t_idx, target in enumerate([0.5, 0.8]):
+            assert batched[s, t_idx] == reference_days_to_target(target, target_pops[s], 25.0, 5.0, totals[s],
+                                                                 list(pfsn_dose2[s]), list(az_dose2[s]))
@@ -0,0 +1,40 @@
+import asyncio
+import pytest
+
+import refresh
+
+
+@pytest.fixture
+def git_calls(monkeypatch):
+    """git commands push_export runs, nothing is executed; `diff --cached` reports staged changes"""
+    calls = []
+
+    async def run_git(repo_path, *git_args, check=True):
+        calls.append(list(git_args))
+        return 1 if git_args[0] == 'diff' else 0
+
+    monkeypatch.setattr(refresh, 'run_git', run_git)
+    return calls
+
+
+@pytest.mark.parametrize('sharded, staged', [
+    (False, ['/data/data3.json', '/data/data3.bin']),
+    (True, ['/data/data3.json', '/data/data3.bin', '/data/index.json', '/data/by_state']),
+])
+def test_push_export_stages(git_calls, sharded, staged):
+    # DATA_EXPORT_PATH is a str
+    assert asyncio.run(refresh.push_export('/repo', '/data/data3.json', sharded))
+    assert git_calls[0] == ['add', *staged]
+    assert [call[0] for call in git_calls] == ['add', 'diff', 'commit', 'push']
+
+
+def test_push_retry_does_not_commit_again(monkeypatch):
+    calls = []
+
+    async def run_git(repo_path, *git_args, check=True):
+        calls.append(git_args[0])
+        return 0  # nothing staged, the last commit was not pushed
+
+    monkeypatch.setattr(refresh, 'run_git', run_git)
+    assert asyncio.run(refresh.push_export('/repo', refresh.DATA_EXPORT_PATH))
+    assert calls == ['add', 'diff', 'push']
@@ -0,0 +1,34 @@
+import json
+import pandas as pd
+import pytest
+
+import timeseries
+from serve import timeseries_view
+
+
+@pytest.fixture
+def store(tmp_path):
+    index = pd.MultiIndex.from_product([pd.date_range('2021-06-01', periods=10), ['Johor', 'Kedah']],
+                                       names=['date_dt', 'state'])
+    dfvs = pd.DataFrame({'daily': range(20), 'cumul': range(0, 200, 10)}, index=index)
+    timeseries.build_store(tmp_path, 'test', {'vax': dfvs}, {'Johor': 'jhr', 'Kedah': 'kdh'})
+    return timeseries.open_store(tmp_path)
+
+
+def test_points(store):
+    view = timeseries_view(store, 'columns=daily&states=jhr&points=3')
+    dates = json.loads(view['identity'])['Johor']['daily']['date']
+    assert len(dates) == 3 and dates[0] == '2021-06-01' and dates[-1] == '2021-06-10'
+
+
+@pytest.mark.parametrize('points', ['0', '-1', '1.5', 'abc'])
+def test_bad_points(store, points):
+    with pytest.raises(ValueError, match='points'):
+        timeseries_view(store, f'points={points}')
+
+
+def test_bad_parameters(store):
+    with pytest.raises(ValueError):
+        timeseries_view(store, 'columns=daily&limit=5')
+    with pytest.raises(KeyError):
+        timeseries_view(store, 'states=xyz')
@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+
+import timeseries
+
+
+def test_open_store_without_build(tmp_path):
+    with pytest.raises(FileNotFoundError, match='no time-series store'):
+        timeseries.open_store(tmp_path)
+    assert timeseries.main(['--store', str(tmp_path)]) == 1
+
+
+def test_missing_days_left_out(tmp_path):
+    # Kedah has no row on the second day
+    index = pd.MultiIndex.from_tuples([(pd.Timestamp('2021-06-01'), 'Johor'), (pd.Timestamp('2021-06-01'), 'Kedah'),
+                                       (pd.Timestamp('2021-06-02'), 'Johor'), (pd.Timestamp('2021-06-03'), 'Johor'),
+                                       (pd.Timestamp('2021-06-03'), 'Kedah')], names=['date_dt', 'state'])
+    dfvs = pd.DataFrame({'daily': [1, 2, 3, 4, 5], 'cumul': [1, 2, 4, 8, 7]}, index=index)
+    timeseries.build_store(tmp_path, 'test', {'vax': dfvs}, {'Johor': 'jhr', 'Kedah': 'kdh'})
+    store = timeseries.open_store(tmp_path)
+    assert store['key'] == 'test'
+    result = timeseries.query(store, columns=['daily', 'cumul'], states=['kdh'])
+    assert result['Kedah']['daily'] == {'date': ['2021-06-01', '2021-06-03'], 'value': [2, 5]}
+    weekly = timeseries.query(store, columns=['daily', 'cumul'], freq='W')
+    assert weekly['Johor']['daily']['value'] == [1 + 3 + 4]
+    assert weekly['Kedah']['cumul']['value'] == [7]
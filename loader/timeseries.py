@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import numpy as np
+from pathlib import Path
+
+from compact import int_dtype
+from sources import ROOT_PATH
+
+
+# daily vax and reg columns of every state and region, one (days x states) array per column
+TIMESERIES_PATH = ROOT_PATH / 'vaxapp-prod' / 'loader' / 'timeseries'
+TIMESERIES_VERSION = 1
+FREQS = ['W', 'M']  # weeks from monday, calendar months
+
+# columns that are running totals, downsampled to their last value instead of summed
+CUMULATIVE_PREFIXES = {'vax': ['cumul'], 'reg': ['']}
+
+
+def is_cumulative(dataset, col):
+    return any(col.startswith(prefix) for prefix in CUMULATIVE_PREFIXES.get(dataset, []))
+
+
+def current_key(store_path=TIMESERIES_PATH):
+    """Key of the store in `store_path`, None if there is none"""
+    try:
+        return json.loads((Path(store_path) / 'current.json').read_text())['key']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def build_store(store_path, key, frames, state_abbr):
+    """
+    Write (date_dt, state) frames by dataset, e.g. {'vax': dfvs, 'reg': dfrs}, as a time-series store
+    Every numeric column becomes one .npy array of (days x states) on a daily calendar shared by all
+    datasets, in the smallest int type that holds it or float64 if it has nan. Days a state has no row
+    are 0 and marked in a `present` array per dataset. Arrays go into a new `store_path/key` directory
+    and `current.json` is switched to it last, so readers see either the old or the new store.
+    """
+    store_path = Path(store_path)
+    entry_dir = store_path / key
+    tmp_dir = store_path / f'{key}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    calendar = np.arange(min(df.index.get_level_values('date_dt').min() for df in frames.values()).to_datetime64(),
+                         max(df.index.get_level_values('date_dt').max() for df in frames.values()).to_datetime64()
+                         + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+    states = sorted(set().union(*(df.index.get_level_values('state') for df in frames.values())))
+    meta = {'version': TIMESERIES_VERSION, 'key': key, 'start': str(calendar[0]), 'n_days': len(calendar),
+            'states': states, 'abbrs': [state_abbr.get(state_name, state_name) for state_name in states],
+            'datasets': {}, 'columns': {}}
+
+    for dataset, df in frames.items():
+        cols = [col for col in df.columns if df[col].dtype.kind in 'iuf']
+        days = calendar.astype('datetime64[ns]')
+        df_wide = df[cols].unstack('state')
+        present = df.assign(present=True)['present'].unstack('state', fill_value=False)
+        present = present.reindex(index=days, columns=states, fill_value=False).to_numpy(dtype=bool)
+        np.save(tmp_dir / f'{dataset}.present.npy', present)
+        meta['datasets'][dataset] = {'present': f'{dataset}.present.npy'}
+
+        for col in cols:
+            values = df_wide[col].reindex(index=days, columns=states).to_numpy(dtype=float)
+            has_nan = np.isnan(values[present]).any()
+            if has_nan:
+                dtype = '<f8'
+            else:
+                values = np.where(present, values, 0)
+                dtype = int_dtype([int(values.min()), int(values.max())])
+            np.save(tmp_dir / f'{dataset}.{col}.npy', values.astype(dtype))
+            meta['columns'][col] = {'dataset': dataset, 'file': f'{dataset}.{col}.npy', 'is_int': not has_nan,
+                                    'agg': 'last' if is_cumulative(dataset, col) else 'sum'}
+
+    with open(tmp_dir / 'meta.json', 'w') as fp:
+        json.dump(meta, fp)
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+    tmp_current = store_path / 'current.json.tmp'
+    tmp_current.write_text(json.dumps({'key': key}))
+    os.replace(tmp_current, store_path / 'current.json')
+    # mapped arrays of readers of old stores stay valid after unlinking
+    for old_dir in store_path.iterdir():
+        if old_dir.is_dir() and old_dir != entry_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def open_store(store_path=TIMESERIES_PATH):
+    """
+    Current store with its arrays memory-mapped read-only, queries on it do no parsing
+    Raises FileNotFoundError if no store was built in `store_path` yet
+    """
+    key = current_key(store_path)
+    if key is None:
+        raise FileNotFoundError(f'no time-series store built in {store_path}, run a build first')
+    entry_dir = Path(store_path) / key
+    with open(entry_dir / 'meta.json') as fp:
+        meta = json.load(fp)
+    if meta['version'] != TIMESERIES_VERSION:
+        raise ValueError(f"time-series store version {meta['version']}, can read {TIMESERIES_VERSION}")
+    return {
+        'key': meta['key'],
+        'calendar': np.datetime64(meta['start'], 'D') + np.arange(meta['n_days']),
+        'states': meta['states'],
+        'state_idx': {**{abbr: s_idx for s_idx, abbr in enumerate(meta['abbrs'])},
+                      **{state_name: s_idx for s_idx, state_name in enumerate(meta['states'])}},
+        'columns': meta['columns'],
+        'values': {col: np.load(entry_dir / item['file'], mmap_mode='r') for col, item in meta['columns'].items()},
+        'present': {dataset: np.load(entry_dir / item['present'], mmap_mode='r')
+                    for dataset, item in meta['datasets'].items()},
+    }
+
+
+def period_starts(dates, freq):
+    """Indices where a new week or month starts in sorted daily `dates`, and the start of each period"""
+    if freq == 'M':
+        periods = dates.astype('datetime64[M]').astype('datetime64[D]')
+    else:
+        # day 0 of datetime64 is a thursday
+        periods = dates - (dates.astype(int) + 3) % 7
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    return starts, periods[starts]
+
+
+def downsample(values, present, starts, agg):
+    """(days x states) values to one row per period from `starts`: sum or last value, nan without rows"""
+    has_row = np.logical_or.reduceat(present, starts, axis=0)
+    if agg == 'sum':
+        sums = np.add.reduceat(np.where(present, np.nan_to_num(values), 0), starts, axis=0)
+        return np.where(has_row, sums, np.nan)
+    last_idx = np.maximum.reduceat(np.where(present, np.arange(len(values))[:, None], -1), starts, axis=0)
+    return np.where(has_row, np.take_along_axis(values, np.maximum(last_idx, 0), axis=0), np.nan)
+
+
+def lttb(x, y, n_points):
+    """
+    Largest-Triangle-Three-Buckets: indices of `n_points` of series (x, y) that keep its visual shape
+    First and last points are kept, every bucket in between contributes the point forming the largest
+    triangle with the point kept before it and the mean of the next bucket
+    """
+    if n_points >= len(x):
+        return np.arange(len(x))
+    if n_points < 3:
+        return np.array([0, len(x) - 1][:max(n_points, 0)], dtype=int)
+    edges = np.linspace(1, len(x) - 1, n_points - 1).astype(int)
+    kept = [0]
+    for bucket_idx in range(n_points - 2):
+        lo, hi = edges[bucket_idx], edges[bucket_idx + 1]
+        next_hi = edges[bucket_idx + 2] if bucket_idx + 2 < len(edges) else len(x)
+        next_x, next_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        prev_x, prev_y = x[kept[-1]], y[kept[-1]]
+        areas = np.abs((prev_x - next_x) * (y[lo:hi] - prev_y) - (prev_x - x[lo:hi]) * (next_y - prev_y))
+        kept.append(lo + int(areas.argmax()))
+    kept.append(len(x) - 1)
+    return np.array(kept)
+
+
+def query(store, start=None, end=None, columns=None, states=None, freq=None, n_points=None):
+    """
+    Series of `columns` for `states` (names or abbreviations) between `start` and `end` (inclusive,
+    YYYY-MM-DD), all of them if not given. `freq` 'W' or 'M' downsamples to weekly or monthly sums,
+    last values for running totals. `n_points` thins every series to that many points with LTTB,
+    after `freq` if both are given. Days a state has no row are left out.
+    Returns {state name: {column: {'date': [YYYY-MM-DD], 'value': [...]}}}, ready for JSON
+    """
+    calendar = store['calendar']
+    columns = list(store['columns']) if columns is None else columns
+    for state in states or []:
+        if state not in store['state_idx']:
+            raise KeyError(f'no state {state}')
+    for col in columns:
+        if col not in store['columns']:
+            raise KeyError(f'no column {col}')
+    s_idx = np.arange(len(store['states'])) if states is None else [store['state_idx'][state] for state in states]
+    if freq is not None and freq not in FREQS:
+        raise ValueError(f'freq must be one of {FREQS}')
+    if n_points is not None and n_points < 1:
+        raise ValueError('n_points must be at least 1')
+
+    lo = np.searchsorted(calendar, np.datetime64(start, 'D')) if start else 0
+    hi = np.searchsorted(calendar, np.datetime64(end, 'D'), side='right') if end else len(calendar)
+    dates = calendar[lo:hi]
+    if freq is not None and len(dates):
+        starts, dates = period_starts(dates, freq)
+
+    result = {store['states'][idx]: {} for idx in s_idx}
+    for col in columns:
+        item = store['columns'][col]
+        # only the requested rows and states are read from the mapped arrays
+        values = store['values'][col][lo:hi][:, s_idx].astype(float)
+        present = store['present'][item['dataset']][lo:hi][:, s_idx]
+        if freq is not None and len(values):
+            values = downsample(values, present, starts, item['agg'])
+            present = ~np.isnan(values)
+        for idx, state_values, state_present in zip(s_idx, values.T, present.T):
+            series_dates, series_values = dates[state_present], state_values[state_present]
+            if n_points is not None:
+                kept = lttb(series_dates.astype(float), series_values, n_points)
+                series_dates, series_values = series_dates[kept], series_values[kept]
+            result[store['states'][idx]][col] = {
+                'date': np.datetime_as_string(series_dates).tolist(),
+                'value': (series_values.astype(np.int64) if item['is_int'] else series_values).tolist(),
+            }
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Query the daily vax and reg time-series store')
+    parser.add_argument('--start', default=None, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', default=None, help='last date, YYYY-MM-DD')
+    parser.add_argument('--columns', nargs='+', default=None)
+    parser.add_argument('--states', nargs='+', default=None, help='state names or abbreviations')
+    parser.add_argument('--freq', default=None, choices=FREQS, help='weekly or monthly sums, last value of running totals')
+    parser.add_argument('--points', dest='n_points', type=int, default=None, help='LTTB downsample every series')
+    parser.add_argument('--store', default=TIMESERIES_PATH)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        store = open_store(args.store)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+    json.dump(query(store, args.start, args.end, args.columns, args.states, args.freq, args.n_points), sys.stdout)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+// Next.js API route: by_state payload of one state from the sharded export, e.g. /api/state/JHR
+import { getIndexData, getStateData } from "../../../lib/data";
+
+export default async function state(req, res) {
+  const { abbr } = req.query;
+  // only abbreviations listed in index.json, so the path can't leave data/by_state
+  const shards = Object.values(getIndexData().shards);
+  if (!shards.includes(`by_state/${abbr}.json`)) {
+    res.status(404).json({ error: `no state ${abbr}` });
+    return;
+  }
+  res.status(200).json(getStateData(abbr));
+}